@@ -0,0 +1,82 @@
+#  Copyright (c) 2024. American Printing House for the Blind.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+"""Compare writing bundle entries serially with ZipFile against compressing them in threads.
+
+Run with: python benchmarks/bundler_compression.py [--volumes N] [--volume-size MB] [--pdfs N]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED
+
+from brf2ebrl.utils.zip import ParallelZipWriter
+
+
+def _create_entries(volumes: int, volume_size: int, pdfs: int) -> list[tuple[str, bytes]]:
+    rng = random.Random(0)
+    words = ["".join(chr(0x2800 + rng.randrange(64)) for _ in range(rng.randrange(1, 9))) for _ in range(2000)]
+    entries = []
+    for i in range(volumes):
+        text = []
+        size = 0
+        while size < volume_size:
+            paragraph = "<p>" + " ".join(rng.choices(words, k=60)) + "</p>\n"
+            text.append(paragraph)
+            size += len(paragraph) * 3
+        entries.append((f"ebraille/vol{i}.html", "".join(text).encode("utf-8")))
+    # Split PDF pages are mostly already compressed streams.
+    entries.extend((f"ebraille/images/page{i}.pdf", rng.randbytes(200_000)) for i in range(pdfs))
+    return entries
+
+
+def _write_serial(path: str, entries: list[tuple[str, bytes]]):
+    with ZipFile(path, "w", compression=ZIP_DEFLATED) as zip_file:
+        for name, data in entries:
+            zip_file.writestr(name, data)
+
+
+def _write_parallel(path: str, entries: list[tuple[str, bytes]], workers: int | None):
+    with ZipFile(path, "w", compression=ZIP_DEFLATED) as zip_file:
+        writer = ParallelZipWriter(zip_file, max_workers=workers)
+        for name, data in entries:
+            zinfo = ZipInfo(name)
+            zinfo.compress_type = ZIP_DEFLATED
+            writer.write(zinfo, data)
+        writer.close()
+
+
+def _time(name: str, write, path: str, repeat: int):
+    best = min(_timed(write, path) for _ in range(repeat))
+    print(f"{name:<24} {best:8.3f}s {os.path.getsize(path) / 1e6:10.2f}MB")
+
+
+def _timed(write, path: str) -> float:
+    start = time.perf_counter()
+    write(path)
+    return time.perf_counter() - start
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--volumes", type=int, default=8)
+    arg_parser.add_argument("--volume-size", type=float, default=4, help="Size of each volume in MB")
+    arg_parser.add_argument("--pdfs", type=int, default=200)
+    arg_parser.add_argument("--repeat", type=int, default=3)
+    args = arg_parser.parse_args()
+    entries = _create_entries(args.volumes, int(args.volume_size * 1e6), args.pdfs)
+    print(f"{len(entries)} entries, {sum(len(d) for _, d in entries) / 1e6:.2f}MB, {os.cpu_count()} CPUs")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "bench.zip")
+        _time("serial ZipFile.writestr", lambda p: _write_serial(p, entries), path, args.repeat)
+        for workers in (1, 2, 4, None):
+            _time(f"parallel workers={workers or os.cpu_count()}", lambda p: _write_parallel(p, entries, workers),
+                  path, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+#  Copyright (c) 2024. American Printing House for the Blind.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+"""Report the time and size of bundling a sample book with different compression policies.
+
+Run with: python benchmarks/compression_policy.py [--volumes N] [--volume-size MB] [--pdfs N]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from bundler_compression import _create_entries
+from brf2ebrl.plugin import EBrlZippedBundler, CompressionPolicy
+from brf2ebrl.utils.ebrl import VolumeNavigation
+
+_POLICIES = [
+    ("deflate everything", CompressionPolicy(stored_media_types=frozenset())),
+    ("default level 6", CompressionPolicy()),
+    ("level 1", CompressionPolicy(level=1)),
+    ("level 9", CompressionPolicy(level=9)),
+]
+
+
+def _bundle(path: str, entries: list[tuple[str, str]], policy: CompressionPolicy) -> float:
+    start = time.perf_counter()
+    with EBrlZippedBundler(path, compression_policy=policy) as bundler:
+        for name, file_name in entries:
+            if name.endswith(".html"):
+                with open(file_name, encoding="utf-8") as f:
+                    # Giving the navigation means only the compression is measured, not finding headings.
+                    bundler.write_volume(os.path.basename(name), f"<html><body>{f.read()}</body></html>")
+                    bundler.add_volume_navigation(os.path.basename(name), VolumeNavigation(title=""))
+            else:
+                bundler.write_image(name.removeprefix("ebraille/"), file_name)
+    return time.perf_counter() - start
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    arg_parser.add_argument("--volumes", type=int, default=4)
+    arg_parser.add_argument("--volume-size", type=float, default=4, help="Size of each volume in MB")
+    arg_parser.add_argument("--pdfs", type=int, default=300)
+    arg_parser.add_argument("--repeat", type=int, default=3)
+    args = arg_parser.parse_args()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        entries = []
+        for i, (name, data) in enumerate(_create_entries(args.volumes, int(args.volume_size * 1e6), args.pdfs)):
+            file_name = os.path.join(temp_dir, f"entry{i}")
+            with open(file_name, "wb") as f:
+                f.write(data)
+            entries.append((name, file_name))
+        path = os.path.join(temp_dir, "bench.ebrl")
+        print(f"{'policy':<20} {'time':>9} {'size':>10}")
+        for name, policy in _POLICIES:
+            best = min(_bundle(path, entries, policy) for _ in range(args.repeat))
+            print(f"{name:<20} {best:8.3f}s {os.path.getsize(path) / 1e6:8.2f}MB")
+
+
+if __name__ == "__main__":
+    main()
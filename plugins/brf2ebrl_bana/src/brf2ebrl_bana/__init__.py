@@ -4,7 +4,6 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 """BANA specific components for processing BRF."""
-import string
 from typing import Sequence
 
 from brf2ebrl.common import PageLayout
@@ -13,14 +12,14 @@ from brf2ebrl.common.block_detectors import create_centered_detector, create_cel
     create_list_detector,create_toc_detector, bp_indicators_block_matcher 
 from brf2ebrl.common.box_line_detectors import remove_box_lines_processing_instructions, tag_boxlines
 from brf2ebrl.common.detectors import detect_and_pass_processing_instructions, \
-    create_running_head_detector, braille_page_counter_detector, xhtml_fixup_detector, \
-    translate_ascii_to_unicode_braille, combine_detectors, convert_blank_lines_to_processing_instructions
+    create_running_head_detector, braille_page_counter_detector, XHTML_FIXUP_PARSER, \
+    INGEST_BRF_PARSER, combine_detectors, convert_blank_lines_to_processing_instructions
 from brf2ebrl.common.emphasis_detectors import tag_emphasis
-from brf2ebrl.common.graphic_detectors import create_pdf_graphic_detector
+from brf2ebrl.common.graphic_detectors import create_pdf_graphic_detector, GraphicsSession
 from brf2ebrl.common.page_numbers import create_ebrf_print_page_tags
-from brf2ebrl.common.selectors import most_confident_detector
-from brf2ebrl.parser import detector_parser, Parser
-from brf2ebrl.plugin import create_plugin
+from brf2ebrl.common.selectors import early_exit_most_confident_fragment
+from brf2ebrl.parser import fragment_parser, Parser, replace_parser
+from brf2ebrl.plugin import create_plugin, package_version
 from brf2ebrl_bana.pages import create_braille_page_detector, \
     create_print_page_detector
 from brf2ebrl_bana.tn_detectors import tn_indicators_block_matcher, \
@@ -33,27 +32,17 @@ def create_brf2ebrl_parser(
         output_path: str = "",
         images_path: str = "",
         detect_running_heads: bool = True,
+        graphics_session: GraphicsSession | None = None,
         *args,
         **kwargs
 ) -> Sequence[Parser]:
     return [
         x
         for x in [
-            Parser(
-                "Ensure only valid BRF ASCII, eg. control characters",
-                lambda x,_: "".join(c for c in x if c in string.printable)
-            ),
-            Parser(
-                "Transform to uppercase ASCII",
-                lambda x,_: x.upper()
-            ),
-            # Convert to Unicode pass
-            Parser(
-                "Convert to unicode Braille",
-                translate_ascii_to_unicode_braille
-            ),
+            # Keep valid BRF ASCII, make uppercase and convert to Unicode pass
+            INGEST_BRF_PARSER,
             # Detect Braille pages pass
-            detector_parser(
+            fragment_parser(
                 "Detect Braille pages",
                 {"start_braille_page": True, "page_count": 1},
                 [
@@ -64,9 +53,9 @@ def create_brf2ebrl_parser(
                     ),
                     detect_and_pass_processing_instructions,
                 ],
-                most_confident_detector,
+                early_exit_most_confident_fragment,
             ),
-            detector_parser(
+            fragment_parser(
                 "Detect print pages",
                 {"page_count": 1},
                 [
@@ -75,17 +64,17 @@ def create_brf2ebrl_parser(
                     ),
                     detect_and_pass_processing_instructions,
                 ],
-                most_confident_detector,
+                early_exit_most_confident_fragment,
             ),
             # Running head pass
-            detector_parser(
+            fragment_parser(
                 "Detect running head",
                 {},
                 [
                     combine_detectors([braille_page_counter_detector, create_running_head_detector(3)]),
                     detect_and_pass_processing_instructions,
                 ],
-                most_confident_detector,
+                early_exit_most_confident_fragment,
             )
             if detect_running_heads
             else None,
@@ -105,7 +94,7 @@ def create_brf2ebrl_parser(
                 tag_boxlines
             ),
             # Detect blocks pass
-            detector_parser(
+            fragment_parser(
                 "Detect blocks",
                 {},
                 [
@@ -131,7 +120,7 @@ def create_brf2ebrl_parser(
                     detect_pre,
                     detect_and_pass_processing_instructions,
                 ],
-                most_confident_detector,
+                early_exit_most_confident_fragment,
             ),
             # remove box line processing instructions
             Parser(
@@ -152,26 +141,23 @@ def create_brf2ebrl_parser(
                 tag_emphasis
             ),
             # PDF Graphics
-            create_image_detection_parser_pass(brf_path, images_path, output_path, page_layout),
+            create_image_detection_parser_pass(brf_path, images_path, output_path, page_layout, graphics_session),
             # Convert print page numbers to ebrf tags
-            detector_parser(
+            fragment_parser(
                 "Print page numbers to ebrf",
                 {},
                 [create_ebrf_print_page_tags()],
-                most_confident_detector,
+                early_exit_most_confident_fragment,
             ),
             # Make complete HTML5 pass
-            Parser(
-                "Make complete XML",
-                xhtml_fixup_detector
-            ),
-            Parser(
+            XHTML_FIXUP_PARSER,
+            replace_parser(
                 "Make processing instructions comments, eBraille is HTML5 and so processing instructions not valid.",
-                lambda x,_: x.replace("<?", "<!--").replace("?>", "-->")
+                [("<?", "<!--"), ("?>", "-->")]
             ),
-            Parser(
+            replace_parser(
                 "Convert u+2800 to regular space as per ebraille standard",
-                lambda x,_: x.replace("\u2800", " ")
+                [("\u2800", " ")]
             )
         ]
         if x is not None
@@ -179,14 +165,18 @@ def create_brf2ebrl_parser(
 
 
 PLUGIN = create_plugin(plugin_id="BANA", name="Convert BANA BRF to eBraille", brf_parser_factory=create_brf2ebrl_parser,
-                       file_mapper=lambda input_file, index: f"vol{index}.html")
+                       file_mapper=lambda input_file, index: f"vol{index}.html",
+                       plugin_version=package_version("brf2ebrl-bana"))
 
 
-def create_image_detection_parser_pass(brf_path, images_path, output_path, page_layout: PageLayout) -> Parser | None:
-    if images_path and (image_detector := create_pdf_graphic_detector(brf_path, output_path, images_path, page_layout)):
+def create_image_detection_parser_pass(brf_path, images_path, output_path, page_layout: PageLayout,
+                                       graphics_session: GraphicsSession | None = None) -> Parser | None:
+    if images_path and (image_detector := create_pdf_graphic_detector(brf_path, output_path, images_path, page_layout,
+                                                                      graphics_session)):
         return Parser(
             "Convert PDF to single files and links",
-            image_detector
+            image_detector,
+            cacheable=False
         )
     else:
         return None
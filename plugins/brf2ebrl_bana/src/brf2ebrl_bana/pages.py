@@ -5,8 +5,8 @@ import re
 import string
 from typing import Callable
 
-from brf2ebrl.common import PageNumberPosition, PageLayout
-from brf2ebrl.parser import Detector, DetectionState, DetectionResult
+from brf2ebrl.common import PageNumberPosition, PageLayout, BRAILLE_CELLS
+from brf2ebrl.parser import Detector, DetectionState, DetectionResult, detector_hints
 
 _BRL_WHITESPACE = string.whitespace + "\u2800"
 
@@ -42,6 +42,12 @@ def _find_page_number(
     return page_content, ""
 
 
+def _find_page_end(text: str, cursor: int) -> int:
+    """Find the index of the form feed ending the page starting at cursor, or the end of text."""
+    page_end = text.find("\f", cursor)
+    return page_end if page_end >= 0 else len(text)
+
+
 def _create_braille_page_command(page_content: str, page_num: str) -> str:
     number_data = {"Number": page_num} if page_num else {}
     page_cmd = json.dumps({"BraillePage": number_data})
@@ -58,13 +64,19 @@ def create_braille_page_detector(
     braille_page_number_pattern = re.compile(
         "[\u280f\u281e]?\u283c[\u2801\u2803\u2809\u2819\u2811\u280b\u281b\u2813\u280a\u281a]+")
 
+    def next_braille_page(text: str, cursor: int, state: DetectionState) -> int:
+        if state.get("start_braille_page", False):
+            return cursor + 1
+        return _find_page_end(text, cursor + 1)
+
+    @detector_hints(max_confidence=1.0, next_match=next_braille_page)
     def detect_braille_page_number(
-            text: str, cursor: int, state: DetectionState, output_text: str
+            text: str, cursor: int, state: DetectionState, output_text: str = ""
     ) -> DetectionResult | None:
         page_count = state.get("page_count", 1)
         if state.get("start_braille_page", False):
-            page_content = text[cursor:].split("\f")[0]
-            new_cursor = cursor + len(page_content)
+            new_cursor = _find_page_end(text, cursor)
+            page_content = text[cursor:new_cursor]
             page_content, page_num = _find_page_number(
                 page_content,
                 page_layout.odd_braille_page_number if page_count % 2 else page_layout.even_braille_page_number,
@@ -116,12 +128,13 @@ def _is_print_page_number_line(line: str) -> str | None:
 def create_print_page_detector(page_layout: PageLayout, separator: str = "\u2800" * 3) -> Detector:
     """Create a detector for print page numbers."""
 
+    @detector_hints(first_chars=BRAILLE_CELLS, max_confidence=0.9)
     def detect_print_page_number(text: str, cursor: int, state: DetectionState,
-                                 output_text: str) -> DetectionResult | None:
+                                 output_text: str = "") -> DetectionResult | None:
         page_count = state.get("page_count", 1)
         if ord(text[cursor]) in range(0x2800, 0x2900):
-            page_content = text[cursor:].partition("\f")[0]
-            new_cursor = cursor + len(page_content)
+            new_cursor = _find_page_end(text, cursor)
+            page_content = text[cursor:new_cursor]
             page_content, page_num = _find_page_number(page_content,
                                                        page_layout.odd_print_page_number if page_count % 2 else page_layout.even_print_page_number,
                                                        page_layout.cells_per_line, page_layout.lines_per_page,
@@ -46,6 +46,19 @@ _TN_HEADING_LIST_SEP_RE = re.compile("((<\\?blank-line\\?>)|\\s)*")
 _TN_LIST_START_RE = re.compile("<ul")
 
 
+def _braille_ends_with(text: str, start: int, end: int, suffix: str) -> bool:
+    """Check whether the non-blank Braille cells of text[start:end] end with suffix."""
+    remaining = len(suffix)
+    index = end
+    while remaining and index > start:
+        index -= 1
+        if "\u2800" < (c := text[index]) <= "\u28ff":
+            remaining -= 1
+            if c != suffix[remaining]:
+                return False
+    return not remaining
+
+
 def tag_symbols_list_tn(text: str, parser_context: ParserContext = ParserContext(), *, cursor: int = 0) -> str:
     new_text = ""
     start = cursor
@@ -59,8 +72,7 @@ def tag_symbols_list_tn(text: str, parser_context: ParserContext = ParserContext
                 list_start = m.end()
                 if _TN_LIST_START_RE.match(text, list_start):
                     list_end = find_end_of_element(text, list_start)
-                    if list_end >= 0 and "".join(
-                            c for c in text[cursor:list_end] if "\u2800" < c <= "\u28ff").endswith(_END_TN_SYMBOL):
+                    if list_end >= 0 and _braille_ends_with(text, cursor, list_end, _END_TN_SYMBOL):
                         new_text = f"{new_text}{text[start:position]}{_START_TN_BLOCK}{text[position:list_end]}{_END_TN_BLOCK}"
                         start = list_end
                         continue
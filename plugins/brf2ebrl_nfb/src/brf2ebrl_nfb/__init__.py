@@ -4,22 +4,21 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 """NFB specific parser"""
-import string
 from typing import Sequence
 
 from brf2ebrl import PageLayout
 from brf2ebrl.common.block_detectors import create_centered_detector, create_cell_heading, create_paragraph_detector, \
     bp_indicators_block_matcher, create_toc_detector, create_list_detector, create_table_detector, detect_pre
 from brf2ebrl.common.box_line_detectors import tag_boxlines, remove_box_lines_processing_instructions
-from brf2ebrl.common.detectors import translate_ascii_to_unicode_braille, detect_and_pass_processing_instructions, \
+from brf2ebrl.common.detectors import INGEST_BRF_PARSER, detect_and_pass_processing_instructions, \
     combine_detectors, braille_page_counter_detector, create_running_head_detector, \
-    convert_blank_lines_to_processing_instructions, xhtml_fixup_detector
+    convert_blank_lines_to_processing_instructions, XHTML_FIXUP_PARSER
 from brf2ebrl.common.emphasis_detectors import tag_emphasis
-from brf2ebrl.common.graphic_detectors import create_pdf_graphic_detector
+from brf2ebrl.common.graphic_detectors import create_pdf_graphic_detector, GraphicsSession
 from brf2ebrl.common.page_numbers import create_ebrf_print_page_tags
-from brf2ebrl.common.selectors import most_confident_detector
-from brf2ebrl.parser import Parser, detector_parser
-from brf2ebrl.plugin import create_plugin
+from brf2ebrl.common.selectors import early_exit_most_confident_fragment
+from brf2ebrl.parser import Parser, fragment_parser, replace_parser
+from brf2ebrl.plugin import create_plugin, package_version
 from brf2ebrl_bana import create_braille_page_detector, create_print_page_detector, tn_indicators_block_matcher, \
     tag_inline_tn, tag_symbols_list_tn
 
@@ -30,27 +29,17 @@ def create_brf2ebrl_parser(
         output_path: str = "",
         images_path: str = "",
         detect_running_heads: bool = True,
+        graphics_session: GraphicsSession | None = None,
         *args,
         **kwargs
 ) -> Sequence[Parser]:
     return [
         x
         for x in [
-            Parser(
-                "Ensure only valid BRF ASCII, eg. control characters",
-                lambda x,_: "".join(c for c in x if c in string.printable)
-            ),
-            Parser(
-                "Transform to uppercase ASCII",
-                lambda x,_: x.upper()
-            ),
-            # Convert to Unicode pass
-            Parser(
-                "Convert to unicode Braille",
-                translate_ascii_to_unicode_braille
-            ),
+            # Keep valid BRF ASCII, make uppercase and convert to Unicode pass
+            INGEST_BRF_PARSER,
             # Detect Braille pages pass
-            detector_parser(
+            fragment_parser(
                 "Detect Braille pages",
                 {"start_braille_page": True, "page_count": 1},
                 [
@@ -61,9 +50,9 @@ def create_brf2ebrl_parser(
                     ),
                     detect_and_pass_processing_instructions,
                 ],
-                most_confident_detector,
+                early_exit_most_confident_fragment,
             ),
-            detector_parser(
+            fragment_parser(
                 "Detect print pages",
                 {"page_count": 1},
                 [
@@ -72,17 +61,17 @@ def create_brf2ebrl_parser(
                     ),
                     detect_and_pass_processing_instructions,
                 ],
-                most_confident_detector,
+                early_exit_most_confident_fragment,
             ),
             # Running head pass
-            detector_parser(
+            fragment_parser(
                 "Detect running head",
                 {},
                 [
                     combine_detectors([braille_page_counter_detector, create_running_head_detector(3)]),
                     detect_and_pass_processing_instructions,
                 ],
-                most_confident_detector,
+                early_exit_most_confident_fragment,
             )
             if detect_running_heads
             else None,
@@ -102,7 +91,7 @@ def create_brf2ebrl_parser(
                 tag_boxlines
             ),
             # Detect blocks pass
-            detector_parser(
+            fragment_parser(
                 "Detect blocks",
                 {},
                 [
@@ -128,7 +117,7 @@ def create_brf2ebrl_parser(
                     detect_pre,
                     detect_and_pass_processing_instructions,
                 ],
-                most_confident_detector,
+                early_exit_most_confident_fragment,
             ),
             # remove box line processing instructions
             Parser(
@@ -149,26 +138,23 @@ def create_brf2ebrl_parser(
                 tag_emphasis
             ),
             # PDF Graphics
-            create_image_detection_parser_pass(brf_path, images_path, output_path, page_layout),
+            create_image_detection_parser_pass(brf_path, images_path, output_path, page_layout, graphics_session),
             # Convert print page numbers to ebrf tags
-            detector_parser(
+            fragment_parser(
                 "Print page numbers to ebrf",
                 {},
                 [create_ebrf_print_page_tags()],
-                most_confident_detector,
+                early_exit_most_confident_fragment,
             ),
             # Make complete HTML5 pass
-            Parser(
-                "Make complete XML",
-                xhtml_fixup_detector
-            ),
-            Parser(
+            XHTML_FIXUP_PARSER,
+            replace_parser(
                 "Make processing instructions comments, eBraille is HTML5 and so processing instructions not valid.",
-                lambda x,_: x.replace("<?", "<!--").replace("?>", "-->")
+                [("<?", "<!--"), ("?>", "-->")]
             ),
-            Parser(
+            replace_parser(
                 "Convert u+2800 to regular space as per ebraille standard",
-                lambda x,_: x.replace("\u2800", " ")
+                [("\u2800", " ")]
             )
         ]
         if x is not None
@@ -176,14 +162,18 @@ def create_brf2ebrl_parser(
 
 
 PLUGIN = create_plugin(plugin_id="NFB", name="Convert NFB BRF to eBraille", brf_parser_factory=create_brf2ebrl_parser,
-                       file_mapper=lambda input_file, index: f"vol{index}.html")
+                       file_mapper=lambda input_file, index: f"vol{index}.html",
+                       plugin_version=package_version("brf2ebrl-nfb"))
 
 
-def create_image_detection_parser_pass(brf_path, images_path, output_path, page_layout: PageLayout) -> Parser | None:
-    if images_path and (image_detector := create_pdf_graphic_detector(brf_path, output_path, images_path, page_layout)):
+def create_image_detection_parser_pass(brf_path, images_path, output_path, page_layout: PageLayout,
+                                       graphics_session: GraphicsSession | None = None) -> Parser | None:
+    if images_path and (image_detector := create_pdf_graphic_detector(brf_path, output_path, images_path, page_layout,
+                                                                      graphics_session)):
         return Parser(
             "Convert PDF to single files and links",
-            image_detector
+            image_detector,
+            cacheable=False
         )
     else:
         return None
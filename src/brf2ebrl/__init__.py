@@ -5,37 +5,90 @@
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 """Module for converting BRF to eBRF"""
 
+import asyncio
 import os
+import threading
+from collections.abc import AsyncIterator
+from concurrent.futures import Executor
+from dataclasses import replace
 from tempfile import TemporaryDirectory
-from typing import Iterable, Callable
+from typing import Iterable, Iterator, Callable
 
 from brf2ebrl.common import PageLayout
-from brf2ebrl.parser import detector_parser, parse, ParserContext, ParserException
-from brf2ebrl.plugin import Plugin, EBrlZippedBundler
+from brf2ebrl.parser import detector_parser, parse, parse_chunks, ParserContext, ParserException, \
+    OUTPUT_INDEPENDENT_OPTIONS, EBrailleParserOptions
+from brf2ebrl.common.graphic_detectors import GraphicsSession
+from brf2ebrl.parallel import VolumeJob, VolumeResult, find_worker_plugin_reference, parse_volumes_in_pool
+from brf2ebrl.plugin import Plugin, EBrlZippedBundler, Bundler, package_version
+from brf2ebrl.utils.pdf import PdfPageIndex
 
 def convert(selected_plugin: Plugin, input_brf_list: Iterable[str], output_ebrf: str,
-            progress_callback: Callable[[int, float], None] = lambda x,y: None, parser_passes: int|None =None, parser_context: ParserContext = ParserContext()):
-    with selected_plugin.create_bundler(output_ebrf, **parser_context.options) as out_bundle:
+            progress_callback: Callable[[int, float], None] = lambda x,y: None, parser_passes: int|None =None, parser_context: ParserContext = ParserContext(),
+            jobs: int = 1, create_bundler: Callable[..., Bundler] | None = None):
+    """Convert the BRF volumes into an eBraille file at output_ebrf.
+
+    Every call has its own temporary folder, graphics session, bundler and metadata defaults, so conversions to
+    different outputs may be run at the same time from several threads. The plugin and parser_context are only
+    read, a pass cache given in parser_context may be shared by the conversions.
+    """
+    # PDFs of graphics are shared by volumes, so are only analysed once for the conversion.
+    graphics_session = GraphicsSession(PdfPageIndex(
+        workers=parser_context.options.get(EBrailleParserOptions.pdf_workers, 1), cache=parser_context.pass_cache))
+    if parser_context.pass_cache is not None:
+        parser_context = replace(parser_context, pass_cache=parser_context.pass_cache.scoped(
+            package_version("brf2ebrl"), selected_plugin.id, selected_plugin.version,
+            sorted((str(k), v) for k, v in parser_context.options.items()
+                   if k not in OUTPUT_INDEPENDENT_OPTIONS)))
+    if create_bundler is None:
+        create_bundler = selected_plugin.create_bundler
+    with create_bundler(output_ebrf, **parser_context.options) as out_bundle:
         with TemporaryDirectory() as temp_dir:
             os.makedirs(os.path.join(temp_dir, "images"), exist_ok=True)
+            volumes = []
             for index, brf in enumerate(input_brf_list):
                 out_name = selected_plugin.file_mapper(brf, index)
-                temp_file = os.path.join(temp_dir, out_name)
-                selected_parser = selected_plugin.create_brf_parser(
-                    brf_path=brf,
-                    output_path=temp_file,
-                    **parser_context.options
-                )[:parser_passes]
-                parser_steps = len(selected_parser)
-                try:
-                    out_bundle.write_volume(out_name, convert_brf2ebrl_str(brf, selected_parser,
-                                         progress_callback=lambda x: progress_callback(index, x / parser_steps),
-                                         parser_context = parser_context))
-                except ParserException as e:
-                    out_bundle.write_str(f"errors/{out_name}", e.text, False)
-                    e.file_name = brf
-                    e.add_note(f"Problem processing file {brf}, text is in bundle in file errors/{out_name}")
-                    raise
+                volumes.append(VolumeJob(index=index, brf=brf, out_name=out_name,
+                                         temp_file=os.path.join(temp_dir, out_name)))
+            plugin_reference = find_worker_plugin_reference(selected_plugin) if jobs > 1 and len(volumes) > 1 else None
+            if plugin_reference is not None:
+                def write_result(volume: VolumeJob, result: VolumeResult):
+                    if result.cache_stats is not None:
+                        parser_context.pass_cache.stats.add(result.cache_stats)
+                    if result.error_text is None:
+                        out_bundle.write_volume(volume.out_name, result.text)
+                        if result.navigation is not None:
+                            out_bundle.add_volume_navigation(volume.out_name, result.navigation)
+                        return
+                    e = ParserException(result.error_text)
+                    _write_parser_error(out_bundle, volume, e)
+                    raise e from RuntimeError(result.error_details)
+                # Workers have their own graphics sessions, so PDFs shared by volumes are analysed once here.
+                if images_path := parser_context.options.get(EBrailleParserOptions.images_path):
+                    for volume in volumes:
+                        graphics_session.analyse_volume_pdfs(volume.brf, volume.temp_file, images_path)
+                parse_volumes_in_pool(plugin_reference, volumes, jobs, parser_passes, parser_context,
+                                      progress_callback, write_result, pdf_page_cache=graphics_session.pdf_pages.cache,
+                                      pdf_pages=graphics_session.pdf_pages.analysed_pages())
+            else:
+                for volume in volumes:
+                    selected_parser = selected_plugin.create_brf_parser(
+                        brf_path=volume.brf,
+                        output_path=volume.temp_file,
+                        graphics_session=graphics_session,
+                        **parser_context.options
+                    )[:parser_passes]
+                    parser_steps = len(selected_parser)
+                    navigation = []
+                    try:
+                        out_bundle.write_volume_chunks(volume.out_name, convert_brf2ebrl_chunks(
+                            volume.brf, selected_parser,
+                            progress_callback=lambda x: progress_callback(volume.index, x / parser_steps),
+                            parser_context=replace(parser_context, navigation=navigation.append)))
+                        if navigation:
+                            out_bundle.add_volume_navigation(volume.out_name, navigation[-1])
+                    except ParserException as e:
+                        _write_parser_error(out_bundle, volume, e)
+                        raise
             for root, dirs, files in os.walk(temp_dir):
                 arch_path = os.path.relpath(root, start=temp_dir)
                 for f in files:
@@ -43,6 +96,91 @@ def convert(selected_plugin: Plugin, input_brf_list: Iterable[str], output_ebrf:
                     out_bundle.write_image(arch_name, os.path.join(root, f))
 
 
+class AsyncConversion:
+    """A conversion running in an executor, iterate over it for the progress and await it for the completion.
+
+    The progress is given as (volume index, fraction) pairs as from the progress_callback of convert. Cancelling a task
+    awaiting the conversion, or iterating over the progress, stops the parser passes at their next check of
+    ParserContext.is_cancelled, awaiting the conversion waits for the passes to stop before raising CancelledError.
+
+    The progress is given once, to the iterations running at the time. Iterating again after the end of the progress
+    ends at once.
+    """
+
+    def __init__(self, selected_plugin: Plugin, input_brf_list: Iterable[str], output_ebrf: str,
+                 parser_passes: int | None, parser_context: ParserContext, jobs: int,
+                 create_bundler: Callable[..., Bundler] | None, executor: Executor | None):
+        loop = asyncio.get_running_loop()
+        self._cancelled = threading.Event()
+        self._progress: asyncio.Queue[tuple[int, float] | None] = asyncio.Queue()
+        is_cancelled = parser_context.is_cancelled
+        parser_context = replace(parser_context, is_cancelled=lambda: self._cancelled.is_set() or is_cancelled())
+        input_brf_list = list(input_brf_list)
+
+        def run():
+            convert(selected_plugin, input_brf_list, output_ebrf,
+                    progress_callback=lambda index, fraction: loop.call_soon_threadsafe(
+                        self._progress.put_nowait, (index, fraction)),
+                    parser_passes=parser_passes, parser_context=parser_context, jobs=jobs,
+                    create_bundler=create_bundler)
+        self._future = loop.run_in_executor(executor, run)
+        # Progress is queued before the future is done, so the end of the progress follows all of it.
+        self._future.add_done_callback(lambda _: self._progress.put_nowait(None))
+
+    def cancel(self):
+        """Ask the conversion to stop."""
+        self._cancelled.set()
+
+    def done(self) -> bool:
+        return self._future.done()
+
+    async def __aiter__(self) -> AsyncIterator[tuple[int, float]]:
+        try:
+            while (progress := await self._progress.get()) is not None:
+                yield progress
+            # Put back the end, so other iterations, or later ones, also end.
+            self._progress.put_nowait(None)
+        except asyncio.CancelledError:
+            self.cancel()
+            raise
+
+    def __await__(self):
+        return self._wait().__await__()
+
+    async def _wait(self):
+        try:
+            return await asyncio.shield(self._future)
+        except asyncio.CancelledError:
+            self.cancel()
+            # The output is still being written until the passes stop.
+            await asyncio.wait([self._future])
+            if not self._future.cancelled():
+                # The passes stopping is the expected problem of a cancelled conversion, so is not reported.
+                self._future.exception()
+            raise
+
+
+def convert_async(selected_plugin: Plugin, input_brf_list: Iterable[str], output_ebrf: str,
+                  parser_passes: int | None = None, parser_context: ParserContext = ParserContext(), jobs: int = 1,
+                  create_bundler: Callable[..., Bundler] | None = None,
+                  executor: Executor | None = None) -> AsyncConversion:
+    """Start converting the BRF volumes in executor, the default executor of the event loop when None.
+
+    The executor should run functions in threads, as the progress and cancellation are shared with the conversion.
+
+    Must be called from a running event loop. The returned conversion gives the progress when iterated over and
+    raises any problem of the conversion when awaited.
+    """
+    return AsyncConversion(selected_plugin, input_brf_list, output_ebrf, parser_passes, parser_context, jobs,
+                           create_bundler, executor)
+
+
+def _write_parser_error(out_bundle: Bundler, volume: VolumeJob, e: ParserException):
+    out_bundle.write_str(f"errors/{volume.out_name}", e.text, False)
+    e.file_name = volume.brf
+    e.add_note(f"Problem processing file {volume.brf}, text is in bundle in file errors/{volume.out_name}")
+
+
 def convert_brf2ebrl(input_brf: str, output_ebrf: str, brf_parser: Iterable[detector_parser],
                      progress_callback: Callable[[int], None] = lambda x: None,
                      parser_context: ParserContext = ParserContext()):
@@ -51,6 +189,17 @@ def convert_brf2ebrl(input_brf: str, output_ebrf: str, brf_parser: Iterable[dete
         out_file.write(output_text)
 
 
+def convert_brf2ebrl_chunks(input_brf: str, brf_parser: Iterable[detector_parser],
+                            progress_callback: Callable[[int], None] = lambda x: None,
+                            parser_context: ParserContext = ParserContext()) -> Iterator[str]:
+    with open(input_brf, "r", encoding="utf-8") as in_file:
+        brf = in_file.read()
+    return parse_chunks(
+        brf,
+        brf_parser, progress_callback=progress_callback, parser_context=parser_context, volume=input_brf
+    )
+
+
 def convert_brf2ebrl_str(input_brf: str, brf_parser: Iterable[detector_parser],
                          progress_callback: Callable[[int], None] = lambda x: None,
                          parser_context: ParserContext = ParserContext()) -> str:
@@ -58,5 +207,5 @@ def convert_brf2ebrl_str(input_brf: str, brf_parser: Iterable[detector_parser],
         brf = in_file.read()
         return parse(
             brf,
-            brf_parser, progress_callback=progress_callback, parser_context=parser_context
+            brf_parser, progress_callback=progress_callback, parser_context=parser_context, volume=input_brf
         )
@@ -0,0 +1,128 @@
+#  Copyright (c) 2024. American Printing House for the Blind.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+"""An on-disk cache of parser pass outputs."""
+import hashlib
+import logging
+import os
+import tempfile
+import zlib
+from dataclasses import dataclass, field
+from typing import Any
+
+DEFAULT_MAX_CACHE_SIZE = 1024 * 1024 * 1024
+_EVICT_TO_FRACTION = 0.9
+"""Eviction removes entries until the cache is this fraction of the max_size, so it is not needed again on the next put."""
+
+
+@dataclass
+class CacheStats:
+    """Counts of the lookups in a pass cache."""
+
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+    def add(self, other: "CacheStats"):
+        self.hits += other.hits
+        self.misses += other.misses
+        self.evictions += other.evictions
+
+
+@dataclass
+class _CacheSize:
+    """Estimate of the total size of the entries, None until the directory has been scanned."""
+
+    total: int | None = None
+
+
+@dataclass(frozen=True)
+class PassCache:
+    """Content addressed cache of parser pass outputs stored in a directory.
+
+    Entries are keyed by a hash of the scope, the pass name and the pass input text. The scope identifies everything
+    else the output depends upon, use scoped to create a cache for a plugin and its options. When the total size of
+    the entries is more than max_size, the least recently used entries are removed.
+
+    The total size is only found by scanning the directory on the first put and when an estimate, kept by adding the
+    size of each entry put, is more than max_size. Entries put by other processes are not in the estimate, so the
+    directory may grow past max_size until the next scan.
+    """
+
+    directory: str
+    max_size: int = DEFAULT_MAX_CACHE_SIZE
+    scope: str = ""
+    stats: CacheStats = field(default_factory=CacheStats, compare=False)
+    _size: _CacheSize = field(default_factory=_CacheSize, compare=False, repr=False)
+
+    def scoped(self, *parts: Any) -> "PassCache":
+        """Create a cache sharing the directory, stats and size estimate, with the parts added to the scope."""
+        return PassCache(self.directory, self.max_size, "\0".join([self.scope, *(repr(p) for p in parts)]),
+                         self.stats, self._size)
+
+    def key(self, text: str, pass_name: str) -> str:
+        digest = hashlib.sha256()
+        for part in (self.scope, pass_name, text):
+            digest.update(part.encode("utf-8", "surrogatepass"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key: str) -> str | None:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as in_file:
+                data = in_file.read()
+            os.utime(path)
+            text = zlib.decompress(data).decode("utf-8", "surrogatepass")
+        except (OSError, zlib.error, UnicodeDecodeError):
+            self.stats.misses += 1
+            return None
+        self.stats.hits += 1
+        return text
+
+    def put(self, key: str, text: str):
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            data = zlib.compress(text.encode("utf-8", "surrogatepass"), 1)
+            with os.fdopen(fd, "wb") as out_file:
+                out_file.write(data)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logging.warning(f"Unable to write to the pass cache {self.directory}: {e}")
+            return
+        if self._size.total is not None:
+            self._size.total += len(data)
+        if self._size.total is None or self._size.total > self.max_size:
+            self._evict()
+
+    def _evict(self):
+        """Scan the directory for the total size, removing the least recently used entries when it is too large."""
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for f in files:
+                if f.endswith(".tmp"):
+                    continue
+                try:
+                    st = os.stat(os.path.join(root, f))
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, os.path.join(root, f)))
+        total = sum(size for _, size, _ in entries)
+        if total > self.max_size:
+            for _, size, path in sorted(entries):
+                if total <= self.max_size * _EVICT_TO_FRACTION:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                self.stats.evictions += 1
+        self._size.total = total
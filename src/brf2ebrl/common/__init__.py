@@ -9,6 +9,11 @@
 from dataclasses import dataclass
 from enum import Enum
 
+BRAILLE_CELLS = "".join(chr(c) for c in range(0x2800, 0x2900))
+"""All the Unicode Braille cells."""
+NON_BLANK_BRAILLE_CELLS = BRAILLE_CELLS[1:]
+"""The Unicode Braille cells excluding the blank cell."""
+
 
 class PageNumberPosition(Enum):
     """The position of a page number on the page."""
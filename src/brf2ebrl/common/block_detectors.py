@@ -16,8 +16,8 @@ from dataclasses import dataclass
 
 from collections.abc import Iterable, Callable
 
-from brf2ebrl.parser import DetectionState, DetectionResult, Detector
-from brf2ebrl.common import PageLayout, PageNumberPosition
+from brf2ebrl.parser import DetectionState, DetectionResult, Detector, detector_hints
+from brf2ebrl.common import PageLayout, PageNumberPosition, BRAILLE_CELLS, NON_BLANK_BRAILLE_CELLS
 
 
 @dataclass
@@ -31,37 +31,34 @@ class ParsedLine:
         return ParsedLine(self.depth, self.pi, self.line_text, self.line_length)
 
 
+_PRE_RE = re.compile("[\u2800-\u28ff]+")
+
+
+@detector_hints(first_chars=BRAILLE_CELLS, max_confidence=0.4)
 def detect_pre(
-    text: str, cursor: int, state: DetectionState, output_text: str
+    text: str, cursor: int, state: DetectionState, output_text: str = ""
 ) -> DetectionResult | None:
     """Detects preformatted Braille"""
-    brl = ""
-    for c in text[cursor:]:
-        if ord(c) in range(0x2800, 0x2900):
-            brl += c
-        else:
-            break
-    return (
-        DetectionResult(cursor + len(brl), state, 0.4, f"{output_text}<pre>{brl}</pre>")
-        if brl
-        else None
-    )
+    if match := _PRE_RE.match(text, cursor):
+        return DetectionResult(
+            match.end(), state, 0.4, f"{output_text}<pre>{match.group()}</pre>"
+        )
+    return None
 
 
 def create_cell_heading(indent: int, tag_name: str) -> Detector:
     """Creates a detector for a heading indented by the specified amount."""
     heading_re = re.compile(f"\u2800{{{indent}}}([\u2801-\u28ff][\u2800-\u28ff]*)\n+")
 
+    @detector_hints(first_chars="\u2800" if indent else NON_BLANK_BRAILLE_CELLS, max_confidence=0.9)
     def detect_cell_heading(
-        text: str, cursor: int, state: DetectionState, output_text: str
+        text: str, cursor: int, state: DetectionState, output_text: str = ""
     ) -> DetectionResult | None:
         lines = []
         new_cursor = cursor
-        while line := heading_re.match(
-            text[new_cursor:],
-        ):
+        while line := heading_re.match(text, new_cursor):
             lines.append(line.group(1))
-            new_cursor += line.end()
+            new_cursor = line.end()
         brl = "\u2800".join(lines)
         return (
             DetectionResult(
@@ -84,27 +81,26 @@ def create_centered_detector(
 
     _next_line_re = re.compile(
         rf"{_BLANK_LINE_RE}\n|<div type=.*\n|\u283f{{{cells_per_line / 2},{cells_per_line}}}\n|"
-        "^[\u2801-\u28ff][\u2800-\u28ff]*\n"
+        "[\u2801-\u28ff][\u2800-\u28ff]*\n"
     )
 
+    @detector_hints(first_chars="\u2800" if min_indent else BRAILLE_CELLS, max_confidence=0.9)
     def detect_centered(
-        text: str, cursor: int, state: DetectionState, output_text: str
+        text: str, cursor: int, state: DetectionState, output_text: str = ""
     ) -> DetectionResult | None:
         lines = []
         brl = ""
         new_cursor = cursor
-        while line := heading_re.match(
-            text[new_cursor:],
-        ):
+        while line := heading_re.match(text, new_cursor):
             line_brl = line.group(2).rstrip("\u2800")
             indent, indent_mod = divmod(cells_per_line - len(line_brl), 2)
             indents = [indent] if indent_mod == 0 else [indent, indent + indent_mod]
             if len(line.group(1)) in indents:
                 lines.append(line_brl)
-                new_cursor += line.end()
+                new_cursor = line.end()
             else:
                 break
-        if _next_line_re.match(text[new_cursor:]):
+        if _next_line_re.match(text, new_cursor):
             brl = "\u2800".join(lines)
         return (
             DetectionResult(
@@ -136,7 +132,9 @@ def create_table_detector() -> Detector:
 
     def get_line(brf_text: str, pos: int, widths: list[int]) -> int | None:
         """Gets each line after table header that matches table columns"""
-        pos2 = brf_text[pos:].find("\n") + 1
+        pos2 = brf_text.find("\n", pos) + 1
+        if pos2:
+            pos2 -= pos
 
         return pos2 if row_column_check(widths, brf_text[pos : pos + pos2]) else None
 
@@ -144,10 +142,11 @@ def create_table_detector() -> Detector:
         """Wraps each element and joins into a single string."""
         return "".join([fmt.format(s) for s in items])
 
+    @detector_hints(first_chars=BRAILLE_CELLS, max_confidence=0.9)
     def detect_table(
-        text: str, cursor: int, state: DetectionState, output_text: str
+        text: str, cursor: int, state: DetectionState, output_text: str = ""
     ) -> DetectionResult | None:
-        match = seperator_re.match(text[cursor:])
+        match = seperator_re.match(text, cursor)
         if not match:
             return None
 
@@ -183,7 +182,7 @@ def create_table_detector() -> Detector:
         table[0] += "</tr>"
         # header done
 
-        cursor += match.end(2) + 1
+        cursor = match.end(2) + 1
         # cells
         row = 0
         while end_cursor := get_line(text, cursor, col_widths):
@@ -306,14 +305,14 @@ def _create_indented_block_finder(
 
         # consume PI
         _blank_lines = 0
-        while line := paragraph_processing_instruction_re.match(text[new_cursor:]):
+        while line := paragraph_processing_instruction_re.match(text, new_cursor):
             if line.group(1) == "<?blank-line?>\n":
                 _blank_lines += 1
                 # more than one blank line this is a hard stop
                 # if _blank_lines > 1:
                 return ([], cursor_offset)
-            new_lines.append(ParsedLine(-1, line.group(1), "", line.end()))
-            new_cursor += line.end()
+            new_lines.append(ParsedLine(-1, line.group(1), "", len(line.group())))
+            new_cursor = line.end()
 
         # last item is a blank line stop
         if new_lines and new_lines[-1].pi == "<?blank-line?>\n":
@@ -342,7 +341,7 @@ def _create_indented_block_finder(
                 line_indent_length = first_line.depth
                 line_text_length = len(first_line.line_text)
             else:
-                next_line_match = _run_over_re.match(text[new_cursor:])
+                next_line_match = _run_over_re.match(text, new_cursor)
                 if not next_line_match:
                     return ([], cursor_offset)
                 line_indent_length = len(next_line_match.group(1))
@@ -366,8 +365,10 @@ def _create_indented_block_finder(
 
         # consume all legal paragraph items until does not match.
         # if first line and has ppn then add spaces
-        while line := _run_over_re.match(text[new_cursor:]):
-            parsed_line = ParsedLine(len(line.group(1)), "", line.group(2), line.end())
+        while line := _run_over_re.match(text, new_cursor):
+            parsed_line = ParsedLine(
+                len(line.group(1)), "", line.group(2), len(line.group())
+            )
             # if first line length is less than cells per line
             # and page number then add remaining spaces
             if count == 1 and page_length:
@@ -389,7 +390,7 @@ def _create_indented_block_finder(
                 return ([], cursor_offset)
 
         # if last line length is less than cells per line and page number then add remaining spaces
-        line = paragraph_processing_instruction_re.match(text[new_cursor:])
+        line = paragraph_processing_instruction_re.match(text, new_cursor)
         if not line or (line and line.group(1) != "<?blank-line?>\n"):
             new_lines[-1].line_text += " " * page_length
 
@@ -420,14 +421,14 @@ def _create_indented_block_finder(
         lines: list[ParsedLine] = []
         new_cursor = cursor
         debug = 0
-        if line := _first_line_re.match(text[cursor:]):
+        if line := _first_line_re.match(text, cursor):
             # if (cursor == 0 or text[cursor-1] in ["\n","\f"]) and
             # (line := _first_line_re.match(text[cursor:])):
             first_line = ParsedLine(
                 len(line.group(1)),
                 "",
                 (" " * len(line.group(1)) + line.group(2)),
-                line.end(),
+                len(line.group()),
             )
             temp_para = get_paragraph_pages(text, new_cursor, first_line, debug + 1)
             lines = temp_para[0]
@@ -479,8 +480,11 @@ def create_paragraph_detector(
             brl_lines.append(f"{line.pi}{line.line_text}".strip(" ").lstrip("\u2800"))
         return "\n".join(brl_lines)
 
+    @detector_hints(
+        first_chars="\u2800" if first_line_indent else NON_BLANK_BRAILLE_CELLS, max_confidence=confidence
+    )
     def detect_paragraph(
-        text: str, cursor: int, state: DetectionState, output_text: str
+        text: str, cursor: int, state: DetectionState, output_text: str = ""
     ) -> DetectionResult | None:
         new_lines, new_cursor = find_paragraph_braille(text, cursor)
         brl = make_paragraph(new_lines)
@@ -642,6 +646,23 @@ def create_toc_detector(cells_per_line: int) -> Detector:
         f"(\u2800{{{min_indent},}})([\u2801-\u28ff][\u2800-\u28ff]*)\n+",
     )
 
+    tn_heading_re = re.compile("\u2808\u2828\u2823[\u2800-\u28ff]*\n")
+    # Start of the last transcriber's note heading in the most recently seen text. The text is identified by its id,
+    # length and hash rather than kept, so the detector does not hold on to the text after the pass.
+    last_tn_heading: list[tuple[tuple[int, int, int], int]] = [((0, -1, 0), -1)]
+
+    def last_tn_heading_start(text: str) -> int:
+        """Find where the last transcriber's note heading in text starts, -1 if none."""
+        key = (id(text), len(text), hash(text))
+        cached_key, start = last_tn_heading[0]
+        if cached_key == key:
+            return start
+        start = text.rfind("\u2808\u2828\u2823")
+        while start >= 0 and not tn_heading_re.match(text, start):
+            start = text.rfind("\u2808\u2828\u2823", 0, start)
+        last_tn_heading[0] = (key, start)
+        return start
+
     toc_entry_re = re.compile(
         r"([\u2800-\u28FF]+?)"  # Group 1: Section title (non-greedy)
         r"(?:\u2800\u2810{2,}\u2800|\u2800\u2800)"  # Divider: 2+ ⠐ or exactly two ⠀
@@ -768,13 +789,15 @@ def create_toc_detector(cells_per_line: int) -> Detector:
         _, brl_str = build_toc(lines, 0, len(lines), levels, 0)
         return str(brl_str)
 
-    def match_toc_line(current_line: str) -> ParsedLine | None:
+    def match_toc_line(text: str, pos: int) -> ParsedLine | None:
         """Match lines if they are possibly part of a list"""
-        if line := first_line_re.match(current_line):
-            return ParsedLine(0, "", line.group(1), line.end())
+        if line := first_line_re.match(text, pos):
+            return ParsedLine(0, "", line.group(1), len(line.group()))
 
-        if line := run_over_re.match(current_line):
-            return ParsedLine(len(line.group(1)), "", line.group(2), line.end())
+        if line := run_over_re.match(text, pos):
+            return ParsedLine(
+                len(line.group(1)), "", line.group(2), len(line.group())
+            )
 
         return None
 
@@ -789,29 +812,30 @@ def create_toc_detector(cells_per_line: int) -> Detector:
         new_lines: list[ParsedLine] = []
 
         # consume PI's if consicutive blanks stop and return [[],0]
-        while line := toc_processing_instruction_re.match(text[new_cursor:]):
+        while line := toc_processing_instruction_re.match(text, new_cursor):
             if (
                 new_lines
                 and line.group(1) == "<?blank-line?>\n"
                 and new_lines[-1].pi == line.group(1)
             ):
                 return ([], cursor_offset)
-            new_lines.append(ParsedLine(-1, line.group(1), "", line.end()))
-            new_cursor += line.end()
+            new_lines.append(ParsedLine(-1, line.group(1), "", len(line.group())))
+            new_cursor = line.end()
 
         # if centered heading stop and return [[], 0]
-        center_line = heading_re.match(text[new_cursor:])
+        center_line = heading_re.match(text, new_cursor)
         if center_line:
             line_brl = center_line.group(2).rstrip("\u2800")
             indent, indent_mod = divmod(cells_per_line - len(line_brl), 2)
             indents = [indent] if indent_mod == 0 else [indent, indent + indent_mod]
-            if len(center_line.group(1)) in indents and not re.findall(
-                "\u2808\u2828\u2823[\u2800-\u28ff]*\n", text[new_cursor:]
+            if (
+                len(center_line.group(1)) in indents
+                and last_tn_heading_start(text) < new_cursor
             ):
                 return ([], cursor_offset)
 
         # consume all legal toc lines until does not match.
-        while line := match_toc_line(text[new_cursor:]):
+        while line := match_toc_line(text, new_cursor):
             new_lines.append(line)
             new_cursor += line.line_length
 
@@ -841,14 +865,15 @@ def create_toc_detector(cells_per_line: int) -> Detector:
         new_lines.extend(temp_list[0])
         return (new_lines, temp_list[1])
 
+    @detector_hints(line_start_only=True, first_chars=NON_BLANK_BRAILLE_CELLS, max_confidence=0.91)
     def detect_toc(
-        text: str, cursor: int, state: DetectionState, output_text: str
+        text: str, cursor: int, state: DetectionState, output_text: str = ""
     ) -> DetectionResult | None:
         brl = ""
         lines: list[ParsedLine] = []
         new_cursor = cursor
         if (cursor == 0 or text[cursor - 1] == "\n") and first_line_re.match(
-            text[cursor:]
+            text, cursor
         ):
             lines, new_cursor = get_toc_pages(text, cursor)
         if lines:
@@ -966,13 +991,15 @@ def create_list_detector(cells_per_line: int) -> Detector:
         _, brl_str = build_list(lines, 0, len(lines), levels, 0)
         return brl_str
 
-    def match_list_line(current_line: str) -> ParsedLine | None:
+    def match_list_line(text: str, pos: int) -> ParsedLine | None:
         """Match lines if they are possibly part of a list"""
-        if line := first_line_re.match(current_line):
-            return ParsedLine(0, "", line.group(1), line.end())
+        if line := first_line_re.match(text, pos):
+            return ParsedLine(0, "", line.group(1), len(line.group()))
 
-        if line := run_over_re.match(current_line):
-            return ParsedLine(len(line.group(1)), "", line.group(2), line.end())
+        if line := run_over_re.match(text, pos):
+            return ParsedLine(
+                len(line.group(1)), "", line.group(2), len(line.group())
+            )
 
         return None
 
@@ -991,14 +1018,14 @@ def create_list_detector(cells_per_line: int) -> Detector:
 
         # consume PI
         _blank_lines = 0
-        while line := list_processing_instruction_re.match(text[new_cursor:]):
+        while line := list_processing_instruction_re.match(text, new_cursor):
             if line.group(1) == "<?blank-line?>\n":
                 _blank_lines += 1
             # more than one blank line this is a hard stop
             if _blank_lines > 1:
                 return ([], cursor_offset)
-            new_lines.append(ParsedLine(-1, line.group(1), "", line.end()))
-            new_cursor += line.end()
+            new_lines.append(ParsedLine(-1, line.group(1), "", len(line.group())))
+            new_cursor = line.end()
 
         # last item is a blank line stop
         if new_lines and new_lines[-1].pi == "<?blank-line?>\n":
@@ -1017,7 +1044,7 @@ def create_list_detector(cells_per_line: int) -> Detector:
             if not page_length:
                 return ([], cursor_offset)
             # get line
-            line = match_list_line(text[new_cursor:])
+            line = match_list_line(text, new_cursor)
             if line is None:
                 return ([], cursor_offset)
             # #add indent, 3 spaces, page number length, and line to see if less thancells_per_line
@@ -1027,7 +1054,7 @@ def create_list_detector(cells_per_line: int) -> Detector:
                 # return [[], cursor_offset] + len(line[2])
 
         # if centered heading stop and return [[], 0]
-        center_line = heading_re.match(text[new_cursor:])
+        center_line = heading_re.match(text, new_cursor)
         # test with out center just any heading
         if center_line:
             return ([], cursor_offset)
@@ -1035,7 +1062,7 @@ def create_list_detector(cells_per_line: int) -> Detector:
         # consume all legal list items until does not match.
         # if first line and has page_length then add spaces
         count = 1
-        while line := match_list_line(text[new_cursor:]):
+        while line := match_list_line(text, new_cursor):
             # if first line length is less than cells per line
             # and page number then add remaining spaces
             if count == 1 and page_length:
@@ -1058,7 +1085,7 @@ def create_list_detector(cells_per_line: int) -> Detector:
 
         # if last line length is less than cells per line and page number then add remaining spaces
         if not page_length:
-            line = list_processing_instruction_re.match(text[new_cursor:])
+            line = list_processing_instruction_re.match(text, new_cursor)
             if line and line.group(1) != "<?blank-line?>\n":
                 new_lines[-1].line_text += " " * (
                     cells_per_line - len(new_lines[-1].line_text)
@@ -1068,14 +1095,15 @@ def create_list_detector(cells_per_line: int) -> Detector:
         new_lines.extend(temp_list[0])
         return (new_lines, temp_list[1])
 
+    @detector_hints(line_start_only=True, first_chars=NON_BLANK_BRAILLE_CELLS, max_confidence=0.9)
     def detect_list(
-        text: str, cursor: int, state: DetectionState, output_text: str
+        text: str, cursor: int, state: DetectionState, output_text: str = ""
     ) -> DetectionResult | None:
         brl = ""
         lines: list[ParsedLine] = []
         new_cursor = cursor
         if (cursor == 0 or text[cursor - 1] == "\n") and first_line_re.match(
-            text[cursor:]
+            text, cursor
         ):
             lines, new_cursor = get_list_pages(text, cursor)
 
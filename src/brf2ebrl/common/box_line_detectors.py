@@ -8,7 +8,7 @@
 import re
 
 from brf2ebrl import ParserContext
-from brf2ebrl.parser import DetectionState, DetectionResult
+from brf2ebrl.parser import DetectionState, DetectionResult, detector_hints
 
 # Define the regular expression patterns
 _ENCLOSING_RE = re.compile(
@@ -30,8 +30,9 @@ def _convert_groups(match):
     return f'<div type="<?box {match.group(2)[0]}?>">{match.group(3)}</div>'
 
 
+@detector_hints(max_confidence=1.0)
 def convert_box_lines(
-        text: str, _: int, state: DetectionState, output_text: str
+        text: str, _: int, state: DetectionState, output_text: str = ""
 ) -> DetectionResult | None:
     """
     converts all box and screen material to their div equivlant or returns None if not a box line
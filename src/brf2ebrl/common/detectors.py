@@ -5,17 +5,22 @@
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
 """Some detectors common to multiple Braille codes/standards."""
+import codecs
 import logging
 import re
-from collections.abc import Iterable
+import string
+from collections.abc import Iterable, Iterator
 from enum import Enum, auto
+from html import escape
 
 import lxml.etree
 import lxml.html
 from lxml.html.builder import HTML, BODY, HEAD, LINK
 
 from brf2ebrl import ParserContext
-from brf2ebrl.parser import DetectionResult, DetectionState, Detector
+from brf2ebrl.parser import DetectionResult, DetectionState, Detector, detector_hints, get_detector_hints, \
+    merge_detector_hints, Parser
+from brf2ebrl.utils.ebrl import find_volume_navigation
 
 _ASCII_TO_UNICODE_DICT = str.maketrans(
     r""" A1B'K2L@CIF/MSP"E3H9O6R^DJG>NTQ,*5<-U8V.%[$+X!&;:4\0Z7(_?W]#Y)=""",
@@ -34,14 +39,33 @@ def translate_ascii_to_unicode_braille(text: str, _: ParserContext = ParserConte
     return text.translate(_ASCII_TO_UNICODE_DICT)
 
 
+_INGEST_DECODING_TABLE = "".join(
+    c.upper().translate(_ASCII_TO_UNICODE_DICT) if c in string.printable else "\ufffe" for c in map(chr, range(256))
+)
+
+
+def ingest_brf(text: str, _: ParserContext = ParserContext()) -> str:
+    """Remove characters which are not printable ASCII, make uppercase and convert to Unicode Braille.
+
+    The same as those three steps done separately, but done in a single decoding of the ASCII bytes.
+    """
+    return codecs.charmap_decode(text.encode("ascii", "ignore"), "ignore", _INGEST_DECODING_TABLE)[0]
+
+
+INGEST_BRF_PARSER = Parser("Ingest BRF as unicode Braille", ingest_brf)
+"""Parser pass for ingesting BRF, keeping only printable ASCII, uppercase and converted to Unicode Braille."""
+
+
+@detector_hints(max_confidence=1.0)
 def convert_ascii_to_unicode_braille(text: str, cursor: int, state: DetectionState,
-                                     output_text: str) -> DetectionResult:
+                                     output_text: str = "") -> DetectionResult:
     """Convert only th next character to Unicode Braille."""
     return DetectionResult(cursor + 1, state, 1.0, output_text + text[cursor].translate(_ASCII_TO_UNICODE_DICT))
 
 
+@detector_hints(first_chars="<", max_confidence=0.9)
 def detect_and_pass_processing_instructions(text: str, cursor: int, state: DetectionState,
-                                            output_text: str) -> DetectionResult | None:
+                                            output_text: str = "") -> DetectionResult | None:
     """Detect and pass through processing instructions"""
     if text.startswith("<?", cursor):
         end_of_pi = text.find("?>", cursor) + 2
@@ -55,24 +79,25 @@ _BRAILLE_PPN_RE = re.compile("<\\?braille-ppn[ \u2800-\u28ff]*\\?>\n")
 _PRINT_PAGE_RE = re.compile("<\\?print-page[ \u2800-\u28ff]*\\?>\n")
 
 
+@detector_hints(first_chars="<", max_confidence=1.0)
 def braille_page_counter_detector(text: str, cursor: int, state: DetectionState,
-                                  output_text: str) -> DetectionResult | None:
+                                  output_text: str = "") -> DetectionResult | None:
     """Detector to count Braille pages in the state."""
-    if m := _BRAILLE_PAGE_PI_RE.match(text[cursor:]):
+    if m := _BRAILLE_PAGE_PI_RE.match(text, cursor):
         prev_braille_page_type = state.get("braille_page_type", BraillePageType.UNSET)
         brl_page_num = m.group("braille_page_num")
         braille_page_type = BraillePageType.T if brl_page_num.startswith(
             "\u281e") else BraillePageType.P if brl_page_num.startswith(
             "\u280f") else BraillePageType.NORMAL if brl_page_num else prev_braille_page_type
         page_count = state.get("braille_page_count", 0) + 1 if prev_braille_page_type == braille_page_type else 1
-        return DetectionResult(cursor + len(m.group()),
+        return DetectionResult(m.end(),
                                dict(state, braille_page_type=braille_page_type, braille_page_count=page_count,
                                     new_braille_page=True), 1.0, f"{output_text}{m.group()}")
-    elif m := _BRAILLE_PPN_RE.match(text[cursor:]):
-        return DetectionResult(cursor=cursor + len(m.group()), state=state, confidence=1.0,
+    elif m := _BRAILLE_PPN_RE.match(text, cursor):
+        return DetectionResult(cursor=m.end(), state=state, confidence=1.0,
                                text=f"{output_text}{m.group()}")
-    elif m := _PRINT_PAGE_RE.match(text[cursor:]):
-        return DetectionResult(cursor=cursor + len(m.group()), state=state, confidence=1.0,
+    elif m := _PRINT_PAGE_RE.match(text, cursor):
+        return DetectionResult(cursor=m.end(), state=state, confidence=1.0,
                                text=f"{output_text}{m.group()}")
     return None
 
@@ -80,7 +105,8 @@ def braille_page_counter_detector(text: str, cursor: int, state: DetectionState,
 _BLANK_LINE_RE = re.compile("(\n[ \t\u2800]*)+\n")
 
 
-def convert_blank_line_to_pi(text: str, cursor: int, state: DetectionState, output_text: str) -> DetectionResult | None:
+@detector_hints(max_confidence=1.0)
+def convert_blank_line_to_pi(text: str, cursor: int, state: DetectionState, output_text: str = "") -> DetectionResult | None:
     """Convert blank braille lines into pi for later use if needed"""
     return DetectionResult(len(text), state, 1.0,
                            output_text + convert_blank_lines_to_processing_instructions(text[cursor:], ParserContext()))
@@ -96,23 +122,28 @@ def create_running_head_detector(min_indent: int) -> Detector:
     min_indent_re = re.compile(
         f"\u2800{{{min_indent},}}(?P<running_head>[\u2801-\u28ff][\u2800-\u28ff]*)(?P<eol>[\n\f])")
 
-    def detect_running_head(text: str, cursor: int, state: DetectionState, output_text: str) -> DetectionResult | None:
+    def next_running_head(text: str, cursor: int, state: DetectionState) -> int:
+        if state.get("new_braille_page", False):
+            return cursor + 1
+        next_page_index = text.find("<?braille-page", cursor + 1)
+        return next_page_index if next_page_index >= 0 else len(text)
+
+    @detector_hints(max_confidence=1.0, next_match=next_running_head)
+    def detect_running_head(text: str, cursor: int, state: DetectionState, output_text: str = "") -> DetectionResult | None:
+        if not state.get("new_braille_page", False) or text.startswith("<?braille-page", cursor):
+            return None
         page_can_have_runninghead = state.get("braille_page_count", 0) != 1 or state.get("braille_page_type", BraillePageType.UNSET) == BraillePageType.P
-        if state.get("new_braille_page", False) and page_can_have_runninghead and (
-                m := min_indent_re.match(text[cursor:])):
+        if page_can_have_runninghead and (m := min_indent_re.match(text, cursor)):
             running_head = m.group("running_head")
-            return DetectionResult(cursor + m.end(), dict(state, new_braille_page=False), 1.0,
+            return DetectionResult(m.end(), dict(state, new_braille_page=False), 1.0,
                                    f"{output_text}<?running-head {running_head}?>{m.group('eol')}")
-        next_page_index = text.find("<?braille-page", cursor)
-        return DetectionResult(next_page_index, dict(state, new_braille_page=False), 1.0, output_text + text[
-                                                                                                        cursor:next_page_index]) if next_page_index > cursor else DetectionResult(
-            len(text), dict(state, new_braille_page=False), 1.0,
-            output_text + text[cursor:]) if next_page_index < 0 else None
+        # Only the start of the page can be a running head, the rest of the page is skipped by the parser.
+        return DetectionResult(cursor, dict(state, new_braille_page=False), 1.0, output_text)
 
     return detect_running_head
 
 
-def xhtml_fixup_detector(input_text: str, _: ParserContext) -> str:
+def _create_xhtml_tree(input_text: str, parser_context: ParserContext) -> lxml.html.HtmlElement:
     try:
         root = HTML(
             HEAD(
@@ -135,13 +166,48 @@ def xhtml_fixup_detector(input_text: str, _: ParserContext) -> str:
             elif element.get("role") == "doc-pagebreak":
                 element.set("id", f"page_{page_id}")
                 page_id += 1
+    if parser_context.navigation is not None:
+        parser_context.navigation(find_volume_navigation(root))
+    return root
+
+
+def xhtml_fixup_detector(input_text: str, parser_context: ParserContext) -> str:
+    root = _create_xhtml_tree(input_text, parser_context)
     return lxml.html.tostring(root, doctype="<!DOCTYPE html>", pretty_print=True, encoding="unicode", method="xml")
 
+
+def xhtml_fixup_chunks(chunks: Iterable[str], parser_context: ParserContext) -> Iterator[str]:
+    """Make the complete XHTML as xhtml_fixup_detector, serialising the body a child element at a time."""
+    root = _create_xhtml_tree("".join(chunks), parser_context)
+    return _serialise_xhtml_chunks(root)
+
+
+def _serialise_xhtml_chunks(root: lxml.html.HtmlElement) -> Iterator[str]:
+    def serialise(element) -> str:
+        return lxml.html.tostring(element, encoding="unicode", method="xml", with_tail=True)
+    # The tree is already indented and the html and body elements have no attributes.
+    body = root.body
+    yield f"<!DOCTYPE html>\n<html>{escape(root.text or '', quote=False)}"
+    yield serialise(root.head)
+    yield f"<body>{escape(body.text or '', quote=False)}"
+    for element in body:
+        yield serialise(element)
+    yield f"</body>{escape(body.tail or '', quote=False)}</html>\n"
+
+
+XHTML_FIXUP_PARSER = Parser("Make complete XML", xhtml_fixup_detector, parse_chunks=xhtml_fixup_chunks)
+"""Parser pass making the complete XHTML document, assigning ids to headings and pages."""
+
+
 def combine_detectors(detectors: Iterable[Detector]) -> Detector:
-    def apply(text: str, cursor: int, state: DetectionState, output_text: str) -> DetectionResult | None:
+    detectors = tuple(detectors)
+
+    def apply(text: str, cursor: int, state: DetectionState, output_text: str = "") -> DetectionResult | None:
         for i, detector in enumerate(detectors):
             if result := detector(text, cursor, state, output_text):
                 logging.debug("Selected index=%s detector=%s", i, detector)
                 return result
         return None
+    apply.detector_hints = merge_detector_hints(get_detector_hints(d) for d in detectors)
+    apply.wrap_detectors = lambda wrap: combine_detectors(wrap(d) for d in detectors)
     return apply
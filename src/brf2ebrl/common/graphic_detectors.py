@@ -9,16 +9,17 @@ import logging
 import os
 import re
 import sys
+from collections import deque
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Callable, List, Set
+from typing import Any, Callable, List, Sequence, Set
 
 import pdfplumber
-import pypdf
 
 from brf2ebrl.common import PageLayout, PageNumberPosition
 from brf2ebrl.common.detectors import _ASCII_TO_UNICODE_DICT
 from brf2ebrl.parser import ParserContext, NotifyLevel
+from brf2ebrl.utils.pdf import PdfPage, PdfPageIndex
 
 # Import improved page number detection from pdfpl.py
 PRINT_PAGE_RE = re.compile(r"""
@@ -115,12 +116,28 @@ AUTO_GEN_TEXT = (
 )
 PDF_TEXT = "\u2820\u2820\u280f\u2819\u280b\u2800\u280f\u2801\u281b\u2811\u2800"
 
-_STATE = {
-    "references": {},
-    "pdf_cache": {},  # Cache for PDF processing to avoid recreating on subsequent runs
-    "braille_ppns_cache": None,
-    "current_volume_path": None,
-}
+
+class GraphicsSession:
+    """The graphics detection state of a conversion, shared by the detectors of all its volumes.
+
+    Create a session for each conversion and give it to create_pdf_graphic_detector for each volume, conversions
+    using separate sessions do not share any state so can be run at the same time.
+    """
+
+    def __init__(self, pdf_pages: PdfPageIndex | None = None):
+        self.pdf_pages = pdf_pages if pdf_pages is not None else PdfPageIndex()
+
+    def analyse_volume_pdfs(self, brf_path: str, output_path: str, images_path: str | None):
+        """Analyse the PDFs a volume would use in advance, such as before parsing the volumes in other processes.
+
+        Problems reading a PDF are left to be reported when parsing the volume.
+        """
+        ebrf_folder = os.path.split(output_path)[0]
+        for image_file in _collect_image_files(images_path, os.path.split(brf_path)[1].split(".")[0]):
+            try:
+                self.pdf_pages.pages(image_file, ebrf_folder)
+            except OSError:
+                continue
 
 
 @dataclass(frozen=True)
@@ -140,15 +157,6 @@ class _VolumeReferenceContext:
     page_layout: PageLayout
 
 
-def reset_pdf_detector_cache():
-    """Reset all caches for the PDF detector - useful for testing or when processing new files"""
-    _STATE["references"].clear()
-    _STATE["pdf_cache"].clear()
-    _STATE["braille_ppns_cache"] = None
-    _STATE["current_volume_path"] = None
-    logging.info("PDF detector cache has been reset")
-
-
 def extract_braille_ppns_from_text(text: str) -> Set[str]:
     """
     Extract all braille page numbers from text using regex pattern.
@@ -175,12 +183,12 @@ def extract_braille_ppns_from_text(text: str) -> Set[str]:
                 ascii_version += '?'  # Mark unmappable characters
 
     # Only log braille PPN count for volumes with issues
-    _STATE["braille_ppns_cache"] = set(matches)
-    if not _STATE["braille_ppns_cache"]:
+    braille_ppns = set(matches)
+    if not braille_ppns:
         logging.warning("No braille PPNs found in text - "
                        "PDF validation will accept all pages")
 
-    return _STATE["braille_ppns_cache"]
+    return braille_ppns
 
 
 
@@ -275,6 +283,64 @@ def _build_ppn_variation_map(braille_ppns_list: List[str]) -> dict[str, str]:
     return variation_map
 
 
+class _PpnMatcher:
+    """Finds the variations of the braille PPNs of a volume in text.
+
+    The variations are found with an Aho-Corasick automaton, so searching text takes a single pass however many
+    PPNs the volume has. Build one matcher for a volume and use it for all the pages.
+    """
+
+    def __init__(self, braille_ppns_list: List[str]):
+        self.variation_map = _build_ppn_variation_map(braille_ppns_list)
+        # The automaton is a trie of the variations, nodes are numbered with node 0 the root. For each node, best is
+        # the lowest index of a variation ending at that node, the variation order is that of variation_map.
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._best: list[int] = [len(self.variation_map)]
+        for index, variation in enumerate(self.variation_map):
+            node = 0
+            for char in variation:
+                if (node_next := self._goto[node].get(char)) is None:
+                    node_next = self._goto[node][char] = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._best.append(len(self.variation_map))
+                node = node_next
+            self._best[node] = min(self._best[node], index)
+        self._originals = list(self.variation_map.values())
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            # Variations which are suffixes of this node's text also end here, the fail node is the longest.
+            self._best[node] = min(self._best[node], self._best[self._fail[node]])
+            for char, child in self._goto[node].items():
+                fail = self._fail[node]
+                while char not in self._goto[fail] and fail:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                queue.append(child)
+
+    def __bool__(self) -> bool:
+        return bool(self.variation_map)
+
+    def get(self, text: str) -> str | None:
+        """Get the PPN when text is exactly a variation."""
+        return self.variation_map.get(text)
+
+    def find_in(self, text: str) -> str | None:
+        """Get the PPN of the first variation, in the order of variation_map, found anywhere in text."""
+        best = self._best[0]
+        node = 0
+        for char in text:
+            while char not in self._goto[node] and node:
+                node = self._fail[node]
+            node = self._goto[node].get(char, 0)
+            best = min(best, self._best[node])
+            if best == 0:
+                break
+        return self._originals[best] if best < len(self._originals) else None
+
+
 def _expected_print_position(page_layout: PageLayout, page_count: int) -> PageNumberPosition:
     return (
         page_layout.odd_print_page_number
@@ -433,15 +499,16 @@ def _best_candidate_ppn(candidates: list[tuple[int, str]]) -> str | None:
 
 def _find_matching_ppn_in_positioned_words(
     page,
-    braille_ppns_list: List[str],
+    braille_ppns_list: List[str] | _PpnMatcher,
     page_layout: PageLayout,
     page_count: int,
 ) -> str | None:
     if not braille_ppns_list:
         return None
 
-    variation_map = _build_ppn_variation_map(braille_ppns_list)
-    if not variation_map:
+    ppn_matcher = braille_ppns_list if isinstance(braille_ppns_list, _PpnMatcher) else _PpnMatcher(
+        braille_ppns_list)
+    if not ppn_matcher:
         return None
 
     lines = _collect_page_word_lines(page)
@@ -462,7 +529,7 @@ def _find_matching_ppn_in_positioned_words(
 
         for word in words:
             normalized = word["text"].strip().lower()
-            matched_ppn = variation_map.get(normalized)
+            matched_ppn = ppn_matcher.get(normalized)
             if not matched_ppn:
                 continue
 
@@ -475,13 +542,13 @@ def _find_matching_ppn_in_positioned_words(
 
 
 def find_matching_ppn_in_blocks(text_blocks: List[str],
-                                braille_ppns_list: List[str]) -> str | None:
+                                braille_ppns_list: List[str] | _PpnMatcher) -> str | None:
     """
     Find a matching PPN by searching through text blocks against PPNs in reverse order.
 
     Args:
         text_blocks: List of text blocks from the PDF
-        braille_ppns_list: List of known braille PPNs (will search in reverse order)
+        braille_ppns_list: List of known braille PPNs, or a matcher of them built for the volume
 
     Returns:
         Matching braille PPN string or None if not found
@@ -489,18 +556,17 @@ def find_matching_ppn_in_blocks(text_blocks: List[str],
     if not text_blocks or not braille_ppns_list:
         return None
 
-    variation_map = _build_ppn_variation_map(braille_ppns_list)
+    ppn_matcher = braille_ppns_list if isinstance(braille_ppns_list, _PpnMatcher) else _PpnMatcher(
+        braille_ppns_list)
 
-    # Search PPNs in reverse order (last to first)
     for block_text in text_blocks:
         block_text_clean = block_text.strip().lower()
 
-        if block_text_clean in variation_map:
-            return variation_map[block_text_clean]
+        if (original_ppn := ppn_matcher.get(block_text_clean)) is not None:
+            return original_ppn
 
-        for candidate_variation, original_ppn in variation_map.items():
-            if candidate_variation in block_text_clean:
-                return original_ppn
+        if (original_ppn := ppn_matcher.find_in(block_text_clean)) is not None:
+            return original_ppn
 
     return None
 
@@ -580,23 +646,36 @@ def extract_page_number_from_pdf(
     try:
         with pdfplumber.open(pdf_path) as pdf:
             if len(pdf.pages) > 0:
-                page = pdf.pages[0]  # Single page PDF
-                matching_ppn = _find_matching_ppn_in_positioned_words(
-                    page,
-                    braille_ppns_list,
-                    page_layout,
-                    page_count,
-                )
-                if matching_ppn:
-                    return matching_ppn
-
-                text_blocks = extract_text_blocks_from_pdf(page)
-                return find_matching_ppn_in_blocks(text_blocks, braille_ppns_list)
+                # Single page PDF
+                return _find_matching_ppn_in_page(pdf.pages[0], _PpnMatcher(braille_ppns_list), page_layout,
+                                                  page_count)
     except OSError as e:
         logging.warning("Error extracting page number from %s: %s", pdf_path, e)
     return None
 
 
+def _find_matching_ppn_in_page(
+    page,
+    ppn_matcher: _PpnMatcher,
+    page_layout: PageLayout,
+    page_count: int,
+) -> str | None:
+    if not ppn_matcher:
+        return None
+
+    matching_ppn = _find_matching_ppn_in_positioned_words(
+        page,
+        ppn_matcher,
+        page_layout,
+        page_count,
+    )
+    if matching_ppn:
+        return matching_ppn
+
+    text_blocks = extract_text_blocks_from_pdf(page)
+    return find_matching_ppn_in_blocks(text_blocks, ppn_matcher)
+
+
 def _ensure_ebrf_folder(ebrf_folder: str) -> None:
     if os.path.exists(ebrf_folder) and not os.path.isdir(ebrf_folder):
         logging.error("Can not create %s file already exists.", ebrf_folder)
@@ -683,74 +762,44 @@ def _collect_image_files(images_path: str | None, in_filename_base: str) -> list
     return [x for x in [images_path] if x and os.path.exists(x)]
 
 
-def _split_pdf_to_pages(
-    image_file: str,
-    full_subdir_path: str,
-    pdf_subdir: str,
-) -> list[dict[str, str | int]]:
-    with open(image_file, 'rb') as pdf_file:
-        pdf_reader = pypdf.PdfReader(pdf_file)
-        total_pages = len(pdf_reader.pages)
-
-        logging.info("Processing PDF %s with %d pages", image_file, total_pages)
-
-        split_pdf_paths = []
-        pdf_counter = 1
-        for page_num in range(total_pages):
-            pdf_filename = f"{pdf_counter}.pdf"
-            pdf_path_full = os.path.join(full_subdir_path, pdf_filename)
-
-            pdf_writer = pypdf.PdfWriter()
-            pdf_writer.add_page(pdf_reader.pages[page_num])
-
-            with open(pdf_path_full, 'wb') as output_pdf:
-                pdf_writer.write(output_pdf)
-
-            split_pdf_paths.append({
-                'full_path': pdf_path_full,
-                'relative_path': os.path.join("images", pdf_subdir, pdf_filename),
-                'pdf_counter': pdf_counter,
-                'page_num': page_num
-            })
-            pdf_counter += 1
-
-        return split_pdf_paths
-
-
-def _match_split_pages(
-    split_pdf_paths: list[dict[str, str | int]],
-    braille_ppns_list: list[str],
+def _match_pdf_pages(
+    pages: Sequence[PdfPage],
+    ppn_matcher: _PpnMatcher,
     image_file: str,
     page_layout: PageLayout,
+    pdf_pages: PdfPageIndex,
+    references: dict[str, list[str]],
 ) -> tuple[int, int]:
     processed_pages = 0
     matched_pages = 0
 
-    for split_info in split_pdf_paths:
+    for page in pages:
         processed_pages += 1
 
-        matching_ppn = extract_page_number_from_pdf(
-            split_info['full_path'],
-            braille_ppns_list,
+        matching_ppn = _find_matching_ppn_in_page(
+            page,
+            ppn_matcher,
             page_layout,
-            int(split_info['pdf_counter']),
+            page.pdf_counter,
         )
 
         if matching_ppn:
+            # Only pages linked from the volume are needed in the bundle.
+            pdf_pages.write_page(page)
             bp_page_trans = matching_ppn.strip().upper().translate(
                 _ASCII_TO_UNICODE_DICT)
-            if bp_page_trans in _STATE["references"]:
-                _STATE["references"][bp_page_trans].append(
-                    split_info['relative_path'])
+            if bp_page_trans in references:
+                references[bp_page_trans].append(
+                    page.relative_path)
             else:
-                _STATE["references"][bp_page_trans] = [
-                    split_info['relative_path']]
+                references[bp_page_trans] = [
+                    page.relative_path]
 
             matched_pages += 1
         else:
             logging.warning(
                 "✗ PDF %s.pdf from %s: No matching PPN found",
-                split_info['pdf_counter'], image_file)
+                page.pdf_counter, image_file)
 
     return processed_pages, matched_pages
 
@@ -758,23 +807,21 @@ def _match_split_pages(
 def _process_image_file(
     image_file: str,
     ebrf_folder: str,
-    braille_ppns_list: list[str],
+    ppn_matcher: _PpnMatcher,
     page_layout: PageLayout,
+    pdf_pages: PdfPageIndex,
+    references: dict[str, list[str]],
 ) -> tuple[int, int]:
     """
-    Split a single image PDF into pages and match pages to braille PPNs.
+    Match the pages of a single image PDF to braille PPNs, writing the matched pages as single page PDFs.
+    The matched pages are added to references.
+    The pages are only analysed once for all volumes using pdf_pages.
     Returns (pages_processed, pages_matched).
     """
-    # Create subdirectory for this source PDF to prevent overwrites
-    pdf_subdir = os.path.splitext(os.path.basename(image_file))[0]
-    full_subdir_path = os.path.join(ebrf_folder, "images", pdf_subdir)
-    os.makedirs(full_subdir_path, exist_ok=True)
-
     try:
-        split_pdf_paths = _split_pdf_to_pages(
-            image_file, full_subdir_path, pdf_subdir)
-        return _match_split_pages(
-            split_pdf_paths, braille_ppns_list, image_file, page_layout)
+        pages = pdf_pages.pages(image_file, ebrf_folder)
+        return _match_pdf_pages(
+            pages, ppn_matcher, image_file, page_layout, pdf_pages, references)
     except OSError as e:
         logging.error("Error processing %s: %s", image_file, e)
         return 0, 0
@@ -813,21 +860,13 @@ def _get_reference_key(brf_page: str, references: dict[str, str]) -> str:
     return brf_pages[0]
 
 
-def _prepare_volume_references(
+def _create_volume_references(
     text: str,
     parser_context: ParserContext,
     volume_context: _VolumeReferenceContext,
-) -> bool:
+    session: GraphicsSession,
+) -> dict[str, list[str]]:
     brf_path = volume_context.brf_path
-    if _STATE["current_volume_path"] == brf_path:
-        return True
-
-    if _STATE["current_volume_path"] is not None:
-        _STATE["references"].clear()
-        _STATE["braille_ppns_cache"] = None
-
-    _STATE["current_volume_path"] = brf_path
-
     braille_ppns = extract_braille_ppns_from_text(text)
 
     if not braille_ppns:
@@ -837,22 +876,22 @@ def _prepare_volume_references(
             NotifyLevel.WARN,
             lambda: "No braille page numbers found in text for PDF validation"
         )
-        return False
+        return {}
 
-    _STATE["references"] = create_images_references(
+    references = create_images_references(
         brf_path,
         volume_context.output_path,
         volume_context.images_path,
         braille_ppns,
         volume_context.page_layout,
+        session.pdf_pages,
     )
 
-    if not _STATE["references"]:
+    if not references:
         logging.warning("No valid PDF references created for volume %s",
                       brf_path)
-        return False
 
-    return True
+    return references
 
 
 def _extract_braille_page(line_match: re.Match) -> str:
@@ -885,9 +924,9 @@ def _consume_page_text(
     return page_text, new_cursor
 
 
-def _build_pdf_object_tags(braille_page: str) -> str:
+def _build_pdf_object_tags(braille_page: str, references: dict[str, list[str]]) -> str:
     object_text = "<?blank-line?>\n"
-    for file_ref in _STATE["references"][braille_page]:
+    for file_ref in references[braille_page]:
         object_text += (
             f'<object data="{Path(file_ref).as_posix()}" '
             f'type="application/pdf" height="250" width="100" '
@@ -904,7 +943,8 @@ def create_images_references(
     images_path: str,
     braille_ppns: Set[str],
     page_layout: PageLayout = PageLayout(),
-) -> dict[str, str]:
+    pdf_pages: PdfPageIndex | None = None,
+) -> dict[str, list[str]]:
     """
     Creates the PDF files and the references dictionary using simplified PPN matching.
 
@@ -916,15 +956,11 @@ def create_images_references(
         output_path: Output directory path
         images_path: Path to the images/PDF files to process
         braille_ppns: Set of known braille page numbers
+        pdf_pages: The pages of the PDFs already analysed for the conversion, when None the PDFs are analysed again
 
     Returns:
         Dictionary mapping braille PPNs to their corresponding PDF file paths
     """
-    # Check if we've already processed this combination
-    cache_key = f"{brf_path}_{images_path}_{page_layout}"
-    if cache_key in _STATE["pdf_cache"]:
-        return _STATE["pdf_cache"][cache_key]
-
     ebrf_folder = os.path.split(output_path)[0]
     in_filename_base = os.path.split(brf_path)[1].split(".")[0]
 
@@ -938,13 +974,18 @@ def create_images_references(
 
     # Convert braille PPNs set to list for reverse iteration
     braille_ppns_list = list(braille_ppns)
+    # Built once for the volume and used for all pages.
+    ppn_matcher = _PpnMatcher(braille_ppns_list)
+    if pdf_pages is None:
+        pdf_pages = PdfPageIndex()
 
+    references: dict[str, list[str]] = {}
     processed_pages = 0
     matched_pages = 0
 
     for image_file in images_files:
         pages_processed, pages_matched = _process_image_file(
-            image_file, ebrf_folder, braille_ppns_list, page_layout)
+            image_file, ebrf_folder, ppn_matcher, page_layout, pdf_pages, references)
         processed_pages += pages_processed
         matched_pages += pages_matched
 
@@ -952,9 +993,7 @@ def create_images_references(
     _log_processing_summary(
         in_filename_base, processed_pages, matched_pages, braille_ppns)
 
-    # Cache the results
-    _STATE["pdf_cache"][cache_key] = _STATE["references"]
-    return _STATE["references"]
+    return references
 
 
 def create_pdf_graphic_detector(
@@ -962,6 +1001,7 @@ def create_pdf_graphic_detector(
     output_path: str,
     images_path: str,
     page_layout: PageLayout = PageLayout(),
+    session: GraphicsSession | None = None,
 ) -> Callable[[str, ParserContext], str] | None:
     """
     Creates a detector for finding graphic page numbers and matching with PDF pages.
@@ -970,16 +1010,13 @@ def create_pdf_graphic_detector(
         brf_path: Path to the BRF file being processed
         output_path: Output path for the processed files
         images_path: Path to images folder or None if no images
+        session: The graphics session of the conversion, when None the detector has its own session
 
     Returns:
         Parser function for detecting and processing PDF graphics, or None if no images
     """
-
-    # Reset cache when detector is created (indicates new processing run)
-    if _STATE["current_volume_path"] != brf_path:
-        logging.info("New detector created for %s, resetting volume tracking",
-                    brf_path)
-        reset_pdf_detector_cache()
+    if session is None:
+        session = GraphicsSession()
 
     volume_context = _VolumeReferenceContext(
         brf_path=brf_path,
@@ -987,17 +1024,23 @@ def create_pdf_graphic_detector(
         images_path=images_path,
         page_layout=page_layout,
     )
+    # The references of the volume, found when the detector is first used.
+    references: dict[str, list[str]] | None = None
 
     def detect_pdf(text: str, parser_context: ParserContext) -> str:
         """
         Detect and process PDF graphics within the text.
         This inner function handles the actual detection and replacement logic.
         """
-        if not _prepare_volume_references(
-            text,
-            parser_context,
-            volume_context,
-        ):
+        nonlocal references
+        if references is None:
+            references = _create_volume_references(
+                text,
+                parser_context,
+                volume_context,
+                session,
+            )
+        if not references:
             return text
 
         # Process the text and create objects
@@ -1008,13 +1051,13 @@ def create_pdf_graphic_detector(
             result_text += text[new_cursor:start_page]
             new_cursor = start_page
             braille_page = _extract_braille_page(line)
-            braille_page = _get_reference_key(braille_page, _STATE["references"])
-            if braille_page in _STATE["references"]:
+            braille_page = _get_reference_key(braille_page, references)
+            if braille_page in references:
                 page_text, new_cursor = _consume_page_text(
                     text, start_page, new_cursor)
                 result_text += page_text
-                result_text += _build_pdf_object_tags(braille_page)
-                del _STATE["references"][braille_page]
+                result_text += _build_pdf_object_tags(braille_page, references)
+                del references[braille_page]
 
         return f"{result_text}{text[new_cursor:]}"
 
@@ -8,7 +8,7 @@
 
 import re
 
-from brf2ebrl.parser import DetectionState, DetectionResult, Detector
+from brf2ebrl.parser import DetectionState, DetectionResult, Detector, detector_hints
 from brf2ebrl.utils import find_end_of_element
 
 _PRINT_PAGE_RE = re.compile("<\\?print-page (?P<page_number>[\u2800-\u28ff]*)\\?>")
@@ -19,12 +19,15 @@ _NON_NESTED_BLOCKS_RE = re.compile("((<\\?blank-line\\?>)|\n)*<(?P<tag_name>(h[1
 def create_ebrf_print_page_tags() -> Detector:
     """Create detector to convert print page numbers to ebrf tags."""
 
+    def next_print_page(text: str, cursor: int, _: DetectionState) -> int:
+        m = _PRINT_PAGE_RE.search(text, cursor + 1)
+        return m.start() if m else len(text)
+
+    @detector_hints(first_chars="<", max_confidence=0.9, next_match=next_print_page)
     def convert_to_ebrf_print_page_numbers(text: str, cursor: int, state: DetectionState,
-                                           output_text: str) -> DetectionResult | None:
+                                           output_text: str = "") -> DetectionResult | None:
         new_text = output_text
-        if m := _PRINT_PAGE_RE.search(text, cursor):
-            if m.start() > cursor:
-                new_text += text[cursor:m.start()]
+        if m := _PRINT_PAGE_RE.match(text, cursor):
             page_number = m.group("page_number")
             tag_start = m.end()
             if _FIND_FOLLOWING_BLOCK_RE.match(text, tag_start):
@@ -34,6 +37,6 @@ def create_ebrf_print_page_tags() -> Detector:
                                            f"{new_text}<div class=\"keeptgr\"><span role=\"doc-pagebreak\" class=\"keepwithnext\">{page_number}</span>{text[tag_start:end_index]}</div>")
             return DetectionResult(tag_start, state, 0.9,
                                    f"{new_text}<span role=\"doc-pagebreak\">{page_number}</span>")
-        return DetectionResult(len(text), state, 0.5, f"{new_text}{text[cursor:]}")
+        return None
 
     return convert_to_ebrf_print_page_numbers
@@ -5,12 +5,92 @@
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
 """Some common selectors for brf2ebrl."""
-from collections.abc import Iterable
+import math
+from collections.abc import Iterable, Sequence, Callable
+from typing import TypeVar
 
-from brf2ebrl.parser import Detector, DetectionResult, DetectionState
+from brf2ebrl.parser import Detector, DetectionResult, DetectionState, FragmentDetector, get_detector_hints
+
+_D = TypeVar("_D", bound=Callable)
 
 
 def most_confident_detector(text: str, cursor: int, state: DetectionState, output_text: str,
                             detectors: Iterable[Detector]) -> DetectionResult:
     """Selects the detector reporting the highest confidence level."""
     return max(filter(lambda x: x is not None, map(lambda x: x(text, cursor, state, output_text), detectors)), key=lambda d: d.confidence, default=DetectionResult(cursor + 1, state, 0.0, output_text + text[cursor]))
+
+
+def most_confident_fragment(text: str, cursor: int, state: DetectionState,
+                            detectors: Sequence[FragmentDetector]) -> DetectionResult | None:
+    """Selects the fragment detector reporting the highest confidence level, None if no detector matched."""
+    return max(filter(lambda x: x is not None, map(lambda x: x(text, cursor, state), detectors)), key=lambda d: d.confidence, default=None)
+
+
+def _evaluation_order(detectors: Sequence[_D]) -> tuple[tuple[float, int, _D], ...]:
+    """Order detectors by descending maximum confidence, detectors without a maximum coming first."""
+    bounds = (get_detector_hints(d).max_confidence for d in detectors)
+    return tuple(sorted(((math.inf if b is None else b, i, d) for i, (b, d) in enumerate(zip(bounds, detectors))),
+                        key=lambda x: (-x[0], x[1])))
+
+
+def _select_bounded(order: tuple[tuple[float, int, _D], ...],
+                    detect: Callable[[_D], DetectionResult | None]) -> DetectionResult | None:
+    """Select the most confident result, stopping once no remaining detector can give a better result.
+
+    As with max, the earliest detector wins when confidences are equal.
+    """
+    if len(order) == 1:
+        return detect(order[0][2])
+    best, best_index = None, -1
+    for bound, index, detector in order:
+        if best is not None and (bound < best.confidence or (bound == best.confidence and index > best_index)):
+            break
+        if (result := detect(detector)) is not None and (
+                best is None or result.confidence > best.confidence
+                or (result.confidence == best.confidence and index < best_index)):
+            best, best_index = result, index
+    return best
+
+
+def _select_detector(order: tuple[tuple[float, int, Detector], ...], text: str, cursor: int, state: DetectionState,
+                     output_text: str) -> DetectionResult:
+    result = _select_bounded(order, lambda d: d(text, cursor, state, output_text))
+    return result if result is not None else DetectionResult(cursor + 1, state, 0.0, output_text + text[cursor])
+
+
+def early_exit_most_confident_detector(text: str, cursor: int, state: DetectionState, output_text: str,
+                                       detectors: Sequence[Detector]) -> DetectionResult:
+    """Selects the same detector as most_confident_detector using the maximum confidence hints of the detectors.
+
+    Detectors are called in order of descending maximum confidence until none of the remaining can be selected.
+    Parsers work out the order once for the detectors of a pass through bind_detectors.
+    """
+    return _select_detector(_evaluation_order(detectors), text, cursor, state, output_text)
+
+
+def _bind_early_exit_detector(
+        detectors: Sequence[Detector]) -> Callable[[str, int, DetectionState, str], DetectionResult]:
+    order = _evaluation_order(detectors)
+    return lambda text, cursor, state, output_text: _select_detector(order, text, cursor, state, output_text)
+
+
+early_exit_most_confident_detector.bind_detectors = _bind_early_exit_detector
+
+
+def early_exit_most_confident_fragment(text: str, cursor: int, state: DetectionState,
+                                       detectors: Sequence[FragmentDetector]) -> DetectionResult | None:
+    """Selects the same fragment detector as most_confident_fragment using the maximum confidence hints.
+
+    Detectors are called in order of descending maximum confidence until none of the remaining can be selected.
+    Parsers work out the order once for the detectors of a pass through bind_detectors.
+    """
+    return _select_bounded(_evaluation_order(detectors), lambda d: d(text, cursor, state))
+
+
+def _bind_early_exit_fragment(
+        detectors: Sequence[FragmentDetector]) -> Callable[[str, int, DetectionState], DetectionResult | None]:
+    order = _evaluation_order(detectors)
+    return lambda text, cursor, state: _select_bounded(order, lambda d: d(text, cursor, state))
+
+
+early_exit_most_confident_fragment.bind_detectors = _bind_early_exit_fragment
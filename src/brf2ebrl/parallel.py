@@ -0,0 +1,201 @@
+#  Copyright (c) 2024. American Printing House for the Blind.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+"""Parsing volumes in parallel using a pool of processes."""
+import logging
+import multiprocessing
+import pickle
+import queue
+import threading
+import traceback
+from collections.abc import Callable, Mapping, Sequence
+from concurrent.futures import ProcessPoolExecutor, wait, Future
+from dataclasses import dataclass, replace
+from typing import Any
+
+from brf2ebrl.cache import PassCache, CacheStats
+from brf2ebrl.common.graphic_detectors import GraphicsSession
+from brf2ebrl.parser import ParserContext, ParserException, ParsingCancelledException, BUNDLER_OPTIONS, \
+    PassMetrics
+from brf2ebrl.plugin import Plugin, find_plugins
+from brf2ebrl.utils.ebrl import VolumeNavigation
+from brf2ebrl.utils.pdf import PdfPageIndex, PdfPage
+
+
+@dataclass(frozen=True)
+class VolumeJob:
+    """A volume to be parsed."""
+    index: int
+    brf: str
+    out_name: str
+    temp_file: str
+
+
+@dataclass(frozen=True)
+class VolumeResult:
+    """The result of parsing a volume, either the text or the details of a ParserException."""
+    text: str | None = None
+    error_text: str | None = None
+    error_details: str = ""
+    cache_stats: CacheStats | None = None
+    navigation: VolumeNavigation | None = None
+
+
+_worker_events: Any = None
+_worker_cancelled: Any = None
+_worker_plugins: dict[str, Plugin] = {}
+_worker_graphics_session: GraphicsSession | None = None
+
+
+def find_worker_plugin_reference(plugin: Plugin) -> str | Plugin | None:
+    """Find how a worker process can get the plugin, None if the plugin cannot be used in a worker process.
+
+    Plugins registered as entry points are found by their id, otherwise the plugin is sent when it can be pickled.
+    """
+    if plugin.id in find_plugins():
+        return plugin.id
+    try:
+        pickle.dumps(plugin)
+    except Exception:
+        logging.warning("Plugin %s cannot be used in worker processes, volumes will be parsed one at a time", plugin.id)
+        return None
+    return plugin
+
+
+def _init_worker(events, cancelled, pdf_page_cache: PassCache | None,
+                 pdf_pages: Mapping[tuple[str, str], tuple[PdfPage, ...]]):
+    global _worker_events, _worker_cancelled, _worker_graphics_session
+    _worker_events = events
+    _worker_cancelled = cancelled
+    # A pool is only used for one conversion, so PDFs are analysed once for all the volumes parsed by the worker.
+    # The volumes are already parsed in parallel, so the pages are not also analysed in another pool.
+    _worker_graphics_session = GraphicsSession(PdfPageIndex(cache=pdf_page_cache, pages=pdf_pages))
+
+
+def _resolve_plugin(plugin_reference: str | Plugin) -> Plugin:
+    if isinstance(plugin_reference, Plugin):
+        return plugin_reference
+    if plugin_reference not in _worker_plugins:
+        _worker_plugins.update(find_plugins())
+    return _worker_plugins[plugin_reference]
+
+
+def _parse_volume(plugin_reference: str | Plugin, job: VolumeJob, parser_passes: int | None,
+                  options: dict[str, Any], report_metrics: bool, report_detector_metrics: bool,
+                  pass_cache: PassCache | None) -> VolumeResult:
+    """Parse a volume in a worker process, reporting progress, notifications and metrics as events."""
+    from brf2ebrl import convert_brf2ebrl_str
+    put = _worker_events.put
+    # Detector metrics are sent along with the metrics of their pass so volumes being parsed at the same time
+    # cannot be interleaved between them.
+    pending_detector_metrics = []
+    navigation = []
+
+    def send_metrics(pass_metrics: PassMetrics):
+        put(("metrics", pass_metrics, pending_detector_metrics.copy()))
+        pending_detector_metrics.clear()
+    parser_context = ParserContext(
+        is_cancelled=_worker_cancelled.is_set,
+        notify=lambda level, msg: put(("notify", level, msg())),
+        options=options,
+        metrics=send_metrics if report_metrics else None,
+        detector_metrics=(lambda name, m: pending_detector_metrics.append((name, list(m))))
+        if report_detector_metrics else None,
+        # Stats are counted per volume and added to those of the calling process.
+        pass_cache=replace(pass_cache, stats=CacheStats()) if pass_cache is not None else None,
+        navigation=navigation.append,
+    )
+    cache_stats = parser_context.pass_cache.stats if pass_cache is not None else None
+    selected_parser = _resolve_plugin(plugin_reference).create_brf_parser(
+        brf_path=job.brf,
+        output_path=job.temp_file,
+        graphics_session=_worker_graphics_session,
+        **options
+    )[:parser_passes]
+    parser_steps = len(selected_parser)
+    try:
+        return VolumeResult(text=convert_brf2ebrl_str(
+            job.brf, selected_parser, progress_callback=lambda x: put(("progress", job.index, x / parser_steps)),
+            parser_context=parser_context), cache_stats=cache_stats, navigation=navigation[-1] if navigation else None)
+    except ParsingCancelledException:
+        raise
+    except ParserException as e:
+        return VolumeResult(error_text=e.text, error_details="".join(traceback.format_exception(e.__cause__ or e)),
+                            cache_stats=cache_stats)
+
+
+def _dispatch_events(events: queue.SimpleQueue, parser_context: ParserContext,
+                     progress_callback: Callable[[int, float], None]):
+    while True:
+        try:
+            event = events.get_nowait()
+        except queue.Empty:
+            return
+        match event:
+            case ("progress", index, fraction):
+                progress_callback(index, fraction)
+            case ("notify", level, msg):
+                parser_context.notify_str(level, msg)
+            case ("metrics", pass_metrics, pass_detector_metrics):
+                for name, detector_metrics in pass_detector_metrics:
+                    parser_context.detector_metrics(name, detector_metrics)
+                parser_context.metrics(pass_metrics)
+
+
+def parse_volumes_in_pool(plugin_reference: str | Plugin, jobs: Sequence[VolumeJob], workers: int,
+                          parser_passes: int | None, parser_context: ParserContext,
+                          progress_callback: Callable[[int, float], None],
+                          handle_result: Callable[[VolumeJob, VolumeResult], None],
+                          pdf_page_cache: PassCache | None = None,
+                          pdf_pages: Mapping[tuple[str, str], tuple[PdfPage, ...]] | None = None):
+    """Parse the volumes in a pool of processes, handling the results in the order of the jobs.
+
+    Progress, notifications and metrics from the workers are passed to the callbacks in the calling thread.
+    When cancelled, or handling a result raises, the workers are asked to stop and unstarted volumes are dropped.
+    Each worker has a graphics session for the conversion, starting with the PDF pages already analysed in pdf_pages
+    so PDFs shared by volumes are not analysed by every worker. Other PDFs are analysed in the worker, storing the
+    words of their pages in pdf_page_cache if given.
+    """
+    mp_context = multiprocessing.get_context()
+    worker_events = mp_context.Queue()
+    cancelled = mp_context.Event()
+    events = queue.SimpleQueue()
+
+    def forward_events():
+        while (event := worker_events.get()) is not None:
+            events.put(event)
+    forwarder = threading.Thread(target=forward_events, name="brf2ebrl-worker-events", daemon=True)
+    forwarder.start()
+    options = {k: v for k, v in parser_context.options.items() if k not in BUNDLER_OPTIONS}
+    try:
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs)), mp_context=mp_context,
+                                 initializer=_init_worker, initargs=(worker_events, cancelled, pdf_page_cache, pdf_pages or {})) as pool:
+            futures = [pool.submit(_parse_volume, plugin_reference, job, parser_passes, options,
+                                   parser_context.metrics is not None, parser_context.detector_metrics is not None,
+                                   parser_context.pass_cache)
+                       for job in jobs]
+            try:
+                for job, future in zip(jobs, futures):
+                    _wait_for_volume(future, cancelled, events, parser_context, progress_callback)
+                    handle_result(job, future.result())
+            except BaseException:
+                cancelled.set()
+                for future in futures:
+                    future.cancel()
+                raise
+    finally:
+        worker_events.put(None)
+        forwarder.join()
+        _dispatch_events(events, parser_context, progress_callback)
+
+
+def _wait_for_volume(future: Future, cancelled, events: queue.SimpleQueue, parser_context: ParserContext,
+                     progress_callback: Callable[[int, float], None]):
+    while not future.done():
+        _dispatch_events(events, parser_context, progress_callback)
+        if parser_context.is_cancelled():
+            cancelled.set()
+        wait([future], timeout=0.05)
+    _dispatch_events(events, parser_context, progress_callback)
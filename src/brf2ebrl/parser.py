@@ -6,12 +6,18 @@
 
 """Main parser framework for the brf2ebrl system."""
 import enum
+import itertools
 import logging
-from collections.abc import Iterable, Callable, Mapping
+import re
+import time
+from collections.abc import Iterable, Iterator, Callable, Mapping, Sequence
 from dataclasses import dataclass, field
 from enum import IntEnum
 from functools import cached_property
-from typing import Any
+from typing import Any, TypeVar
+
+from brf2ebrl.cache import PassCache
+from brf2ebrl.utils.ebrl import VolumeNavigation
 
 
 class EBrailleParserOptions(enum.StrEnum):
@@ -19,6 +25,14 @@ class EBrailleParserOptions(enum.StrEnum):
     images_path = "images_path"
     detect_running_heads = "detect_running_heads"
     metadata_entries = "metadata_entries"
+    compression_policy = "compression_policy"
+    pdf_workers = "pdf_workers"
+
+
+BUNDLER_OPTIONS = frozenset({EBrailleParserOptions.metadata_entries, EBrailleParserOptions.compression_policy})
+"""Options only used by the bundler, these do not change the output of the parser."""
+OUTPUT_INDEPENDENT_OPTIONS = BUNDLER_OPTIONS | {EBrailleParserOptions.pdf_workers}
+"""Options which do not change the output of the parser, so are not part of the pass cache scope."""
 
 
 class NotifyLevel(IntEnum):
@@ -29,11 +43,53 @@ class NotifyLevel(IntEnum):
     CRITICAL = 50
 
 
+@dataclass(frozen=True)
+class PassMetrics:
+    """Measurements from running a single parser pass on a volume."""
+
+    volume: str | None
+    pass_index: int
+    pass_name: str
+    wall_time: float
+    cpu_time: float
+    input_length: int
+    output_length: int
+    cached: bool = False
+    """Whether the output was taken from the pass cache."""
+
+    @property
+    def chars_per_second(self) -> float:
+        """The number of input characters processed per second."""
+        return self.input_length / self.wall_time if self.wall_time > 0 else 0.0
+
+
+@dataclass
+class DetectorMetrics:
+    """Counts and cumulative time of the calls to a detector in a parser pass.
+
+    The time of a detector combining other detectors includes the time of those detectors.
+    """
+
+    name: str
+    calls: int = 0
+    results: int = 0
+    wins: int = 0
+    time: float = 0.0
+
+
 @dataclass(frozen=True)
 class ParserContext:
     is_cancelled: Callable[[], bool] = field(default=lambda: False)
     notify: Callable[[NotifyLevel, Callable[[], str]], None] = field(default=lambda l,t: None)
     options: dict[str, Any] = field(default_factory=dict)
+    metrics: Callable[[PassMetrics], None] | None = None
+    """Receives the metrics of each parser pass, passes are only measured when this is set."""
+    detector_metrics: Callable[[str, Sequence[DetectorMetrics]], None] | None = None
+    """Receives the pass name and detector metrics of each detector pass, detectors are only instrumented when set."""
+    pass_cache: PassCache | None = None
+    """Cache of the outputs of cacheable passes, the cache scope should identify the plugin and options."""
+    navigation: Callable[[VolumeNavigation], None] | None = None
+    """Receives the headings and pages found whilst making the complete XHTML of the volume."""
     def check_cancelled(self):
         if self.is_cancelled():
             raise ParsingCancelledException()
@@ -45,6 +101,10 @@ class ParserContext:
 class Parser:
     name: str
     parse: Callable[[str, ParserContext], str]
+    cacheable: bool = True
+    """Whether the output only depends on the input text, passes with side effects should not be cached."""
+    parse_chunks: Callable[[Iterable[str], ParserContext], Iterable[str]] | None = None
+    """Optionally parses the text given as chunks into chunks, so the output need not be held in memory at once."""
 
 
 DetectionState = Mapping[str, Any]
@@ -97,23 +157,277 @@ class NamedDetectionResult(DetectionResult):
 
 
 Detector = Callable[[str, int, DetectionState, str], DetectionResult | None]
+"""Detects at the cursor, the result text is the output text given followed by the text the detector adds.
+
+Detectors run by detector_parser are always given an empty output text, not the output produced so far, so must
+not depend on the output of earlier detections. Use the state to carry information between detections instead.
+"""
 DetectionSelector = Callable[[str, int, DetectionState, str, Iterable[Detector]], DetectionResult]
+FragmentDetector = Callable[[str, int, DetectionState], DetectionResult | None]
+"""A detector whose result text is only the fragment it adds to the output."""
+FragmentSelector = Callable[[str, int, DetectionState, Sequence[FragmentDetector]], DetectionResult | None]
+"""Selects the fragment result to use, None means no detector matched at the cursor.
 
+A selector may have a bind_detectors attribute, a function taking the detectors and returning a function selecting
+from them given the other arguments. Parsers use it to do work depending only on the detectors once for the pass.
+The same applies to a DetectionSelector.
+"""
 
-def detector_parser(name: str, initial_state: DetectionState, detectors: Iterable[Detector], selector: DetectionSelector) -> Parser:
-    """A configuration for a single step in a multipass parsing."""
+
+@dataclass(frozen=True)
+class DetectorHints:
+    """Conditions at the cursor which are required for a detector to match.
+
+    Parsers use the hints to skip detectors which cannot match at a position, so hints must never exclude a
+    position where the detector would return a result.
+    """
+
+    line_start_only: bool = False
+    """The detector only matches at the start of the text or directly after a new line."""
+    first_chars: frozenset[str] | None = None
+    """The characters the detector can match starting with, None for any character."""
+    max_confidence: float | None = None
+    """The highest confidence of any result from the detector, None when not known."""
+    next_match: Callable[[str, int, DetectionState], int] | None = None
+    """Find the earliest position after the cursor where the detector could match with the state.
+
+    When given it is used instead of line_start_only and first_chars to find how far the parser may skip when no
+    detector matched, it should return the length of the text when the detector cannot match again.
+    """
+
+    @property
+    def restricts_position(self) -> bool:
+        """Whether the hints exclude any positions."""
+        return self.line_start_only or self.first_chars is not None
+
+
+_NO_HINTS = DetectorHints()
+_D = TypeVar("_D", bound=Callable)
+
+
+def detector_hints(*, line_start_only: bool = False, first_chars: Iterable[str] | None = None,
+                   max_confidence: float | None = None,
+                   next_match: Callable[[str, int, DetectionState], int] | None = None):
+    """Decorator to declare the hints of a detector."""
+    hints = DetectorHints(line_start_only=line_start_only,
+                          first_chars=None if first_chars is None else frozenset(first_chars),
+                          max_confidence=max_confidence, next_match=next_match)
+
+    def apply_hints(detector: _D) -> _D:
+        detector.detector_hints = hints
+        return detector
+    return apply_hints
+
+
+def get_detector_hints(detector: Callable) -> DetectorHints:
+    """Get the hints declared for a detector, detectors without hints may match anywhere."""
+    return getattr(detector, "detector_hints", _NO_HINTS)
+
+
+def merge_detector_hints(hints: Iterable[DetectorHints]) -> DetectorHints:
+    """Hints for a detector which matches wherever any detector with one of the given hints matches."""
+    hints = tuple(hints)
+    first_chars = None if any(h.first_chars is None for h in hints) else frozenset().union(
+        *(h.first_chars for h in hints))
+    max_confidence = None if any(h.max_confidence is None for h in hints) else max(
+        (h.max_confidence for h in hints), default=0.0)
+    next_match = _create_next_match(hints) if any(h.next_match is not None for h in hints) else None
+    return DetectorHints(line_start_only=all(h.line_start_only for h in hints),
+                         first_chars=first_chars, max_confidence=max_confidence, next_match=next_match)
+
+
+def _create_next_match(hints: Sequence[DetectorHints]) -> Callable[[str, int, DetectionState], int] | None:
+    """Create a function finding the earliest position after the cursor where a detector with the hints could match.
+
+    None is returned when one of the detectors may match anywhere.
+    """
+    if any(h.next_match is None and not h.restricts_position for h in hints):
+        return None
+    patterns = []
+    for h in hints:
+        if h.next_match is None and h.first_chars != frozenset():
+            chars = "[" + "".join(re.escape(c) for c in sorted(h.first_chars)) + "]" if h.first_chars is not None else ""
+            patterns.append(f"(?<=\n){chars}" if h.line_start_only else chars)
+    pattern = re.compile("|".join(patterns)) if patterns else None
+    next_match_functions = tuple(h.next_match for h in hints if h.next_match is not None)
+
+    def next_match(text: str, cursor: int, state: DetectionState) -> int:
+        found = len(text)
+        if pattern is not None and (m := pattern.search(text, cursor + 1)):
+            found = m.start()
+        for next_match_function in next_match_functions:
+            found = min(found, next_match_function(text, cursor, state))
+        return found
+    return next_match
+
+
+_T = TypeVar("_T")
+
+
+def _create_candidates_lookup(detectors: tuple[_D, ...],
+                              bind: Callable[[tuple[_D, ...]], _T]) -> Callable[[str, int], _T] | None:
+    """Create a lookup of bind applied to the detectors which may match at a position, None when no detector has hints.
+
+    The candidates are keyed by whether the cursor is at a line start and the character at the cursor, the
+    table being filled as keys are encountered. Candidates keep the order of the detectors.
+    """
+    hints = tuple(get_detector_hints(d) for d in detectors)
+    if not any(h.restricts_position for h in hints):
+        return None
+    table: dict[tuple[bool, str], _T] = {}
+    bound: dict[tuple[_D, ...], _T] = {}
+
+    def candidates(text: str, cursor: int) -> _T:
+        key = (cursor == 0 or text[cursor - 1] == "\n", text[cursor])
+        if (found := table.get(key)) is None:
+            line_start, char = key
+            selectable = tuple(
+                d for d, h in zip(detectors, hints)
+                if (line_start or not h.line_start_only) and (h.first_chars is None or char in h.first_chars))
+            if (found := bound.get(selectable)) is None:
+                found = bound[selectable] = bind(selectable)
+            table[key] = found
+        return found
+    return candidates
+
+
+def fragment_detector(detector: Detector) -> FragmentDetector:
+    """Adapt a Detector so it can be used where a FragmentDetector is required.
+
+    The detector is given an empty output text, so the text of its result is only the fragment it adds.
+    """
+    def detect(text: str, cursor: int, state: DetectionState) -> DetectionResult | None:
+        return detector(text, cursor, state, "")
+    detect.detector_hints = get_detector_hints(detector)
+    return detect
+
+
+_Select = Callable[[str, int, DetectionState], DetectionResult | None]
+
+
+def _run_detectors(text: str, parser_context: ParserContext, initial_state: DetectionState, select: _Select,
+                   next_match: Callable[[str, int, DetectionState], int] | None) -> str:
+    fragments: list[str] = []
+    cursor, state = 0, initial_state
+    while cursor < len(text):
+        parser_context.check_cancelled()
+        result = select(text, cursor, state)
+        if result is None:
+            next_cursor = max(next_match(text, cursor, state), cursor + 1) if next_match else cursor + 1
+            fragments.append(text[cursor:next_cursor])
+            cursor = next_cursor
+            continue
+        assert cursor != result.cursor or state != result.state, f"Input conditions not changed by detector, cursor={cursor}, state={state}, selected detector={result}"
+        fragments.append(result.text)
+        cursor, state = result.cursor, result.state
+    return "".join(fragments)
+
+
+def _detector_name(detector: Callable) -> str:
+    return getattr(detector, "__name__", type(detector).__name__)
+
+
+def _instrument_detector(detector: _D, name: str, metrics: list[DetectorMetrics],
+                         results: list[tuple[DetectionResult, DetectorMetrics]]) -> _D:
+    """Wrap a detector to count its calls and results, results are recorded so wins can be counted.
+
+    Detectors with a wrap_detectors attribute have the detectors they combine instrumented as well.
+    """
+    detector_metrics = DetectorMetrics(name)
+    metrics.append(detector_metrics)
+    if (wrap_detectors := getattr(detector, "wrap_detectors", None)) is not None:
+        inner_index = itertools.count()
+        detector = wrap_detectors(lambda d: _instrument_detector(
+            d, f"{name}/{next(inner_index)}:{_detector_name(d)}", metrics, results))
+
+    def instrumented(*args):
+        start = time.perf_counter()
+        try:
+            result = detector(*args)
+        finally:
+            detector_metrics.time += time.perf_counter() - start
+        detector_metrics.calls += 1
+        if result is not None:
+            detector_metrics.results += 1
+            results.append((result, detector_metrics))
+        return result
+    instrumented.detector_hints = get_detector_hints(detector)
+    return instrumented
+
+
+def _builder_parser(name: str, initial_state: DetectionState, detectors: tuple[_D, ...],
+                    create_select: Callable[[tuple[_D, ...]], _Select]) -> Parser:
+    """Create a parser running the detectors using the select function created for them.
+
+    When the parser context has a detector metrics sink the run uses instrumented detectors, otherwise the
+    detectors are called directly.
+    """
+    select = create_select(detectors)
+    next_match = _create_next_match([get_detector_hints(d) for d in detectors])
 
     def run_detectors(text: str, parser_context: ParserContext) -> str:
-        text_builder, cursor, state = "", 0, initial_state
-        while cursor < len(text):
-            parser_context.check_cancelled()
-            result = selector(text, cursor, state, text_builder, detectors)
-            assert cursor != result.cursor or state != result.state, f"Input conditions not changed by detector, cursor={cursor}, state={state}, selected detector={result}"
-            text_builder, cursor, state = result.text, result.cursor, result.state
-        return text_builder
+        if parser_context.detector_metrics is None:
+            return _run_detectors(text, parser_context, initial_state, select, next_match)
+        metrics: list[DetectorMetrics] = []
+        results: list[tuple[DetectionResult, DetectorMetrics]] = []
+        instrumented_select = create_select(tuple(
+            _instrument_detector(d, f"{i}:{_detector_name(d)}", metrics, results) for i, d in enumerate(detectors)))
+
+        def select_and_count_wins(text: str, cursor: int, state: DetectionState) -> DetectionResult | None:
+            selected = instrumented_select(text, cursor, state)
+            for result, detector_metrics in results:
+                if result is selected:
+                    detector_metrics.wins += 1
+            results.clear()
+            return selected
+        try:
+            return _run_detectors(text, parser_context, initial_state, select_and_count_wins, next_match)
+        finally:
+            parser_context.detector_metrics(name, metrics)
     return Parser(name=name, parse=run_detectors)
 
 
+def fragment_parser(name: str, initial_state: DetectionState, detectors: Iterable[FragmentDetector],
+                    selector: FragmentSelector) -> Parser:
+    """A single step in a multipass parsing where the detectors only return the fragment they add.
+
+    The output is built by appending the fragments, so the cost of a step does not depend on the output so far.
+    When the selector returns None the character at the cursor is copied to the output.
+    Only the detectors whose hints allow a match at the cursor are given to the selector, and when the selector
+    returns None the text up to where the hints allow the next match is copied in one step.
+    """
+    def bind(selectable: tuple[FragmentDetector, ...]) -> _Select:
+        if (bind_detectors := getattr(selector, "bind_detectors", None)) is not None:
+            return bind_detectors(selectable)
+        return lambda text, cursor, state: selector(text, cursor, state, selectable)
+
+    def create_select(selectable: tuple[FragmentDetector, ...]) -> _Select:
+        if (candidates := _create_candidates_lookup(selectable, bind)) is None:
+            return bind(selectable)
+        return lambda text, cursor, state: candidates(text, cursor)(text, cursor, state)
+    return _builder_parser(name, initial_state, tuple(detectors), create_select)
+
+
+def detector_parser(name: str, initial_state: DetectionState, detectors: Iterable[Detector], selector: DetectionSelector) -> Parser:
+    """A configuration for a single step in a multipass parsing.
+
+    The selector is always given an empty output text and the text of the result it returns is appended to the
+    output, so detectors must return the output text they were given followed by the text they add.
+    Only the detectors whose hints allow a match at the cursor are given to the selector.
+    """
+    def bind(selectable: tuple[Detector, ...]) -> Callable[[str, int, DetectionState, str], DetectionResult]:
+        if (bind_detectors := getattr(selector, "bind_detectors", None)) is not None:
+            return bind_detectors(selectable)
+        return lambda text, cursor, state, output_text: selector(text, cursor, state, output_text, selectable)
+
+    def create_select(selectable: tuple[Detector, ...]) -> _Select:
+        if (candidates := _create_candidates_lookup(selectable, bind)) is None:
+            select = bind(selectable)
+            return lambda text, cursor, state: select(text, cursor, state, "")
+        return lambda text, cursor, state: candidates(text, cursor)(text, cursor, state, "")
+    return _builder_parser(name, initial_state, tuple(detectors), create_select)
+
+
 class ParsingCancelledException(Exception):
     pass
 
@@ -123,19 +437,159 @@ class ParserException(Exception):
         self.file_name = None
 
 def parse(brf: str, parser_passes: Iterable[Parser], progress_callback: Callable[[int], None] = lambda x: None,
-          parser_context: ParserContext = ParserContext()) -> str:
-    """Perform a parse of the BRF according to the steps in the parser configuration."""
+          parser_context: ParserContext = ParserContext(), volume: str | None = None) -> str:
+    """Perform a parse of the BRF according to the steps in the parser configuration.
+
+    When the parser context has a metrics sink the metrics of each pass are reported for the named volume.
+    """
+    logging.info("Starting parsing")
+    text = _run_passes(brf, enumerate(parser_passes), progress_callback, parser_context, volume)
+    logging.info(f"Finished parsing")
+    return text
+
+
+def parse_chunks(brf: str, parser_passes: Iterable[Parser], progress_callback: Callable[[int], None] = lambda x: None,
+                 parser_context: ParserContext = ParserContext(), volume: str | None = None) -> Iterator[str]:
+    """Perform a parse of the BRF, producing the output as chunks.
+
+    The trailing passes which are able to parse chunks are run as the chunks are consumed, so the output is never
+    held in memory as a whole. Problems in those passes are raised whilst consuming the chunks, the text of the
+    ParserException is the input of the first of those passes, being the last text held as a whole.
+    """
+    parser_passes = list(parser_passes)
+    stream_start = len(parser_passes)
+    while stream_start > 0 and parser_passes[stream_start - 1].parse_chunks is not None:
+        stream_start -= 1
     logging.info("Starting parsing")
-    text = brf
-    for i, parser_pass in enumerate(parser_passes):
+    text = _run_passes(brf, itertools.islice(enumerate(parser_passes), stream_start), progress_callback,
+                       parser_context, volume)
+    chunks = iter([text])
+    input_length = len(text)
+    error_text = text
+    upstream = None
+    for i, parser_pass in itertools.islice(enumerate(parser_passes), stream_start, None):
         parser_context.check_cancelled()
         progress_callback(i)
-        logging.info(f"Processing pass {parser_pass.name}")
+        logging.info(f"Processing pass {parser_pass.name} as chunks")
+        stats = _StreamedPassStats()
+        start_wall, start_cpu = time.perf_counter(), time.thread_time()
         try:
-            text = parser_pass.parse(text, parser_context)
+            pass_chunks = iter(parser_pass.parse_chunks(chunks, parser_context))
         except ParsingCancelledException as e:
             raise e
         except Exception as e:
-            raise ParserException(text=text) from e
-    logging.info(f"Finished parsing")
+            raise ParserException(text=error_text) from e
+        stats.start_wall_time, stats.start_cpu_time = time.perf_counter() - start_wall, time.thread_time() - start_cpu
+        chunks = _stream_pass(pass_chunks, i, parser_pass, parser_context, volume, stats, upstream, input_length,
+                              error_text)
+        upstream = stats
+    return chunks
+
+
+def _run_passes(text: str, parser_passes: Iterable[tuple[int, Parser]], progress_callback: Callable[[int], None],
+                parser_context: ParserContext, volume: str | None) -> str:
+    for i, parser_pass in parser_passes:
+        parser_context.check_cancelled()
+        progress_callback(i)
+        logging.info(f"Processing pass {parser_pass.name}")
+        if parser_context.metrics is not None:
+            start_wall, start_cpu = time.perf_counter(), time.thread_time()
+        pass_cache = parser_context.pass_cache if parser_pass.cacheable else None
+        cache_key = pass_cache.key(text, parser_pass.name) if pass_cache is not None else None
+        new_text = pass_cache.get(cache_key) if pass_cache is not None else None
+        cached = new_text is not None
+        if not cached:
+            try:
+                new_text = parser_pass.parse(text, parser_context)
+            except ParsingCancelledException as e:
+                raise e
+            except Exception as e:
+                raise ParserException(text=text) from e
+            if pass_cache is not None:
+                pass_cache.put(cache_key, new_text)
+        if parser_context.metrics is not None:
+            parser_context.metrics(PassMetrics(volume=volume, pass_index=i, pass_name=parser_pass.name,
+                                               wall_time=time.perf_counter() - start_wall,
+                                               cpu_time=time.thread_time() - start_cpu,
+                                               input_length=len(text), output_length=len(new_text),
+                                               cached=cached))
+        text = new_text
     return text
+
+
+@dataclass
+class _StreamedPassStats:
+    """Time spent starting a pass and getting chunks from it, the latter includes the passes before it."""
+    start_wall_time: float = 0.0
+    start_cpu_time: float = 0.0
+    wall_time: float = 0.0
+    cpu_time: float = 0.0
+    output_length: int = 0
+
+
+def _stream_pass(chunks: Iterator[str], index: int, parser_pass: Parser, parser_context: ParserContext,
+                 volume: str | None, stats: _StreamedPassStats, upstream: _StreamedPassStats | None,
+                 first_input_length: int, error_text: str) -> Iterator[str]:
+    try:
+        while True:
+            parser_context.check_cancelled()
+            start_wall, start_cpu = time.perf_counter(), time.thread_time()
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                break
+            finally:
+                stats.wall_time += time.perf_counter() - start_wall
+                stats.cpu_time += time.thread_time() - start_cpu
+            stats.output_length += len(chunk)
+            yield chunk
+    except (ParsingCancelledException, ParserException):
+        raise
+    except Exception as e:
+        parser_exception = ParserException(text=error_text)
+        parser_exception.add_note(f"Problem in pass {parser_pass.name} whilst producing the output")
+        raise parser_exception from e
+    if parser_context.metrics is not None:
+        parser_context.metrics(PassMetrics(
+            volume=volume, pass_index=index, pass_name=parser_pass.name,
+            wall_time=stats.start_wall_time + stats.wall_time - (upstream.wall_time if upstream else 0.0),
+            cpu_time=stats.start_cpu_time + stats.cpu_time - (upstream.cpu_time if upstream else 0.0),
+            input_length=upstream.output_length if upstream else first_input_length,
+            output_length=stats.output_length))
+
+
+def replace_parser(name: str, replacements: Sequence[tuple[str, str]]) -> Parser:
+    """Create a parser which replaces each old string with the new string in turn, which is able to parse chunks.
+
+    The old strings must not be able to overlap themselves, such as "aa", as chunks are replaced separately.
+    """
+    for old, _ in replacements:
+        if not old or any(old[:k] == old[-k:] for k in range(1, len(old))):
+            raise ValueError(f"Replacing {old!r} is not supported as it may overlap itself")
+
+    def parse_text(text: str, _: ParserContext) -> str:
+        for old, new in replacements:
+            text = text.replace(old, new)
+        return text
+
+    def parse_text_chunks(chunks: Iterable[str], _: ParserContext) -> Iterator[str]:
+        for old, new in replacements:
+            chunks = _replace_chunks(chunks, old, new)
+        return iter(chunks)
+    return Parser(name, parse_text, parse_chunks=parse_text_chunks)
+
+
+def _replace_chunks(chunks: Iterable[str], old: str, new: str) -> Iterator[str]:
+    keep = len(old) - 1
+    pending = ""
+    for chunk in chunks:
+        text = pending + chunk
+        cut = max(len(text) - keep, 0)
+        # As old cannot overlap itself, only one match can cross the cut, which is moved to after it.
+        if keep and (i := text.find(old, max(cut - keep, 0))) != -1 and i < cut:
+            cut = i + len(old)
+        pending = text[cut:]
+        if cut > 0:
+            yield text[:cut].replace(old, new)
+    if pending:
+        yield pending.replace(old, new)
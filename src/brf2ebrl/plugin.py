@@ -6,17 +6,20 @@
 """Module used when defining a plugin."""
 import os
 import shutil
+import tempfile
+import time
+import zlib
 from abc import abstractmethod, ABC
 from collections import Counter, deque
 from collections.abc import Iterable
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
 from datetime import date, datetime, UTC
 from importlib import resources
-from importlib.metadata import entry_points
+from importlib.metadata import entry_points, version, PackageNotFoundError
 from mimetypes import MimeTypes
 from pathlib import Path
-from typing import Sequence, AnyStr
-from zipfile import ZipFile, ZIP_DEFLATED, ZIP_STORED
+from typing import Sequence, AnyStr, BinaryIO
+from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED, ZIP_STORED, ZIP64_LIMIT
 
 import lxml.html
 from lxml import etree
@@ -24,11 +27,18 @@ from lxml.builder import ElementMaker
 
 from brf2ebrl.parser import Parser
 from brf2ebrl.utils import list_sub_paths
-from brf2ebrl.utils.ebrl import create_navigation_html, PageRef, HeadingRef
-from brf2ebrl.utils.metadata import DEFAULT_METADATA, MetadataItem, ensure_default_metadata
+from brf2ebrl.utils.ebrl import create_navigation_html, VolumeNavigation, find_volume_navigation
+from brf2ebrl.utils.metadata import MetadataItem, ensure_default_metadata
 from brf2ebrl.utils.opf import PACKAGE, METADATA, MANIFEST, SPINE, ITEM, ITEMREF, META, FORMAT, DATE
+from brf2ebrl.utils.zip import ParallelZipWriter
 
-_HEADING_TAGS = ("h1", "h2", "h3", "h4", "h5", "h6")
+
+def package_version(distribution: str) -> str:
+    """The version of an installed distribution, an empty string if the distribution is not installed."""
+    try:
+        return version(distribution)
+    except PackageNotFoundError:
+        return ""
 
 
 def find_plugins():
@@ -63,6 +73,22 @@ class Bundler(ABC):
         """Write a volume to the bundle."""
         self.write_str(name, data, True)
 
+    def write_volume_chunks(self, name: str, chunks: Iterable[str]):
+        """Write a volume given as chunks of its text to the bundle.
+
+        Bundlers which can write the chunks as they are produced should override this, by default the chunks are
+        joined and given to write_volume.
+        """
+        self.write_volume(name, "".join(chunks))
+
+    def add_volume_navigation(self, name: str, navigation: VolumeNavigation):
+        """Give the headings, pages and title of a volume written to the bundle.
+
+        Called after write_volume when the parser found the navigation, saving bundlers finding it in the volume.
+        Bundlers which do not use the navigation may ignore it.
+        """
+        pass
+
     @abstractmethod
     def close(self):
         """Close the bundle."""
@@ -92,8 +118,21 @@ class OpfFileEntry:
     is_nav_document: bool = False
 
 
+@dataclass(frozen=True)
+class CompressionPolicy:
+    """How the entries of an eBraille package are compressed, based upon their media type."""
+    level: int = zlib.Z_DEFAULT_COMPRESSION
+    """The deflate level from 0 to 9, or -1 for the zlib default."""
+    stored_media_types: frozenset[str] = frozenset(
+        {"application/pdf", "image/png", "image/jpeg", "image/gif", "image/webp"})
+    """Media types which are already compressed and so are stored without compressing."""
+
+    def compress_type(self, media_type: str) -> int:
+        return ZIP_STORED if media_type in self.stored_media_types else ZIP_DEFLATED
+
+
 def _create_opf_str(file_entries: dict[str, OpfFileEntry],
-                    metadata_entries: Iterable[MetadataItem] = DEFAULT_METADATA) -> bytes:
+                    metadata_entries: Iterable[MetadataItem] = ()) -> bytes:
     files_list = [(f"file{i}", n, d.media_type, d.in_spine, d.is_nav_document) for i, (n, (d)) in
                   enumerate(file_entries.items())]
     graphic_types = " ".join(sorted(
@@ -120,92 +159,262 @@ def _create_opf_str(file_entries: dict[str, OpfFileEntry],
     return etree.tostring(opf, xml_declaration=True, pretty_print=True, encoding="UTF-8")
 
 
-class EBrlZippedBundler(Bundler):
-    def __init__(self, name: str, metadata_entries: Iterable[MetadataItem] = DEFAULT_METADATA, *args, **kwargs):
+class _EBrlBundler(Bundler, ABC):
+    """Base class for bundlers writing the eBraille package layout."""
+
+    def __init__(self, metadata_entries: Iterable[MetadataItem] = ()):
         self._files: dict[str, OpfFileEntry] = {}
+        self._navigation: dict[str, VolumeNavigation] = {}
         self.metadata_entries = metadata_entries
-        self._zipfile = ZipFile(name, 'w', compression=ZIP_DEFLATED)
-        self._zipfile.writestr("mimetype", b"application/epub+zip", compress_type=ZIP_STORED)
+
+    def _write_static_files(self):
         files = resources.files("brf2ebrl.ebrl.static")
         for k, v in list_sub_paths(files):
             if v.is_file():
                 self.write_file("/".join(k[1:]), v, add_to_spine=False)
 
+    @abstractmethod
+    def _open_volume(self, name: str) -> BinaryIO:
+        """Open a volume already written to the bundle for reading."""
+        pass
+
+    @abstractmethod
+    def _write_chunks(self, name: str, chunks: Iterable[str], add_to_spine: bool, media_type: str | None = None):
+        """Write a file from chunks of text, the file should only be added to the files once complete.
+
+        A problem producing the chunks should not leave a partial file in the bundle.
+        """
+        pass
+
+    def _find_navigation(self, vol_name: str) -> VolumeNavigation:
+        if (navigation := self._navigation.get(vol_name)) is not None:
+            # eBraille uses regular spaces, the volume text had U+2800 replaced after the navigation was found.
+            return VolumeNavigation(
+                title=navigation.title.replace("\u2800", " "),
+                heading_refs=tuple(replace(h, heading_braille=h.heading_braille.replace("\u2800", " "))
+                                   for h in navigation.heading_refs),
+                page_refs=tuple(replace(p, page_num_braille=p.page_num_braille.replace("\u2800", " "))
+                                for p in navigation.page_refs))
+        with self._open_volume(vol_name) as f:
+            return find_volume_navigation(lxml.html.parse(f, parser=lxml.html.xhtml_parser).getroot())
+
     def _create_navigation_html(self, opf_name: str) -> str:
         page_refs = []
         headings = deque()
         vols = [k for k, v in self._files.items() if v.in_spine]
         detected_title = None
         for vol_name in vols:
-            with self._zipfile.open(vol_name) as f:
-                root = lxml.html.parse(f, parser=lxml.html.xhtml_parser).getroot()
-                if detected_title is None:
-                    detected_title = next((x.text_content for x in root.body.iter(tag=["li", *_HEADING_TAGS, "p"])), "")
-                for element in root.iter():
-                    if element.tag in _HEADING_TAGS:
-                        heading_id = element.get("id")
-                        headings.append(
-                            HeadingRef(href=f"{vol_name}#{heading_id}", heading_braille=element.text_content, level=(
-                                    _HEADING_TAGS.index(element.tag) + 1)))
-                    elif element.tag == "span" and element.get("role") == "doc-pagebreak":
-                        page_id = element.get("id")
-                        page_refs.append(
-                            PageRef(href=f"{vol_name}#{page_id}", page_num_braille=element.text_content(), title=""))
+            navigation = self._find_navigation(vol_name)
+            if detected_title is None:
+                detected_title = navigation.title
+            headings.extend(replace(h, href=f"{vol_name}{h.href}") for h in navigation.heading_refs)
+            page_refs.extend(replace(p, href=f"{vol_name}{p.href}") for p in navigation.page_refs)
         if detected_title is None:
             detected_title = ""
         return create_navigation_html(opf_name=opf_name, page_refs=page_refs, heading_refs=headings,
                                       braille_title=detected_title)
 
-    def _add_to_files(self, name, add_to_spine, tactile_graphic: bool, is_nav_document: bool,
-                      media_type: str | None = None):
+    def _write_navigation(self):
+        self.write_str("index.html", self._create_navigation_html(_OPF_NAME), True, is_nav_document=True,
+                       media_type="application/xhtml+xml")
+
+    def _create_package_files(self) -> list[tuple[str, bytes]]:
+        return [(_OPF_NAME, _create_opf_str(self._files, metadata_entries=self.metadata_entries)),
+                ("META-INF/container.xml", _create_container_xml(_OPF_NAME))]
+
+    def _create_file_entry(self, name, add_to_spine, tactile_graphic: bool, is_nav_document: bool,
+                           media_type: str | None = None) -> OpfFileEntry:
         def get_media_type():
             yield media_type
             yield _MIMETYPES.guess_type(name)[0]
             yield "application/octet-stream"
 
         media_type = next(m for m in get_media_type() if m is not None)
-        self._files[name] = OpfFileEntry(media_type=media_type,
-                                         in_spine=add_to_spine, tactile_graphic=tactile_graphic,
-                                         is_nav_document=is_nav_document)
+        return OpfFileEntry(media_type=media_type, in_spine=add_to_spine, tactile_graphic=tactile_graphic,
+                            is_nav_document=is_nav_document)
+
+    def _add_to_files(self, name, add_to_spine, tactile_graphic: bool, is_nav_document: bool,
+                      media_type: str | None = None) -> OpfFileEntry:
+        entry = self._files[name] = self._create_file_entry(name, add_to_spine, tactile_graphic, is_nav_document,
+                                                            media_type)
+        return entry
+
+    def write_image(self, name: str, filename: str):
+        self.write_file(f"ebraille/{name}", Path(filename), False, tactile_graphic=True)
+
+    def write_volume(self, name: str, data: AnyStr):
+        self.write_str(f"ebraille/{name}", data, True, media_type="application/xhtml+xml")
+
+    def write_volume_chunks(self, name: str, chunks: Iterable[str]):
+        self._write_chunks(f"ebraille/{name}", chunks, True, media_type="application/xhtml+xml")
+
+    def add_volume_navigation(self, name: str, navigation: VolumeNavigation):
+        self._navigation[f"ebraille/{name}"] = navigation
+
+
+_MAX_IN_MEMORY_FILE_SIZE = 16 * 1024 * 1024
+"""Files up to this size are read into memory to be compressed in parallel, larger ones are streamed into the zip."""
+
+
+class EBrlZippedBundler(_EBrlBundler):
+    def __init__(self, name: str, metadata_entries: Iterable[MetadataItem] = (),
+                 compression_workers: int | None = None, compression_policy: CompressionPolicy = CompressionPolicy(),
+                 *args, **kwargs):
+        super().__init__(metadata_entries)
+        self.compression_policy = compression_policy
+        self._zipfile = ZipFile(name, 'w', compression=ZIP_DEFLATED, compresslevel=compression_policy.level)
+        self._zipfile.writestr("mimetype", b"application/epub+zip", compress_type=ZIP_STORED)
+        # Entries are compressed in other threads, the writer must be flushed before using the zip file directly.
+        self._writer = ParallelZipWriter(self._zipfile, max_workers=compression_workers)
+        self._write_static_files()
+
+    def _open_volume(self, name: str) -> BinaryIO:
+        self._writer.flush()
+        return self._zipfile.open(name)
+
+    def _write_entry(self, zinfo: ZipInfo, data: bytes, entry: OpfFileEntry):
+        zinfo.compress_type = self.compression_policy.compress_type(entry.media_type)
+        self._writer.write(zinfo, data, level=self.compression_policy.level)
+
+    def _open_entry(self, arch_name: str, entry: OpfFileEntry, size: int) -> BinaryIO:
+        """Open an entry for writing directly to the zip file, after the entries pending in the writer.
+
+        The level of the policy is only used on Python versions where ZipInfo has compress_level, otherwise these
+        entries are deflated at the zlib default level.
+        """
+        zinfo = ZipInfo(arch_name, date_time=time.localtime(time.time())[:6])
+        zinfo.compress_type = self.compression_policy.compress_type(entry.media_type)
+        if zinfo.compress_type == ZIP_DEFLATED and hasattr(ZipInfo, "compress_level"):
+            zinfo.compress_level = self.compression_policy.level
+        self._writer.flush()
+        return self._zipfile.open(zinfo, mode="w", force_zip64=size * 1.05 > ZIP64_LIMIT)
 
     def write_file(self, name: str, path: Path, add_to_spine: bool, tactile_graphic: bool = False,
                    is_nav_document: bool = False, media_type: str | None = None):
         arch_name = Path(name).as_posix()
-        with self._zipfile.open(arch_name, mode='w') as dest:
-            with path.open(mode='rb') as src:
+        entry = self._add_to_files(arch_name, add_to_spine, tactile_graphic=tactile_graphic,
+                                   is_nav_document=is_nav_document, media_type=media_type)
+        try:
+            size = os.path.getsize(path)
+        except (OSError, TypeError):
+            # Such as the static files of a package which is not unpacked on disk, these are small.
+            size = 0
+        if size > _MAX_IN_MEMORY_FILE_SIZE:
+            # Large files, such as big tactile graphics, are streamed rather than read into memory.
+            with path.open(mode="rb") as src, self._open_entry(arch_name, entry, size) as dest:
                 shutil.copyfileobj(src, dest)
-        self._add_to_files(arch_name, add_to_spine, tactile_graphic=tactile_graphic, is_nav_document=is_nav_document,
-                           media_type=media_type)
+            return
+        self._write_entry(ZipInfo(arch_name, date_time=time.localtime(time.time())[:6]), path.read_bytes(), entry)
 
     def write_str(self, name: str, data: AnyStr, add_to_spine: bool, tactile_graphic: bool = False,
                   is_nav_document: bool = False, media_type: str | None = None):
         arch_name = Path(name).as_posix()
-        self._zipfile.writestr(arch_name, data)
-        self._add_to_files(arch_name, add_to_spine, tactile_graphic, is_nav_document=is_nav_document,
-                           media_type=media_type)
-
-    def write_image(self, name: str, filename: str):
-        self.write_file(f"ebraille/{name}", Path(filename), False, tactile_graphic=True)
+        entry = self._add_to_files(arch_name, add_to_spine, tactile_graphic, is_nav_document=is_nav_document,
+                                   media_type=media_type)
+        self._write_entry(ZipInfo(arch_name, date_time=time.localtime(time.time())[:6]),
+                          data.encode("utf-8") if isinstance(data, str) else data, entry)
 
-    def write_volume(self, name: str, data: AnyStr):
-        self.write_str(f"ebraille/{name}", data, True, media_type="application/xhtml+xml")
+    def _write_chunks(self, name: str, chunks: Iterable[str], add_to_spine: bool, media_type: str | None = None):
+        arch_name = Path(name).as_posix()
+        entry = self._create_file_entry(arch_name, add_to_spine, False, is_nav_document=False, media_type=media_type)
+        # Entries of a zip cannot be removed, so the chunks are spooled to disk and only added once all are produced.
+        with tempfile.TemporaryFile() as spool:
+            for chunk in chunks:
+                spool.write(chunk.encode("utf-8"))
+            size = spool.tell()
+            spool.seek(0)
+            with self._open_entry(arch_name, entry, size) as dest:
+                shutil.copyfileobj(spool, dest)
+        self._files[arch_name] = entry
 
     def close(self):
         try:
-            self.write_str("index.html", self._create_navigation_html(_OPF_NAME), True, is_nav_document=True,
-                           media_type="application/xhtml+xml")
-            self._zipfile.writestr(_OPF_NAME, _create_opf_str(self._files, metadata_entries=self.metadata_entries))
-            self._zipfile.writestr("META-INF/container.xml", _create_container_xml(_OPF_NAME))
+            try:
+                self._write_navigation()
+            finally:
+                self._writer.close()
+            for name, data in self._create_package_files():
+                self._zipfile.writestr(name, data, compresslevel=self.compression_policy.level)
         finally:
             self._zipfile.close()
 
 
+class EBrlDirectoryBundler(_EBrlBundler):
+    """Writes the eBraille package layout into a directory rather than a zip.
+
+    Intended for quickly inspecting the output, existing files in the directory are replaced but not removed.
+    Images are hard linked where possible rather than copied.
+    """
+
+    def __init__(self, name: str, metadata_entries: Iterable[MetadataItem] = (), *args, **kwargs):
+        super().__init__(metadata_entries)
+        self._directory = name
+        os.makedirs(name, exist_ok=True)
+        self._write_bytes("mimetype", b"application/epub+zip")
+        self._write_static_files()
+
+    def _path(self, name: str) -> str:
+        path = os.path.join(self._directory, *Path(name).parts)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def _write_bytes(self, name: str, data: bytes):
+        with open(self._path(name), "wb") as out_file:
+            out_file.write(data)
+
+    def _open_volume(self, name: str) -> BinaryIO:
+        return open(self._path(name), "rb")
+
+    def write_file(self, name: str, path: Path, add_to_spine: bool, tactile_graphic: bool = False,
+                   is_nav_document: bool = False, media_type: str | None = None):
+        arch_name = Path(name).as_posix()
+        self._write_bytes(arch_name, path.read_bytes())
+        self._add_to_files(arch_name, add_to_spine, tactile_graphic=tactile_graphic,
+                           is_nav_document=is_nav_document, media_type=media_type)
+
+    def write_str(self, name: str, data: AnyStr, add_to_spine: bool, tactile_graphic: bool = False,
+                  is_nav_document: bool = False, media_type: str | None = None):
+        arch_name = Path(name).as_posix()
+        self._write_bytes(arch_name, data.encode("utf-8") if isinstance(data, str) else data)
+        self._add_to_files(arch_name, add_to_spine, tactile_graphic, is_nav_document=is_nav_document,
+                           media_type=media_type)
+
+    def _write_chunks(self, name: str, chunks: Iterable[str], add_to_spine: bool, media_type: str | None = None):
+        arch_name = Path(name).as_posix()
+        path = self._path(arch_name)
+        try:
+            with open(path, "w", encoding="utf-8", newline="") as out_file:
+                for chunk in chunks:
+                    out_file.write(chunk)
+        except BaseException:
+            os.remove(path)
+            raise
+        self._add_to_files(arch_name, add_to_spine, False, is_nav_document=False, media_type=media_type)
+
+    def write_image(self, name: str, filename: str):
+        arch_name = Path(f"ebraille/{name}").as_posix()
+        path = self._path(arch_name)
+        if os.path.lexists(path):
+            os.remove(path)
+        try:
+            os.link(filename, path)
+        except OSError:
+            shutil.copyfile(filename, path)
+        self._add_to_files(arch_name, False, tactile_graphic=True, is_nav_document=False)
+
+    def close(self):
+        self._write_navigation()
+        for name, data in self._create_package_files():
+            self._write_bytes(name, data)
+
+
 class Plugin(ABC):
     """Base class for plugins to convert a BRF to eBraille."""
 
-    def __init__(self, plugin_id: str, name: str):
+    def __init__(self, plugin_id: str, name: str, plugin_version: str = ""):
         self._id = plugin_id
         self._name = name
+        self._version = plugin_version
 
     @property
     def id(self) -> str:
@@ -217,6 +426,11 @@ class Plugin(ABC):
         """A name which will be displayed to users"""
         return self._name
 
+    @property
+    def version(self) -> str:
+        """The version of the plugin, used to tell when cached parser output is out of date"""
+        return self._version
+
     @abstractmethod
     def create_brf_parser(
             self,
@@ -238,11 +452,13 @@ class Plugin(ABC):
 
 
 class _DelegatingPluginImpl(Plugin):
-    def __init__(self, plugin_id: str, name: str, brf_parser_factory, file_mapper, bundler_factory):
-        super().__init__(plugin_id, name)
+    def __init__(self, plugin_id: str, name: str, brf_parser_factory, file_mapper, bundler_factory,
+                 plugin_version: str = "", compression_policy: CompressionPolicy | None = None):
+        super().__init__(plugin_id, name, plugin_version)
         self._brf_parser_factory = brf_parser_factory
         self._file_mapper = file_mapper
         self._bundler_factory = bundler_factory
+        self._compression_policy = compression_policy
 
     def create_brf_parser(
             self,
@@ -255,11 +471,18 @@ class _DelegatingPluginImpl(Plugin):
         return self._file_mapper(input_file=input_file, index=index, *args, **kwargs)
 
     def create_bundler(self, output_file: str, *args, **kwargs) -> Bundler:
+        if self._compression_policy is not None:
+            kwargs.setdefault("compression_policy", self._compression_policy)
         return self._bundler_factory(output_file, *args, **kwargs)
 
 
 def create_plugin(plugin_id: str, name: str, brf_parser_factory,
-                  file_mapper, bundler_factory=EBrlZippedBundler) -> Plugin:
-    """Create a plugin by providing the information required"""
+                  file_mapper, bundler_factory=EBrlZippedBundler, plugin_version: str = "",
+                  compression_policy: CompressionPolicy | None = None) -> Plugin:
+    """Create a plugin by providing the information required
+
+    The compression policy is given to the bundler unless the bundler options have one.
+    """
     return _DelegatingPluginImpl(plugin_id, name, brf_parser_factory=brf_parser_factory, file_mapper=file_mapper,
-                                 bundler_factory=bundler_factory)
+                                 bundler_factory=bundler_factory, plugin_version=plugin_version,
+                                 compression_policy=compression_policy)
@@ -6,15 +6,22 @@
 
 """Script to convert BRF into eBRF."""
 import argparse
+import json
 import logging
 import os
-from dataclasses import dataclass
+import time
+import traceback
+from collections.abc import Sequence
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, asdict
 from glob import glob
+from typing import Any
 
 from brf2ebrl import convert, ParserContext
+from brf2ebrl.cache import PassCache
 from brf2ebrl.common import PageNumberPosition, PageLayout
-from brf2ebrl.parser import EBrailleParserOptions
-from brf2ebrl.plugin import find_plugins
+from brf2ebrl.parser import EBrailleParserOptions, PassMetrics, DetectorMetrics
+from brf2ebrl.plugin import find_plugins, CompressionPolicy, EBrlDirectoryBundler
 
 DISCOVERED_PARSER_PLUGINS = find_plugins()
 
@@ -43,6 +50,168 @@ class _ListPluginsAction(argparse.Action):
         parser.exit()
 
 
+class _Profile:
+    """Collects the metrics of the parser passes, detector metrics are added to the pass they were reported in."""
+
+    def __init__(self):
+        self._passes = []
+        self._detectors = []
+
+    def add_detectors(self, _: str, detector_metrics: Sequence[DetectorMetrics]):
+        self._detectors = [asdict(m) for m in detector_metrics]
+
+    def add_pass(self, pass_metrics: PassMetrics):
+        entry = dict(asdict(pass_metrics), chars_per_second=pass_metrics.chars_per_second)
+        if self._detectors:
+            entry["detectors"] = self._detectors
+            self._detectors = []
+        self._passes.append(entry)
+
+    def write(self, output_ebrf: str):
+        profile_file = f"{os.path.splitext(output_ebrf)[0]}.profile.json"
+        with open(profile_file, "w", encoding="utf-8") as out_file:
+            json.dump(self._passes, out_file, indent=2)
+        logging.info(f"Written parser pass metrics to {profile_file}")
+
+
+_BATCH_BOOK_KEYS = {"inputs", "output", "parser", "page_layout", "cells_per_line", "lines_per_page", "images",
+                    "running_heads"}
+
+
+def _find_page_layout(name: str, cells_per_line: int, lines_per_page: int) -> PageLayout:
+    page_standard = [x for x in PAGE_LAYOUT_STANDARDS if x.name == name]
+    if not page_standard:
+        raise ValueError(f"Standard not found, available standards: {', '.join(x.name for x in PAGE_LAYOUT_STANDARDS)}")
+    return PageLayout(
+        odd_braille_page_number=page_standard[0].obpn,
+        even_braille_page_number=page_standard[0].ebpn,
+        odd_print_page_number=page_standard[0].oppn,
+        even_print_page_number=page_standard[0].eppn,
+        cells_per_line=cells_per_line,
+        lines_per_page=lines_per_page,
+    )
+
+
+def _create_parser_options(page_layout: PageLayout, images: str | None, running_heads: bool,
+                           args: argparse.Namespace) -> dict[str, Any]:
+    parser_options = {EBrailleParserOptions.page_layout: page_layout, EBrailleParserOptions.images_path: images, EBrailleParserOptions.detect_running_heads: running_heads, EBrailleParserOptions.pdf_workers: args.pdf_workers or os.cpu_count() or 1}
+    if args.compression_level is not None:
+        parser_options[EBrailleParserOptions.compression_policy] = CompressionPolicy(level=args.compression_level)
+    return parser_options
+
+
+def _check_batch_book(book: Any):
+    """Check a book read from a manifest has the keys and types of values a batch needs."""
+    if not isinstance(book, dict) or not book.get("inputs") or not book.get("output"):
+        raise ValueError("A book needs inputs and an output")
+    if unknown := book.keys() - _BATCH_BOOK_KEYS:
+        raise ValueError(f"Unknown keys {', '.join(sorted(unknown))}")
+    inputs = book["inputs"]
+    if not isinstance(inputs, str) and not (isinstance(inputs, list) and all(isinstance(f, str) for f in inputs)):
+        raise TypeError("inputs must be a path or a list of paths")
+    for key, expected, description in [("output", str, "a path"), ("parser", str, "a parser id"),
+                                       ("page_layout", str, "a page layout name"),
+                                       ("images", (str, type(None)), "a path or null"),
+                                       ("running_heads", bool, "true or false")]:
+        if key in book and not isinstance(book[key], expected):
+            raise TypeError(f"{key} must be {description}")
+    for key in ("cells_per_line", "lines_per_page"):
+        if key in book and (isinstance(book[key], bool) or not isinstance(book[key], int)):
+            raise TypeError(f"{key} must be a whole number")
+
+
+def _read_batch_manifest(manifest: str, args: argparse.Namespace) -> list[tuple[int, dict[str, Any] | str]]:
+    """Read the line number and book of each line of a manifest, books get the command line options they do not set.
+
+    Relative paths are relative to the folder of the manifest. Lines which are not valid give the problem instead.
+    """
+    base_dir = os.path.dirname(os.path.abspath(manifest))
+    defaults = {"parser": args.parser_plugin, "page_layout": args.page_layout, "cells_per_line": args.cells_per_line,
+                "lines_per_page": args.lines_per_page, "images": args.images, "running_heads": args.running_heads}
+    books = []
+    with open(manifest, "r", encoding="utf-8") as manifest_file:
+        for line_number, line in enumerate(manifest_file, start=1):
+            if not line.strip():
+                continue
+            try:
+                book = json.loads(line)
+                _check_batch_book(book)
+                inputs = [book["inputs"]] if isinstance(book["inputs"], str) else book["inputs"]
+                book = defaults | book | {
+                    "inputs": [os.path.join(base_dir, f) for f in inputs],
+                    "output": os.path.join(base_dir, book["output"])}
+                if book["images"]:
+                    book["images"] = os.path.join(base_dir, book["images"])
+                books.append((line_number, book))
+            except (ValueError, TypeError) as e:
+                books.append((line_number, f"Invalid line {line.strip()!r}: {e}"))
+    return books
+
+
+def _convert_batch_book(book: dict[str, Any], args: argparse.Namespace) -> dict[str, Any]:
+    """Convert a book of a batch, returning the record of the result rather than raising."""
+    record = {"output": book["output"], "status": "done", "start_time": time.time()}
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+    notifications = []
+    try:
+        if book["parser"] not in DISCOVERED_PARSER_PLUGINS:
+            raise ValueError(f"Parser {book['parser']} not found")
+        input_brf = [x for f in book["inputs"] for x in sorted(glob(f), key=lambda x: x.lower())]
+        if not input_brf:
+            raise ValueError("No input BRFs found")
+        if book["images"] and not os.path.exists(book["images"]):
+            raise ValueError(f"{book['images']} is not a filename or folder.")
+        page_layout = _find_page_layout(book["page_layout"], book["cells_per_line"], book["lines_per_page"])
+        os.makedirs(os.path.dirname(book["output"]), exist_ok=True)
+        convert(DISCOVERED_PARSER_PLUGINS[book["parser"]], input_brf_list=input_brf, output_ebrf=book["output"],
+                parser_context=ParserContext(notify=lambda l, s: notifications.append(f"{logging.getLevelName(l)}: {s()}"),
+                                             options=_create_parser_options(page_layout, book["images"], book["running_heads"], args),
+                                             pass_cache=PassCache(args.cache_dir) if args.cache_dir else None),
+                jobs=args.jobs or os.cpu_count() or 1,
+                create_bundler=EBrlDirectoryBundler if args.output_format == "dir" else None)
+    except Exception as e:
+        error_file = f"{os.path.splitext(book['output'])[0]}.error.txt"
+        try:
+            # The book may fail before its output folder is made.
+            os.makedirs(os.path.dirname(error_file), exist_ok=True)
+            with open(error_file, "w", encoding="utf-8") as out_file:
+                out_file.write("".join(traceback.format_exception(e)))
+        except OSError:
+            logging.exception(f"Unable to write the error to {error_file}")
+            error_file = None
+        record.update(status="failed", error="".join(traceback.format_exception_only(e)).strip(), error_file=error_file)
+    record.update(wall_time=time.perf_counter() - start_wall, cpu_time=time.process_time() - start_cpu,
+                  notifications=notifications)
+    return record
+
+
+def _run_batch(manifest: str, summary_file: str, workers: int, args: argparse.Namespace) -> int:
+    """Convert the books of the manifest, writing a record of each to the summary, returns the number of failures."""
+    books = _read_batch_manifest(manifest, args)
+    failures = 0
+    with open(summary_file, "w", encoding="utf-8") as summary, ProcessPoolExecutor(max_workers=workers) as pool:
+        def write_record(record: dict[str, Any]):
+            nonlocal failures
+            if record["status"] != "done":
+                failures += 1
+                logging.error(f"Failed to convert book on line {record['line']} of {manifest}: {record['error']}")
+            # Records are written as books finish, so the summary shows the progress of the batch.
+            summary.write(json.dumps(record) + "\n")
+            summary.flush()
+        futures = {pool.submit(_convert_batch_book, book, args): line for line, book in books if isinstance(book, dict)}
+        for line, book in books:
+            if isinstance(book, str):
+                write_record({"line": line, "status": "failed", "error": book})
+        for future in as_completed(futures):
+            try:
+                write_record({"line": futures[future]} | future.result())
+            except Exception as e:
+                # Such as the worker process being killed.
+                write_record({"line": futures[future], "status": "failed", "error": str(e) or type(e).__name__})
+    logging.info(f"Converted {len(books) - failures} of {len(books)} books, summary written to {summary_file}")
+    return failures
+
+
 def main():
     logging.basicConfig(
         level=logging.INFO, format="%(levelname)s:%(asctime)s:%(module)s:%(message)s"
@@ -85,25 +254,80 @@ def main():
     arg_parser.add_argument(
         "-i", "--images", type=str, help="The images folder or file."
     )
+    arg_parser.add_argument(
+        "-j", "--jobs",
+        help="Number of volumes to parse at the same time, 0 uses the number of CPUs",
+        dest="jobs",
+        default=1,
+        type=int,
+    )
+    arg_parser.add_argument(
+        "--cache-dir",
+        help="Directory for caching the output of parser passes, speeds up converting the same BRF again",
+        dest="cache_dir",
+        default=None,
+    )
+    arg_parser.add_argument(
+        "--compression-level",
+        help="Deflate level from 0 to 9 for compressing the text files of the eBraille package, PDFs and images are stored",
+        dest="compression_level",
+        default=None,
+        type=int,
+        choices=range(0, 10),
+    )
+    arg_parser.add_argument(
+        "--pdf-workers",
+        help="Number of processes for finding the print page numbers in PDF pages, 0 uses the number of CPUs",
+        dest="pdf_workers",
+        default=1,
+        type=int,
+    )
+    arg_parser.add_argument(
+        "--output-format",
+        help="Write a zipped eBraille file, or the unzipped package into a directory for quickly inspecting the output",
+        dest="output_format",
+        default="ebrl",
+        choices=["ebrl", "dir"],
+    )
+    batch_args = arg_parser.add_argument_group(title="Batch options")
+    batch_args.add_argument("--batch", metavar="MANIFEST", default=None,
+                            help="Convert the books of a JSON lines manifest instead of the given BRFs. Each line is an object with inputs and output, "
+                                 "and optionally parser, page_layout, cells_per_line, lines_per_page, images and running_heads overriding the command line options. "
+                                 "Relative paths are relative to the manifest.")
+    batch_args.add_argument("--batch-workers", dest="batch_workers", default=1, type=int,
+                            help="Number of books to convert at the same time, 0 uses the number of CPUs")
+    batch_args.add_argument("--summary", dest="summary_file", default=None,
+                            help="Where to write the JSON lines record of each book, defaults to the manifest name with .summary.jsonl")
     debug_args = arg_parser.add_argument_group(title="Debug options")
-    debug_args.add_argument("-pp", "--parser-passes", type=int, default=None, help="Only run number of parser passes.")
-    arg_parser.add_argument("-o", "--output", dest="output_file", help="The output file name", required=True)
-    arg_parser.add_argument("brfs", help="The input BRFs to convert", nargs="+")
+    debug_args.add_argument("-pp", "--parser-passes", type=int, default=None, help="Only run number of parser passes. The plugins now start with a single ingest pass in place of the separate filter, upper case and braille translation passes, so a number used with earlier versions stops two passes later than before.")
+    debug_args.add_argument("--profile", action="store_true", help="Write timing and size metrics of each parser pass as JSON next to the output file.")
+    debug_args.add_argument("--profile-detectors", action="store_true", help="Add counts and times of detector calls to the profile, this slows down detector passes.")
+    arg_parser.add_argument("-o", "--output", dest="output_file", help="The output file name, required unless using --batch")
+    arg_parser.add_argument("brfs", help="The input BRFs to convert", nargs="*")
     args = arg_parser.parse_args()
 
     try:
         logging.root.setLevel(args.logging)
     except ValueError:
         logging.warning(f"Unable to set logging level to {args.logging}, using {logging.getLevelName(logging.root.level)} instead.")
+    if args.batch:
+        if args.parser_passes is not None or args.profile or args.profile_detectors:
+            arg_parser.error("--parser-passes, --profile and --profile-detectors cannot be used with --batch")
+        if not os.path.isfile(args.batch):
+            arg_parser.exit(status=-4, message=f"Manifest {args.batch} not found")
+        summary_file = args.summary_file or f"{os.path.splitext(args.batch)[0]}.summary.jsonl"
+        failures = _run_batch(args.batch, summary_file, args.batch_workers or os.cpu_count() or 1, args)
+        arg_parser.exit(status=1 if failures else 0)
+    if not args.output_file:
+        arg_parser.error("the following arguments are required: -o/--output")
     parser_plugin = [plugin for plugin in parser_modules if plugin.id == args.parser_plugin]
     if not parser_plugin:
         arg_parser.exit(status=-2, message="Parser not found")
 
-    page_standard_name = args.page_layout
-    page_standard = [x for x in PAGE_LAYOUT_STANDARDS if x.name == page_standard_name]
-    if not page_standard:
-        arg_parser.exit(status=-3, message=f"Standard not found, available standards: {', '.join(x.name for x in PAGE_LAYOUT_STANDARDS)}")
-    page_standard = page_standard[0]
+    try:
+        page_layout = _find_page_layout(args.page_layout, args.cells_per_line, args.lines_per_page)
+    except ValueError as e:
+        arg_parser.exit(status=-3, message=str(e))
 
     input_brf = args.brfs
     if not input_brf:
@@ -128,18 +352,18 @@ def main():
         arg_parser.print_help()
         arg_parser.exit()
 
-    page_layout = PageLayout(
-        odd_braille_page_number=page_standard.obpn,
-        even_braille_page_number=page_standard.ebpn,
-        odd_print_page_number=page_standard.oppn,
-        even_print_page_number=page_standard.eppn,
-        cells_per_line=args.cells_per_line,
-        lines_per_page=args.lines_per_page,
-    )
     running_heads = args.running_heads
     notifications = []
-    parser_options = {EBrailleParserOptions.page_layout: page_layout, EBrailleParserOptions.images_path: input_images, EBrailleParserOptions.detect_running_heads: running_heads}
-    convert(parser_plugin[0], input_brf_list=input_brf, output_ebrf=output_ebrf, parser_passes=args.parser_passes, parser_context=ParserContext(notify=lambda l,s: notifications.append(f"{logging.getLevelName(l)}: {s()}"), options=parser_options))
+    profile = _Profile()
+    parser_options = _create_parser_options(page_layout, input_images, running_heads, args)
+    pass_cache = PassCache(args.cache_dir) if args.cache_dir else None
+    try:
+        convert(parser_plugin[0], input_brf_list=input_brf, output_ebrf=output_ebrf, parser_passes=args.parser_passes, parser_context=ParserContext(notify=lambda l,s: notifications.append(f"{logging.getLevelName(l)}: {s()}"), options=parser_options, metrics=profile.add_pass if args.profile or args.profile_detectors else None, detector_metrics=profile.add_detectors if args.profile_detectors else None, pass_cache=pass_cache), jobs=args.jobs or os.cpu_count() or 1, create_bundler=EBrlDirectoryBundler if args.output_format == "dir" else None)
+    finally:
+        if args.profile or args.profile_detectors:
+            profile.write(output_ebrf)
+        if pass_cache is not None:
+            logging.info(f"Pass cache {pass_cache.directory}: {pass_cache.stats.hits} hits, {pass_cache.stats.misses} misses, {pass_cache.stats.evictions} evictions")
     if notifications:
         logging.error("Problems detected whilst converting:")
         logging.error("\n".join(notifications))
@@ -0,0 +1,66 @@
+#  Copyright (c) 2024. American Printing House for the Blind.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+"""Script running a service to convert BRF into eBRF."""
+import argparse
+import logging
+import os
+
+from brf2ebrl.cache import PassCache
+from brf2ebrl.common import PageLayout
+from brf2ebrl.plugin import find_plugins
+from brf2ebrl.scripts.brf2ebrl import PAGE_LAYOUT_STANDARDS
+from brf2ebrl.server import ConversionService, create_server, DEFAULT_MAX_REQUEST_SIZE
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO, format="%(levelname)s:%(asctime)s:%(module)s:%(message)s"
+    )
+    arg_parser = argparse.ArgumentParser(description="Runs a service converting BRF to eBraille, jobs are submitted over HTTP")
+    arg_parser.add_argument("--logging", default="INFO", help="Set the logging level, should be one of the standard Python logging levels.")
+    arg_parser.add_argument("--host", default="127.0.0.1", help="The address to listen on")
+    arg_parser.add_argument("--allow-remote", dest="allow_remote", action="store_true", help="Allow listening on an address other than a loopback one. Jobs name paths the service reads and writes, so only use this when every client on the network is trusted")
+    arg_parser.add_argument("--port", default=8765, type=int, help="The port to listen on")
+    arg_parser.add_argument("--unix-socket", dest="unix_socket", default=None, help="Listen on a Unix socket at this path instead of a TCP port")
+    arg_parser.add_argument("-w", "--workers", default=1, type=int, help="Number of books to convert at the same time, 0 uses the number of CPUs")
+    arg_parser.add_argument("--max-queued", dest="max_queued", default=100, type=int, help="Number of jobs which may be waiting, further jobs are refused")
+    arg_parser.add_argument("--max-finished", dest="max_finished", default=1000, type=int, help="Number of finished jobs to keep the output of")
+    arg_parser.add_argument("-j", "--jobs", default=1, type=int, help="Number of volumes of a book to parse at the same time")
+    arg_parser.add_argument("--cache-dir", dest="cache_dir", default=None, help="Directory for caching the output of parser passes")
+    arg_parser.add_argument("--max-request-size", dest="max_request_size", default=DEFAULT_MAX_REQUEST_SIZE, type=int, help="Largest job in bytes to accept, including uploaded volumes")
+    arg_parser.add_argument("--work-dir", dest="work_dir", default=None, help="Directory for uploaded volumes and the output of jobs")
+    args = arg_parser.parse_args()
+
+    try:
+        logging.root.setLevel(args.logging)
+    except ValueError:
+        logging.warning(f"Unable to set logging level to {args.logging}, using {logging.getLevelName(logging.root.level)} instead.")
+    plugins = find_plugins()
+    if not plugins:
+        arg_parser.exit(status=-2, message="No parser plugins found")
+    page_layouts = {s.name: PageLayout(odd_braille_page_number=s.obpn, even_braille_page_number=s.ebpn,
+                                       odd_print_page_number=s.oppn, even_print_page_number=s.eppn)
+                    for s in PAGE_LAYOUT_STANDARDS}
+    pass_cache = PassCache(args.cache_dir) if args.cache_dir else None
+    with ConversionService(plugins, workers=args.workers or os.cpu_count() or 1, max_queued=args.max_queued,
+                           max_finished=args.max_finished, page_layouts=page_layouts, pass_cache=pass_cache,
+                           volume_jobs=args.jobs, work_dir=args.work_dir) as service:
+        try:
+            server = create_server(service, args.unix_socket or (args.host, args.port),
+                                   max_request_size=args.max_request_size, allow_remote=args.allow_remote)
+        except ValueError as e:
+            arg_parser.error(f"{e}, use --allow-remote if all clients are trusted")
+        with server:
+            logging.info(f"Serving on {args.unix_socket or f'http://{args.host}:{args.port}'}, parsers: {', '.join(plugins)}")
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                logging.info("Stopping")
+
+
+if __name__ == "__main__":
+    main()
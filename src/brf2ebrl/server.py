@@ -0,0 +1,415 @@
+#  Copyright (c) 2024. American Printing House for the Blind.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+"""A service converting BRFs to eBraille, keeping the plugins loaded between conversions.
+
+Jobs are submitted as JSON over HTTP, served on a TCP port or a Unix socket:
+
+    POST /jobs              Submit a job, responds with the status of the job. With ?wait=1 the response is sent
+                            once the job has finished.
+    GET /jobs/<id>          The status of a job.
+    GET /jobs/<id>/bundle   The eBraille file of a finished job.
+    DELETE /jobs/<id>       Cancel a job, a finished job is removed along with its files.
+
+Clients name paths which the service reads and writes with its own permissions, so it is only for trusted local
+clients. A server listening on an address other than a loopback one must be created with allow_remote.
+
+Jobs larger than the max_request_size of the server, including the base64 of uploaded volumes, are refused with 413.
+
+A job is an object with the members:
+
+    brfs            The paths of the BRF volumes, or
+    volumes         a list of {"name": ..., "data": ...} objects with the BRF of each volume encoded in base64.
+    output          Where to write the eBraille file, otherwise it is kept by the service until the job is removed.
+    parser          The id of the parser plugin.
+    page_layout     The name of a page layout standard, or an object with the fields of PageLayout. Page number
+                    positions are given by name, a standard to base the layout on may be given as "standard".
+    images          The path of the images folder or PDF.
+    running_heads   Whether to detect running heads, defaults to true.
+"""
+import base64
+import binascii
+import ipaddress
+import json
+import logging
+import os
+import shutil
+import socketserver
+import stat
+import threading
+import uuid
+from collections.abc import Mapping, Sequence
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace, field
+from enum import Enum
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from tempfile import TemporaryDirectory, mkdtemp
+from typing import Any
+from urllib.parse import urlsplit, parse_qs
+
+from brf2ebrl import convert
+from brf2ebrl.cache import PassCache
+from brf2ebrl.common import PageLayout, PageNumberPosition
+from brf2ebrl.parser import ParserContext, EBrailleParserOptions, ParserException, ParsingCancelledException
+from brf2ebrl.plugin import Plugin
+
+
+class JobStatus(Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+
+_FINISHED = {JobStatus.DONE, JobStatus.FAILED, JobStatus.CANCELLED}
+
+
+class ServiceBusyException(Exception):
+    """Raised when submitting a job whilst the queue of the service is full."""
+    pass
+
+
+@dataclass(frozen=True)
+class ConversionRequest:
+    """The book to convert, the volumes are either BRF files or uploaded as (name, bytes) pairs.
+
+    Uploaded volumes are written to the folder of the job when it is submitted, the request of the job gives their paths
+    in brfs.
+    """
+    plugin_id: str
+    brfs: Sequence[str] = ()
+    uploads: Sequence[tuple[str, bytes]] = ()
+    page_layout: PageLayout = PageLayout()
+    images: str | None = None
+    running_heads: bool = True
+    output: str | None = None
+
+
+@dataclass
+class ConversionJob:
+    """A conversion submitted to the service."""
+    id: str
+    request: ConversionRequest
+    work_dir: str
+    """Folder for uploaded volumes and the output, removed with the job."""
+    output: str
+    status: JobStatus = JobStatus.QUEUED
+    progress: dict[int, float] = field(default_factory=dict)
+    notifications: list[str] = field(default_factory=list)
+    error: str | None = None
+    _cancelled: threading.Event = field(default_factory=threading.Event, repr=False)
+    _finished: threading.Event = field(default_factory=threading.Event, repr=False)
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def is_cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def wait(self, timeout: float | None = None) -> bool:
+        """Wait for the job to finish, returns whether it has finished."""
+        return self._finished.wait(timeout)
+
+    def to_json(self) -> dict[str, Any]:
+        volumes = max(len(self.request.brfs), 1)
+        return {
+            "id": self.id,
+            "status": self.status.value,
+            # Progress is reported as each pass starts, so only reaches one when the job is done.
+            "progress": 1.0 if self.status == JobStatus.DONE else sum(self.progress.copy().values()) / volumes,
+            "notifications": self.notifications.copy(),
+            "output": self.output if self.status == JobStatus.DONE else None,
+            "error": self.error,
+        }
+
+
+class ConversionService:
+    """Runs conversions in a bounded pool of threads, the plugins and parsers stay loaded between jobs.
+
+    At most workers jobs are converted at the same time, with up to max_queued waiting, submitting more raises
+    ServiceBusyException. The files of finished jobs are kept until they are removed or max_finished newer jobs
+    have finished. Each job may parse its volumes in volume_jobs processes.
+    """
+
+    def __init__(self, plugins: Mapping[str, Plugin], workers: int = 1, max_queued: int = 100,
+                 max_finished: int = 1000, page_layouts: Mapping[str, PageLayout] | None = None,
+                 pass_cache: PassCache | None = None, volume_jobs: int = 1, work_dir: str | None = None):
+        self.plugins = dict(plugins)
+        self.page_layouts = dict(page_layouts or {})
+        self.default_page_layout = next(iter(self.page_layouts.values()), PageLayout())
+        self.pass_cache = pass_cache
+        self.volume_jobs = volume_jobs
+        self._workers = workers
+        self._max_queued = max_queued
+        self._max_finished = max_finished
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="brf2ebrl-job")
+        self._temp_dir = TemporaryDirectory(prefix="brf2ebrl-server-", dir=work_dir)
+        self._jobs: dict[str, ConversionJob] = {}
+        self._lock = threading.Lock()
+        self._warm_up()
+
+    def _warm_up(self):
+        # Building a parser compiles the patterns of the detectors, so the first job does not pay for it.
+        for plugin in self.plugins.values():
+            try:
+                plugin.create_brf_parser(brf_path="", output_path="", **{
+                    EBrailleParserOptions.page_layout: self.default_page_layout,
+                    EBrailleParserOptions.images_path: None,
+                    EBrailleParserOptions.detect_running_heads: True})
+            except Exception as e:
+                logging.warning("Unable to create the parser of plugin %s in advance: %s", plugin.id, e)
+
+    def submit(self, request: ConversionRequest) -> ConversionJob:
+        if request.plugin_id not in self.plugins:
+            raise ValueError(f"Parser {request.plugin_id} not found")
+        if not request.brfs and not request.uploads:
+            raise ValueError("No volumes to convert")
+        upload_names = [os.path.basename(name) for name, _ in request.uploads]
+        if not all(upload_names) or len(set(upload_names)) != len(upload_names):
+            raise ValueError("Uploaded volumes need distinct file names")
+        job_id = uuid.uuid4().hex
+        work_dir = mkdtemp(prefix=f"{job_id}-", dir=self._temp_dir.name)
+        try:
+            # The job keeps the paths of uploaded volumes, so their bytes are not held in memory until it is removed.
+            request = replace(request, brfs=[*request.brfs, *self._write_uploads(request.uploads, work_dir)],
+                              uploads=())
+            with self._lock:
+                if sum(job.status not in _FINISHED for job in self._jobs.values()) >= self._workers + self._max_queued:
+                    raise ServiceBusyException("Too many jobs waiting to be converted")
+                job = self._jobs[job_id] = ConversionJob(
+                    id=job_id, request=request, work_dir=work_dir,
+                    output=request.output or os.path.join(work_dir, "book.ebrl"))
+        except BaseException:
+            shutil.rmtree(work_dir, ignore_errors=True)
+            raise
+        self._executor.submit(self._run, job)
+        return job
+
+    @staticmethod
+    def _write_uploads(uploads: Sequence[tuple[str, bytes]], work_dir: str) -> list[str]:
+        brfs = []
+        for name, data in uploads:
+            brf = os.path.join(work_dir, os.path.basename(name))
+            with open(brf, "wb") as brf_file:
+                brf_file.write(data)
+            brfs.append(brf)
+        return brfs
+
+    def get(self, job_id: str) -> ConversionJob | None:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def remove(self, job_id: str) -> ConversionJob | None:
+        """Cancel the job, if it has finished it is removed along with its files."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and job.status in _FINISHED:
+                self._discard(job)
+        if job is not None:
+            job.cancel()
+        return job
+
+    def _discard(self, job: ConversionJob):
+        del self._jobs[job.id]
+        shutil.rmtree(job.work_dir, ignore_errors=True)
+
+    def _run(self, job: ConversionJob):
+        try:
+            if job.is_cancelled():
+                job.status = JobStatus.CANCELLED
+                return
+            job.status = JobStatus.RUNNING
+            request = job.request
+            options = {EBrailleParserOptions.page_layout: request.page_layout,
+                       EBrailleParserOptions.images_path: request.images,
+                       EBrailleParserOptions.detect_running_heads: request.running_heads}
+            convert(self.plugins[request.plugin_id], request.brfs, job.output,
+                    progress_callback=lambda index, fraction: job.progress.__setitem__(index, fraction),
+                    parser_context=ParserContext(
+                        is_cancelled=job.is_cancelled,
+                        notify=lambda l, s: job.notifications.append(f"{logging.getLevelName(l)}: {s()}"),
+                        options=options, pass_cache=self.pass_cache),
+                    jobs=self.volume_jobs)
+            job.status = JobStatus.DONE
+        except ParsingCancelledException:
+            job.status = JobStatus.CANCELLED
+        except ParserException as e:
+            job.error = "\n".join(getattr(e, "__notes__", [])) or f"Problem processing file {e.file_name}"
+            job.status = JobStatus.FAILED
+        except Exception as e:
+            logging.exception("Job %s failed", job.id)
+            job.error = str(e) or type(e).__name__
+            job.status = JobStatus.FAILED
+        finally:
+            job._finished.set()
+            self._remove_old_jobs()
+
+    def _remove_old_jobs(self):
+        with self._lock:
+            finished = [job for job in self._jobs.values() if job.status in _FINISHED]
+            for job in finished[:max(len(finished) - self._max_finished, 0)]:
+                self._discard(job)
+
+    def close(self):
+        """Cancel the jobs and remove their files."""
+        with self._lock:
+            for job in self._jobs.values():
+                job.cancel()
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self._temp_dir.cleanup()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def parse_job(data: Mapping[str, Any], service: ConversionService) -> ConversionRequest:
+    """Create the request for a job submitted as JSON, raises ValueError when the job is not valid."""
+    try:
+        uploads = [(volume["name"], base64.b64decode(volume["data"], validate=True))
+                   for volume in data.get("volumes", [])]
+        return ConversionRequest(
+            plugin_id=data.get("parser", next(iter(service.plugins), "")),
+            brfs=[str(brf) for brf in data.get("brfs", [])],
+            uploads=uploads,
+            page_layout=_parse_page_layout(data.get("page_layout"), service),
+            images=data.get("images"),
+            running_heads=bool(data.get("running_heads", True)),
+            output=data.get("output"),
+        )
+    except (KeyError, TypeError, AttributeError, binascii.Error) as e:
+        raise ValueError(f"Invalid job: {e!r}") from e
+
+
+def _parse_page_layout(value: str | Mapping[str, Any] | None, service: ConversionService) -> PageLayout:
+    if value is None:
+        return service.default_page_layout
+    fields = {"standard": value} if isinstance(value, str) else dict(value)
+    page_layout = service.page_layouts[fields.pop("standard")] if "standard" in fields else service.default_page_layout
+    return replace(page_layout, **{k: PageNumberPosition[v] if k.endswith("_page_number") else int(v)
+                                   for k, v in fields.items()})
+
+
+class _JobRequestHandler(BaseHTTPRequestHandler):
+    server_version = "brf2ebrl-server"
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def service(self) -> ConversionService:
+        return self.server.service
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path.rstrip("/") != "/jobs":
+            return self._send_json(HTTPStatus.NOT_FOUND, {"error": "Not found"})
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.close_connection = True
+            return self._send_json(HTTPStatus.BAD_REQUEST, {"error": "Invalid Content-Length"})
+        if length > self.server.max_request_size:
+            # The body is not read, so the connection cannot be used for another request.
+            self.close_connection = True
+            return self._send_json(HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                                   {"error": f"Requests may be at most {self.server.max_request_size} bytes"})
+        try:
+            data = json.loads(self.rfile.read(length))
+            job = self.service.submit(parse_job(data, self.service))
+        except ServiceBusyException as e:
+            return self._send_json(HTTPStatus.SERVICE_UNAVAILABLE, {"error": str(e)})
+        except ValueError as e:
+            return self._send_json(HTTPStatus.BAD_REQUEST, {"error": str(e)})
+        if parse_qs(url.query).get("wait", ["0"])[-1].lower() in ("1", "true"):
+            job.wait()
+        self._send_json(HTTPStatus.OK if job.status in _FINISHED else HTTPStatus.ACCEPTED, job.to_json())
+
+    def do_GET(self):
+        match urlsplit(self.path).path.strip("/").split("/"):
+            case ["jobs", job_id] if (job := self.service.get(job_id)) is not None:
+                self._send_json(HTTPStatus.OK, job.to_json())
+            case ["jobs", job_id, "bundle"] if (job := self.service.get(job_id)) is not None:
+                if job.status != JobStatus.DONE:
+                    return self._send_json(HTTPStatus.CONFLICT, job.to_json())
+                self._send_file(job.output)
+            case _:
+                self._send_json(HTTPStatus.NOT_FOUND, {"error": "Not found"})
+
+    def do_DELETE(self):
+        match urlsplit(self.path).path.strip("/").split("/"):
+            case ["jobs", job_id] if (job := self.service.remove(job_id)) is not None:
+                self._send_json(HTTPStatus.OK, job.to_json())
+            case _:
+                self._send_json(HTTPStatus.NOT_FOUND, {"error": "Not found"})
+
+    def _send_json(self, status: HTTPStatus, data: Mapping[str, Any]):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_file(self, path: str):
+        if os.path.isdir(path):
+            return self._send_json(HTTPStatus.CONFLICT, {"error": "The output is a directory"})
+        with open(path, "rb") as bundle:
+            self.send_response(HTTPStatus.OK)
+            self.send_header("Content-Type", "application/epub+zip")
+            self.send_header("Content-Length", str(os.fstat(bundle.fileno()).st_size))
+            self.end_headers()
+            shutil.copyfileobj(bundle, self.wfile)
+
+    def log_message(self, format, *args):
+        # The client address of a Unix socket is not a (host, port) pair.
+        logging.debug(format, *args)
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        # A socket left by a server which was not closed is replaced, any other file is kept.
+        try:
+            if not stat.S_ISSOCK(os.stat(self.server_address).st_mode):
+                raise FileExistsError(f"{self.server_address} exists and is not a socket")
+            os.remove(self.server_address)
+        except FileNotFoundError:
+            pass
+        super().server_bind()
+
+
+DEFAULT_MAX_REQUEST_SIZE = 64 * 1024 * 1024
+"""The default size in bytes of the largest job the server reads, larger jobs are refused with 413."""
+
+
+def _is_loopback(host: str) -> bool:
+    try:
+        return host == "localhost" or ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def create_server(service: ConversionService, address: tuple[str, int] | str,
+                  max_request_size: int = DEFAULT_MAX_REQUEST_SIZE, allow_remote: bool = False) -> socketserver.BaseServer:
+    """Create the HTTP server for the service, address is a (host, port) pair or the path of a Unix socket.
+
+    Raises ValueError for a host which is not a loopback address unless allow_remote is given, as jobs may name any path
+    the service can access.
+    """
+    if not isinstance(address, str) and not allow_remote and not _is_loopback(address[0]):
+        raise ValueError(f"Listening on {address[0]} lets other machines read and write files of the service")
+    if isinstance(address, str):
+        server = _UnixHTTPServer(address, _JobRequestHandler)
+    else:
+        server = ThreadingHTTPServer(address, _JobRequestHandler)
+    server.service = service
+    server.max_request_size = max_request_size
+    return server
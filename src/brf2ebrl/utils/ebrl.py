@@ -40,6 +40,28 @@ class HeadingRef:
     heading_braille: str
     level: int
 
+@dataclass(frozen=True)
+class VolumeNavigation:
+    """The headings and pages of a volume, hrefs are relative to the volume."""
+    title: str
+    heading_refs: tuple[HeadingRef, ...] = ()
+    page_refs: tuple[PageRef, ...] = ()
+
+HEADING_TAGS = ("h1", "h2", "h3", "h4", "h5", "h6")
+
+def find_volume_navigation(root: HtmlElement) -> VolumeNavigation:
+    """Find the headings and pages of a volume, the title is the text of the first heading, paragraph or list item."""
+    title = next((x.text_content() for x in root.body.iter(tag=["li", *HEADING_TAGS, "p"])), "")
+    heading_refs = []
+    page_refs = []
+    for element in root.iter():
+        if element.tag in HEADING_TAGS:
+            heading_refs.append(HeadingRef(href=f"#{element.get('id')}", heading_braille=element.text_content(),
+                                           level=HEADING_TAGS.index(element.tag) + 1))
+        elif element.tag == "span" and element.get("role") == "doc-pagebreak":
+            page_refs.append(PageRef(href=f"#{element.get('id')}", page_num_braille=element.text_content(), title=""))
+    return VolumeNavigation(title=title, heading_refs=tuple(heading_refs), page_refs=tuple(page_refs))
+
 def HEADING_LIST(headings: Iterable[HeadingRef]) -> HtmlElement:
     return OL(*_make_heading_list(headings, 1))
 
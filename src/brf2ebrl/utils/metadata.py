@@ -5,6 +5,7 @@
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 """Classes for metadata in eBraille"""
 import datetime
+import warnings
 from typing import Any, Callable, Iterable
 from uuid import uuid4
 
@@ -90,18 +91,29 @@ class Producer(MetadataItem):
     def __init__(self, value: str="-"):
         super().__init__("Producer", value, A11Y_PRODUCER)
 
-DEFAULT_METADATA = [
-    Creator(),
-    Identifier(),
-    Language(),
-    Title(),
-    DateCopyrighted(),
-    DateTranscribed(),
-    BrailleSystem(),
-    CellType(),
-    CompleteTranscription(),
-    Producer()
-]
+def create_default_metadata() -> list[MetadataItem]:
+    """Create new default metadata items, each call has its own items and so a new identifier."""
+    return [
+        Creator(),
+        Identifier(),
+        Language(),
+        Title(),
+        DateCopyrighted(),
+        DateTranscribed(),
+        BrailleSystem(),
+        CellType(),
+        CompleteTranscription(),
+        Producer()
+    ]
+
+def __getattr__(name: str) -> Any:
+    # DEFAULT_METADATA was a single list shared by every bundle, so every book got the same identifier.
+    if name == "DEFAULT_METADATA":
+        warnings.warn("DEFAULT_METADATA is deprecated, use create_default_metadata()", DeprecationWarning,
+                      stacklevel=2)
+        return tuple(create_default_metadata())
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def ensure_default_metadata(data: Iterable[MetadataItem]) -> Iterable[MetadataItem]:
-    return list(data) + [d for d in DEFAULT_METADATA if not any(isinstance(v, type(d)) for v in data)]
+    data = list(data)
+    return data + [d for d in create_default_metadata() if not any(isinstance(v, type(d)) for v in data)]
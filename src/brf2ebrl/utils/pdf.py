@@ -0,0 +1,205 @@
+#  Copyright (c) 2024. American Printing House for the Blind.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+"""Finding the words on each page of PDFs and writing pages as single page PDFs."""
+import hashlib
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, replace
+from itertools import repeat
+from typing import Any, Mapping, Sequence
+
+import pdfplumber
+import pypdf
+
+from brf2ebrl.cache import PassCache
+
+_MIN_PAGES_PER_WORKER = 8
+"""Smaller PDFs are not worth starting processes for."""
+_WORD_KEYS = ("text", "x0", "x1", "top", "bottom")
+"""The properties of the words which are kept, this is all that is needed to find the page numbers."""
+_CACHE_FORMAT = 1
+
+
+@dataclass(frozen=True)
+class PdfPage:
+    """A page of a source PDF along with the words found on it.
+
+    The text is extracted with the same methods as a pdfplumber page, so a PdfPage can be used in place of one.
+    """
+
+    source: str
+    page_num: int
+    full_path: str
+    """Where the page is written as a single page PDF."""
+    relative_path: str
+    pdf_counter: int
+    width: float | None = None
+    height: float | None = None
+    words: tuple[dict[str, Any], ...] = ()
+    text: str | None = None
+
+    def extract_words(self) -> list[dict[str, Any]]:
+        return list(self.words)
+
+    def extract_text(self) -> str | None:
+        return self.text
+
+
+def _unanalysed_page(image_file: str, ebrf_folder: str, page_num: int) -> PdfPage:
+    pdf_subdir = os.path.splitext(os.path.basename(image_file))[0]
+    pdf_counter = page_num + 1
+    pdf_filename = f"{pdf_counter}.pdf"
+    return PdfPage(
+        source=image_file,
+        page_num=page_num,
+        full_path=os.path.join(ebrf_folder, "images", pdf_subdir, pdf_filename),
+        relative_path=os.path.join("images", pdf_subdir, pdf_filename),
+        pdf_counter=pdf_counter,
+    )
+
+
+def _analyse_pages(pdf: pdfplumber.PDF, image_file: str, ebrf_folder: str, start: int,
+                   stop: int | None) -> list[PdfPage]:
+    pages = []
+    for page_num, pdf_page in enumerate(pdf.pages[start:stop], start=start):
+        page = _unanalysed_page(image_file, ebrf_folder, page_num)
+        try:
+            words = tuple({k: word[k] for k in _WORD_KEYS if k in word} for word in pdf_page.extract_words())
+            page = replace(page, width=pdf_page.width, height=pdf_page.height, words=words,
+                           text=pdf_page.extract_text())
+        except OSError as e:
+            logging.warning("Error extracting words from page %d of %s: %s", page.pdf_counter, image_file, e)
+        finally:
+            # Free the layout objects of the page, only the words are kept.
+            pdf_page.close()
+        pages.append(page)
+    return pages
+
+
+def _analyse_page_range(image_file: str, ebrf_folder: str, start: int, stop: int) -> list[PdfPage]:
+    with pdfplumber.open(image_file) as pdf:
+        return _analyse_pages(pdf, image_file, ebrf_folder, start, stop)
+
+
+def analyse_pdf_pages(image_file: str, ebrf_folder: str, workers: int = 1) -> list[PdfPage]:
+    """Find the words and text of each page of a PDF.
+
+    The pages are not written, their paths are in a subdirectory for the source PDF in the images folder of
+    ebrf_folder so pages of different PDFs do not overwrite each other. When workers is more than one, ranges of
+    pages are analysed in a pool of processes, each opening the PDF, otherwise the PDF is only read once. The pages
+    are always returned in page order.
+    """
+    with pdfplumber.open(image_file) as pdf:
+        total_pages = len(pdf.pages)
+        logging.info("Processing PDF %s with %d pages", image_file, total_pages)
+        if workers <= 1 or total_pages <= _MIN_PAGES_PER_WORKER:
+            return _analyse_pages(pdf, image_file, ebrf_folder, 0, None)
+    # Several ranges for each worker, so a worker given slow pages does not hold up the others.
+    range_size = max(-(-total_pages // (workers * 4)), _MIN_PAGES_PER_WORKER)
+    starts = range(0, total_pages, range_size)
+    with ProcessPoolExecutor(max_workers=min(workers, len(starts))) as pool:
+        ranges = pool.map(_analyse_page_range, repeat(image_file), repeat(ebrf_folder), starts,
+                          (start + range_size for start in starts))
+        return [page for pages in ranges for page in pages]
+
+
+def write_pdf_page(pdf_reader: pypdf.PdfReader, page: PdfPage):
+    """Write a page of the PDF read by pdf_reader as a single page PDF at page.full_path."""
+    os.makedirs(os.path.dirname(page.full_path), exist_ok=True)
+    pdf_writer = pypdf.PdfWriter()
+    pdf_writer.add_page(pdf_reader.pages[page.page_num])
+    # Volumes parsed in other processes may be reading a page written by an earlier volume.
+    temp_path = f"{page.full_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(temp_path, "wb") as output_pdf:
+            pdf_writer.write(output_pdf)
+        os.replace(temp_path, page.full_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def _pdf_digest(image_file: str) -> str:
+    digest = hashlib.sha256()
+    with open(image_file, "rb") as pdf_file:
+        while chunk := pdf_file.read(1024 * 1024):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _pages_to_json(pages: Sequence[PdfPage]) -> str:
+    return json.dumps([[page.width, page.height, page.text, [[word.get(k) for k in _WORD_KEYS] for word in page.words]]
+                       for page in pages], separators=(",", ":"), ensure_ascii=False)
+
+
+def _pages_from_json(text: str, image_file: str, ebrf_folder: str) -> list[PdfPage]:
+    return [replace(_unanalysed_page(image_file, ebrf_folder, page_num), width=width, height=height, text=page_text,
+                    words=tuple(dict(zip(_WORD_KEYS, word)) for word in words))
+            for page_num, (width, height, page_text, words) in enumerate(json.loads(text))]
+
+
+class PdfPageIndex:
+    """The pages of the source PDFs used in a conversion.
+
+    Each source PDF is analysed the first time its pages are requested, later requests, such as from other volumes
+    of the book, get the same pages. The pages of a PDF are analysed in a pool of processes when workers is more
+    than one. When given a cache, the words of the pages are stored keyed by the content of the PDF, so a PDF
+    analysed in an earlier conversion is not read with pdfplumber. Only pages given to write_page are written out, each at most once. An index
+    should be used for a single conversion, as the pages are written into the output folder of that conversion.
+    Pages already analysed, such as from analysed_pages of the index of another process, may be given as pages.
+    """
+
+    def __init__(self, workers: int = 1, cache: PassCache | None = None,
+                 pages: Mapping[tuple[str, str], tuple[PdfPage, ...]] | None = None):
+        self.workers = workers
+        self.cache = cache
+        self._scoped_cache = cache.scoped("PDF page words", _CACHE_FORMAT, pdfplumber.__version__) if cache is not None else None
+        self._pages: dict[tuple[str, str], tuple[PdfPage, ...]] = dict(pages or {})
+        self._readers: dict[str, pypdf.PdfReader] = {}
+        self._written: set[str] = set()
+        self._lock = threading.Lock()
+
+    def pages(self, image_file: str, ebrf_folder: str) -> Sequence[PdfPage]:
+        """Get the analysed pages of image_file, the paths of the pages are in the images folder of ebrf_folder."""
+        key = (os.path.abspath(image_file), os.path.abspath(ebrf_folder))
+        with self._lock:
+            if (pages := self._pages.get(key)) is None:
+                pages = self._pages[key] = tuple(self._analyse(image_file, ebrf_folder))
+            return pages
+
+    def analysed_pages(self) -> dict[tuple[str, str], tuple[PdfPage, ...]]:
+        """The pages analysed so far, keyed by the absolute paths of the PDF and the ebrf folder."""
+        with self._lock:
+            return dict(self._pages)
+
+    def _analyse(self, image_file: str, ebrf_folder: str) -> list[PdfPage]:
+        if self._scoped_cache is None:
+            return analyse_pdf_pages(image_file, ebrf_folder, self.workers)
+        cache_key = self._scoped_cache.key(_pdf_digest(image_file), "pages")
+        if (cached := self._scoped_cache.get(cache_key)) is not None:
+            try:
+                return _pages_from_json(cached, image_file, ebrf_folder)
+            except (ValueError, TypeError) as e:
+                logging.warning("Ignoring invalid cached pages of %s: %s", image_file, e)
+        pages = analyse_pdf_pages(image_file, ebrf_folder, self.workers)
+        # Pages which could not be analysed might be read next time.
+        if all(page.width is not None for page in pages):
+            self._scoped_cache.put(cache_key, _pages_to_json(pages))
+        return pages
+
+    def write_page(self, page: PdfPage):
+        """Write the page as a single page PDF if not already written."""
+        with self._lock:
+            if page.full_path in self._written:
+                return
+            if (pdf_reader := self._readers.get(page.source)) is None:
+                pdf_reader = self._readers[page.source] = pypdf.PdfReader(page.source)
+            write_pdf_page(pdf_reader, page)
+            self._written.add(page.full_path)
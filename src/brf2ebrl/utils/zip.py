@@ -0,0 +1,121 @@
+#  Copyright (c) 2024. American Printing House for the Blind.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+"""Writing zip files with the entries compressed in a pool of threads."""
+import os
+import sys
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from dataclasses import dataclass
+from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED, ZIP_STORED, ZIP64_LIMIT, LargeZipFile
+
+
+_RAW_WRITE_VERSIONS = {(3, 11), (3, 12), (3, 13)}
+"""Python versions whose ZipFile internals ParallelZipWriter has been checked against.
+
+ZipFile has no public way to add an entry which is already compressed, so writing one uses ZipFile internals which may
+change between versions. Other versions write the entries with ZipFile.writestr, compressing them in the caller.
+"""
+
+
+def _can_write_raw(zip_file: ZipFile) -> bool:
+    return sys.version_info[:2] in _RAW_WRITE_VERSIONS and all(
+        hasattr(zip_file, a) for a in ("_lock", "_seekable", "start_dir", "_writecheck", "_didModify", "_allowZip64")
+    ) and hasattr(ZipInfo, "FileHeader")
+
+
+@dataclass(frozen=True)
+class _CompressedEntry:
+    data: bytes
+    crc: int
+    file_size: int
+
+
+def _compress(data: bytes, compress_type: int, level: int) -> _CompressedEntry:
+    crc = zlib.crc32(data)
+    if compress_type == ZIP_DEFLATED:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        compressed = compressor.compress(data) + compressor.flush()
+    else:
+        compressed = data
+    return _CompressedEntry(data=compressed, crc=crc, file_size=len(data))
+
+
+class ParallelZipWriter:
+    """Adds entries to a ZipFile, compressing them in a pool of threads.
+
+    zlib releases the GIL whilst compressing, so entries are compressed at the same time as the caller carries on.
+    Entries are written to the zip in the order they were added, so the archive is the same as one written serially.
+    At most max_pending entries are held in memory waiting to be written.
+
+    On Python versions other than those in _RAW_WRITE_VERSIONS, entries are written with ZipFile.writestr as they are
+    added, so are not compressed in parallel.
+    """
+
+    def __init__(self, zip_file: ZipFile, max_workers: int | None = None, max_pending: int | None = None):
+        self._zip_file = zip_file
+        self._parallel = _can_write_raw(zip_file)
+        max_workers = max_workers or os.cpu_count() or 1
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="brf2ebrl-zip")
+        self._max_pending = max_pending or max_workers * 2
+        self._pending: deque[tuple[ZipInfo, Future[_CompressedEntry]]] = deque()
+
+    def write(self, zinfo: ZipInfo, data: bytes, level: int = zlib.Z_DEFAULT_COMPRESSION):
+        """Add an entry, only ZIP_STORED and ZIP_DEFLATED compression are supported."""
+        if zinfo.compress_type not in (ZIP_STORED, ZIP_DEFLATED):
+            raise ValueError(f"Compression type {zinfo.compress_type} not supported")
+        if not self._parallel:
+            self._zip_file.writestr(zinfo, data, compresslevel=level)
+            return
+        if not zinfo.external_attr:
+            zinfo.external_attr = 0o600 << 16
+        self._pending.append((zinfo, self._executor.submit(_compress, data, zinfo.compress_type, level)))
+        self._write_completed()
+        while len(self._pending) > self._max_pending:
+            self._write_next()
+
+    def _write_completed(self):
+        while self._pending and self._pending[0][1].done():
+            self._write_next()
+
+    def _write_next(self):
+        zinfo, future = self._pending.popleft()
+        entry = future.result()
+        zinfo.CRC = entry.crc
+        zinfo.file_size = entry.file_size
+        zinfo.compress_size = len(entry.data)
+        zinfo.flag_bits = 0x00
+        zip_file = self._zip_file
+        zip64 = zinfo.file_size * 1.05 > ZIP64_LIMIT or zinfo.compress_size > ZIP64_LIMIT
+        if zip64 and not zip_file._allowZip64:
+            raise LargeZipFile("Filesize would require ZIP64 extensions")
+        # The sizes and CRC are known, so the entry is written in one go in the way ZipFile.open(mode="w") would.
+        with zip_file._lock:
+            if zip_file._seekable:
+                zip_file.fp.seek(zip_file.start_dir)
+            zinfo.header_offset = zip_file.fp.tell()
+            zip_file._writecheck(zinfo)
+            zip_file._didModify = True
+            zip_file.fp.write(zinfo.FileHeader(zip64))
+            zip_file.fp.write(entry.data)
+            zip_file.start_dir = zip_file.fp.tell()
+            zip_file.filelist.append(zinfo)
+            zip_file.NameToInfo[zinfo.filename] = zinfo
+
+    def flush(self):
+        """Write all the pending entries, must be called before writing to the ZipFile directly."""
+        while self._pending:
+            self._write_next()
+
+    def close(self):
+        """Write the pending entries and stop the threads, the ZipFile is left open."""
+        try:
+            self.flush()
+        finally:
+            for _, future in self._pending:
+                future.cancel()
+            self._pending.clear()
+            self._executor.shutdown()
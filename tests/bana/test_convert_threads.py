@@ -0,0 +1,98 @@
+#  Copyright (c) 2024. American Printing House for the Blind.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+import random
+import re
+from concurrent.futures import ThreadPoolExecutor
+from zipfile import ZipFile
+
+from brf2ebrl import convert, ParserContext
+from brf2ebrl.cache import PassCache
+from brf2ebrl.common import PageLayout, PageNumberPosition
+from brf2ebrl.parser import EBrailleParserOptions
+from brf2ebrl_bana import PLUGIN
+
+_LAYOUT = PageLayout(odd_braille_page_number=PageNumberPosition.BOTTOM_RIGHT,
+                     even_braille_page_number=PageNumberPosition.NONE,
+                     odd_print_page_number=PageNumberPosition.TOP_RIGHT,
+                     even_print_page_number=PageNumberPosition.TOP_RIGHT)
+# The creation time and identifier are different for every bundle.
+_GENERATED_METADATA = re.compile(rb"<dc:date>.*?</dc:date>|dcterms:modified\">.*?<|<dc:identifier.*?</dc:identifier>")
+
+
+def _write_brf(path, seed: int):
+    rng = random.Random(seed)
+    pages = []
+    for page in range(1, 7):
+        print_page = "#" + "JABCDEFGHI"[page // 2 + 1]
+        lines = [" " * (40 - len(print_page)) + print_page]
+        if page % 3 == 1:
+            lines.append(" " * 14 + "CHAPTER " + "#" + "JABCDEFGHI"[page % 10])
+        while len(lines) < 24:
+            line = "  " + " ".join("".join(rng.choices("ABCDEFGHIJKLMNOPQRSTUVWXYZ", k=rng.randint(1, 7)))
+                                   for _ in range(5))
+            lines.append(line[:40])
+        braille_page = "#" + "JABCDEFGHI"[page] if page % 2 else ""
+        lines.append(" " * (40 - len(braille_page)) + braille_page)
+        pages.append("\n".join(lines))
+    path.write_text("\f".join(pages) + "\f", encoding="utf-8")
+
+
+def _convert(volumes, output, images: str | None = None, pass_cache: PassCache | None = None) -> dict[str, bytes]:
+    convert(PLUGIN, volumes, str(output), parser_context=ParserContext(options={
+        EBrailleParserOptions.page_layout: _LAYOUT, EBrailleParserOptions.images_path: images,
+        EBrailleParserOptions.detect_running_heads: True}, pass_cache=pass_cache))
+    with ZipFile(output) as zip_file:
+        return {name: zip_file.read(name) for name in zip_file.namelist()}
+
+
+def _write_books(tmp_path) -> list[list[str]]:
+    books = []
+    for book in range(8):
+        volumes = []
+        for volume in range(2):
+            path = tmp_path / f"book{book}_{volume}.brf"
+            _write_brf(path, book * 10 + volume)
+            volumes.append(str(path))
+        books.append(volumes)
+    return books
+
+
+def test_concurrent_conversions_match_serial_conversions(tmp_path):
+    books = _write_books(tmp_path)
+    serial = [_convert(volumes, tmp_path / f"serial{book}.ebrl") for book, volumes in enumerate(books)]
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        concurrent = list(pool.map(lambda book: _convert(books[book], tmp_path / f"concurrent{book}.ebrl"),
+                                   range(len(books))))
+    _assert_same_bundles(serial, concurrent, len(books))
+
+
+def test_concurrent_conversions_sharing_pdf_and_pass_cache_match_serial_conversions(tmp_path, write_text_pdf):
+    books = _write_books(tmp_path)
+    # Every book uses the same PDF, with pages for some of the braille page numbers of the volumes.
+    write_text_pdf(tmp_path / "graphics.pdf", ["#a", "#c", "#e"])
+    images = str(tmp_path / "graphics.pdf")
+    serial = [_convert(volumes, tmp_path / f"serial{book}.ebrl", images) for book, volumes in enumerate(books)]
+    pass_cache = PassCache(str(tmp_path / "cache"))
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        concurrent = list(pool.map(
+            lambda book: _convert(books[book], tmp_path / f"concurrent{book}.ebrl", images, pass_cache),
+            range(len(books))))
+    assert any(name.startswith("ebraille/images/graphics/") for name in serial[0])
+    assert pass_cache.stats.misses > 0
+    _assert_same_bundles(serial, concurrent, len(books))
+
+
+def _assert_same_bundles(serial: list[dict[str, bytes]], concurrent: list[dict[str, bytes]], books: int):
+    identifiers = set()
+    for serial_entries, concurrent_entries in zip(serial, concurrent):
+        assert serial_entries.keys() == concurrent_entries.keys()
+        for name, data in serial_entries.items():
+            if name == "package.opf":
+                identifiers.update(re.findall(rb"<dc:identifier.*?</dc:identifier>", concurrent_entries[name]))
+                assert _GENERATED_METADATA.sub(b"", data) == _GENERATED_METADATA.sub(b"", concurrent_entries[name])
+            else:
+                assert data == concurrent_entries[name], name
+    assert len(identifiers) == books
@@ -0,0 +1,104 @@
+#  Copyright (c) 2024. American Printing House for the Blind.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+import argparse
+import json
+import os
+from zipfile import ZipFile
+
+import pytest
+
+from brf2ebrl.parser import Parser, ParserContext
+from brf2ebrl.plugin import create_plugin
+from brf2ebrl.scripts import brf2ebrl as script
+
+
+def _to_html(text: str, context: ParserContext) -> str:
+    return f"<html><body><p>{text.upper()}</p></body></html>"
+
+
+_PLUGIN = create_plugin("test", "Test plugin", lambda **kwargs: [Parser("To HTML", _to_html)],
+                        lambda input_file, index: f"vol{index}.html")
+
+
+@pytest.fixture
+def args(monkeypatch) -> argparse.Namespace:
+    monkeypatch.setattr(script, "DISCOVERED_PARSER_PLUGINS", {_PLUGIN.id: _PLUGIN})
+    return argparse.Namespace(parser_plugin="test", page_layout="interpoint", cells_per_line=40, lines_per_page=25,
+                              images=None, running_heads=True, pdf_workers=1, compression_level=None, cache_dir=None,
+                              jobs=1, output_format="ebrl")
+
+
+def _write_manifest(path, lines: list[str]) -> str:
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    return str(path)
+
+
+def test_read_batch_manifest_applies_defaults_and_relative_paths(tmp_path, args):
+    manifest = _write_manifest(tmp_path / "books.jsonl", [
+        json.dumps({"inputs": "a/*.brf", "output": "out/a.ebrl"}),
+        "",
+        json.dumps({"inputs": ["b1.brf", "/abs/b2.brf"], "output": "b.ebrl", "images": "b.pdf",
+                    "cells_per_line": 32, "running_heads": False}),
+    ])
+    books = script._read_batch_manifest(manifest, args)
+    assert [line for line, _ in books] == [1, 3]
+    first, second = books[0][1], books[1][1]
+    assert first["inputs"] == [os.path.join(tmp_path, "a/*.brf")]
+    assert first["output"] == os.path.join(tmp_path, "out/a.ebrl")
+    assert (first["parser"], first["page_layout"], first["cells_per_line"], first["images"]) == \
+           ("test", "interpoint", 40, None)
+    assert second["inputs"] == [os.path.join(tmp_path, "b1.brf"), "/abs/b2.brf"]
+    assert second["images"] == os.path.join(tmp_path, "b.pdf")
+    assert (second["cells_per_line"], second["lines_per_page"], second["running_heads"]) == (32, 25, False)
+
+
+@pytest.mark.parametrize("line", [
+    "not json",
+    "[1, 2]",
+    json.dumps({"inputs": "a.brf"}),
+    json.dumps({"inputs": "a.brf", "output": "a.ebrl", "colour": "red"}),
+    json.dumps({"inputs": 5, "output": "a.ebrl"}),
+    json.dumps({"inputs": ["a.brf", 5], "output": "a.ebrl"}),
+    json.dumps({"inputs": "a.brf", "output": ["a.ebrl"]}),
+    json.dumps({"inputs": "a.brf", "output": "a.ebrl", "images": 3}),
+    json.dumps({"inputs": "a.brf", "output": "a.ebrl", "cells_per_line": "40"}),
+])
+def test_read_batch_manifest_gives_problem_of_invalid_lines(tmp_path, args, line):
+    manifest = _write_manifest(tmp_path / "books.jsonl", [line, json.dumps({"inputs": "a.brf", "output": "a.ebrl"})])
+    books = script._read_batch_manifest(manifest, args)
+    assert [line for line, _ in books] == [1, 2]
+    assert isinstance(books[0][1], str) and books[0][1].startswith("Invalid line")
+    assert isinstance(books[1][1], dict)
+
+
+def test_convert_batch_book_writes_error_to_folder_not_yet_made(tmp_path, args):
+    book = script._read_batch_manifest(_write_manifest(tmp_path / "books.jsonl", [
+        json.dumps({"inputs": "missing/*.brf", "output": "out/b.ebrl"})]), args)[0][1]
+    record = script._convert_batch_book(book, args)
+    assert record["status"] == "failed"
+    assert record["error_file"] == str(tmp_path / "out" / "b.error.txt")
+    assert "No input BRFs found" in (tmp_path / "out" / "b.error.txt").read_text(encoding="utf-8")
+
+
+def test_run_batch_records_failed_book_and_converts_others(tmp_path, args):
+    (tmp_path / "a.brf").write_text("book a", encoding="utf-8")
+    (tmp_path / "c.brf").write_text("book c", encoding="utf-8")
+    manifest = _write_manifest(tmp_path / "books.jsonl", [
+        json.dumps({"inputs": "a.brf", "output": "out/a.ebrl"}),
+        json.dumps({"inputs": "missing/*.brf", "output": "out/b.ebrl"}),
+        "{",
+        json.dumps({"inputs": "c.brf", "output": "out/c.ebrl"}),
+    ])
+    summary_file = str(tmp_path / "summary.jsonl")
+    assert script._run_batch(manifest, summary_file, 2, args) == 2
+    with open(summary_file, "r", encoding="utf-8") as summary:
+        records = {record["line"]: record for record in map(json.loads, summary)}
+    assert {line: record["status"] for line, record in records.items()} == \
+           {1: "done", 2: "failed", 3: "failed", 4: "done"}
+    assert "No input BRFs found" in records[2]["error"]
+    assert os.path.isfile(records[2]["error_file"])
+    with ZipFile(tmp_path / "out" / "c.ebrl") as zip_file:
+        assert b"<p>BOOK C</p>" in zip_file.read("ebraille/vol0.html")
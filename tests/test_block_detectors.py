@@ -0,0 +1,56 @@
+#  Copyright (c) 2024. American Printing House for the Blind.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+from brf2ebrl.common import PageLayout
+from brf2ebrl.common.block_detectors import create_centered_detector, create_cell_heading, \
+    create_paragraph_detector, create_toc_detector, create_list_detector, create_table_detector, detect_pre
+from brf2ebrl.common.selectors import most_confident_fragment
+from brf2ebrl.parser import fragment_parser, parse, Parser
+
+_PAGE = (
+    "<?braille-page ⠼⠁?>\n"
+    + "⠀" * 16 + "⠓⠑⠁⠙⠀⠇⠕⠕⠀⠀\n"
+    + "<?blank-line?>\n"
+    + "⠀" * 6 + "⠞⠓⠑⠀⠋⠊⠗⠎⠞⠀⠇⠊⠝⠑\n"
+    + "⠀" * 4 + "⠉⠕⠝⠞⠊⠝⠥⠑⠎⠀⠓⠑⠗⠑⠲\n"
+    + "⠁⠀⠊⠞⠑⠍\n"
+    + "⠀⠀⠎⠥⠃⠀⠊⠞⠑⠍\n"
+    + "⠁⠃⠉⠙⠑⠋⠛⠓⠊⠚\n"
+)
+
+
+def _create_block_pass() -> Parser:
+    layout = PageLayout()
+    return fragment_parser("Detect blocks", {}, [
+        create_centered_detector(layout.cells_per_line, 3, "h1"),
+        create_cell_heading(6, "h3"),
+        create_cell_heading(4, "h2"),
+        create_paragraph_detector(first_line_indent=6, run_over=4, layout=layout, confidence=0.95),
+        create_paragraph_detector(first_line_indent=2, run_over=0, layout=layout),
+        create_toc_detector(layout.cells_per_line),
+        create_list_detector(layout.cells_per_line),
+        create_table_detector(),
+        detect_pre,
+    ], most_confident_fragment)
+
+
+class _SliceCountingStr(str):
+    """A volume which fails once slicing has copied more than its length, as slicing from a cursor to the end does."""
+    copied = 0
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            self.copied += len(range(start, stop, step))
+            assert self.copied <= len(self), f"Copied {self.copied} characters slicing a volume of {len(self)}"
+        return super().__getitem__(key)
+
+
+def test_block_pass_scales_linearly():
+    volume = _SliceCountingStr(_PAGE * (5_000_000 // len(_PAGE.encode("utf-8"))))
+    assert len(volume.encode("utf-8")) > 4_900_000
+    parse(volume, [_create_block_pass()])
+    assert 0 < volume.copied <= len(volume)
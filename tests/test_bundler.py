@@ -0,0 +1,113 @@
+#  Copyright (c) 2024. American Printing House for the Blind.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+import os
+import time
+
+import pytest
+from zipfile import ZipFile, ZipInfo, ZIP_STORED, ZIP_DEFLATED
+
+from brf2ebrl import plugin
+from brf2ebrl.plugin import EBrlZippedBundler, EBrlDirectoryBundler, CompressionPolicy, create_plugin, Bundler
+from brf2ebrl.utils.metadata import create_default_metadata
+
+
+def _write_bundle(bundler: Bundler, tmp_path):
+    pdf = tmp_path / "page1.pdf"
+    pdf.write_bytes(b"%PDF-1.4 already compressed")
+    with bundler:
+        bundler.write_volume("vol0.html", "<html><body>" + "<h1>⠁</h1>" * 100 + "</body></html>")
+        bundler.write_image("images/page1.pdf", str(pdf))
+
+
+def test_bundler_compresses_by_media_type(tmp_path):
+    _write_bundle(EBrlZippedBundler(str(tmp_path / "out.ebrl")), tmp_path)
+    with ZipFile(tmp_path / "out.ebrl") as zip_file:
+        assert zip_file.testzip() is None
+        assert zip_file.getinfo("mimetype").compress_type == ZIP_STORED
+        assert zip_file.getinfo("ebraille/images/page1.pdf").compress_type == ZIP_STORED
+        assert zip_file.getinfo("ebraille/vol0.html").compress_type == ZIP_DEFLATED
+        assert zip_file.getinfo("ebraille/css/default.css").compress_type == ZIP_DEFLATED
+
+
+def test_plugin_compression_policy_used_by_bundler(tmp_path):
+    plugin = create_plugin("test", "Test", lambda **kwargs: [], lambda input_file, index: f"vol{index}.html",
+                           compression_policy=CompressionPolicy(level=0, stored_media_types=frozenset()))
+    _write_bundle(plugin.create_bundler(str(tmp_path / "out.ebrl")), tmp_path)
+    with ZipFile(tmp_path / "out.ebrl") as zip_file:
+        assert zip_file.getinfo("ebraille/images/page1.pdf").compress_type == ZIP_DEFLATED
+        volume = zip_file.getinfo("ebraille/vol0.html")
+        assert volume.compress_size > volume.file_size
+
+
+def test_directory_bundler_writes_package_layout(tmp_path):
+    out_dir = tmp_path / "out"
+    _write_bundle(EBrlDirectoryBundler(str(out_dir)), tmp_path)
+    _write_bundle(EBrlZippedBundler(str(tmp_path / "out.ebrl")), tmp_path)
+    with ZipFile(tmp_path / "out.ebrl") as zip_file:
+        assert sorted(str(p.relative_to(out_dir).as_posix()) for p in out_dir.rglob("*") if p.is_file()) == sorted(
+            zip_file.namelist())
+        # package.opf is left out as it holds the modified time.
+        for name in ["mimetype", "META-INF/container.xml", "ebraille/vol0.html", "index.html"]:
+            assert (out_dir / name).read_bytes() == zip_file.read(name)
+    assert os.path.samefile(out_dir / "ebraille/images/page1.pdf", tmp_path / "page1.pdf")
+
+
+
+def _fail_producing_chunks():
+    yield "<html><body>"
+    raise ValueError("Problem producing the chunks")
+
+
+def test_zipped_bundler_leaves_no_partial_volume(tmp_path):
+    with EBrlZippedBundler(str(tmp_path / "out.ebrl")) as bundler:
+        with pytest.raises(ValueError):
+            bundler.write_volume_chunks("vol0.html", _fail_producing_chunks())
+        bundler.write_volume_chunks("vol1.html", iter(["<html><body>", "<h1>⠁</h1>", "</body></html>"]))
+    with ZipFile(tmp_path / "out.ebrl") as zip_file:
+        assert zip_file.testzip() is None
+        assert "ebraille/vol0.html" not in zip_file.namelist()
+        assert zip_file.read("ebraille/vol1.html").decode("utf-8") == "<html><body><h1>⠁</h1></body></html>"
+
+
+def test_directory_bundler_leaves_no_partial_volume(tmp_path):
+    with EBrlDirectoryBundler(str(tmp_path / "out")) as bundler:
+        with pytest.raises(ValueError):
+            bundler.write_volume_chunks("vol0.html", _fail_producing_chunks())
+    assert not (tmp_path / "out" / "ebraille" / "vol0.html").exists()
+
+
+@pytest.mark.skipif(not hasattr(ZipInfo, "compress_level"), reason="ZipInfo.compress_level is new in Python 3.13")
+def test_zipped_bundler_compresses_streamed_volume_with_policy_level(tmp_path):
+    volume = ["<html><body>", *["<h1>⠁</h1>"] * 100, "</body></html>"]
+    for level in (0, 9):
+        with EBrlZippedBundler(str(tmp_path / f"out{level}.ebrl"),
+                               compression_policy=CompressionPolicy(level=level)) as bundler:
+            bundler.write_volume_chunks("vol0.html", iter(volume))
+    with ZipFile(tmp_path / "out0.ebrl") as stored, ZipFile(tmp_path / "out9.ebrl") as compressed:
+        assert stored.getinfo("ebraille/vol0.html").compress_size > stored.getinfo("ebraille/vol0.html").file_size
+        assert compressed.getinfo("ebraille/vol0.html").compress_size < 100
+        assert compressed.read("ebraille/vol0.html").decode("utf-8") == "".join(volume)
+
+
+def test_default_metadata_is_deprecated():
+    with pytest.deprecated_call():
+        from brf2ebrl.utils.metadata import DEFAULT_METADATA
+    assert [item.name for item in DEFAULT_METADATA] == [item.name for item in create_default_metadata()]
+
+
+@pytest.mark.parametrize("max_in_memory_size", [16 * 1024 * 1024, 0])
+def test_zipped_bundler_dates_entries_when_written(tmp_path, monkeypatch, max_in_memory_size):
+    # Files larger than the limit are streamed into the zip instead of being read into memory.
+    monkeypatch.setattr(plugin, "_MAX_IN_MEMORY_FILE_SIZE", max_in_memory_size)
+    start = time.localtime(time.time() - 2)[:6]
+    _write_bundle(EBrlZippedBundler(str(tmp_path / "out.ebrl")), tmp_path)
+    end = time.localtime(time.time() + 2)[:6]
+    with ZipFile(tmp_path / "out.ebrl") as zip_file:
+        assert zip_file.testzip() is None
+        for name in ("ebraille/css/default.css", "ebraille/images/page1.pdf", "ebraille/vol0.html", "package.opf"):
+            assert start <= zip_file.getinfo(name).date_time <= end, name
+        assert zip_file.getinfo("ebraille/images/page1.pdf").compress_type == ZIP_STORED
+        assert zip_file.read("ebraille/images/page1.pdf") == b"%PDF-1.4 already compressed"
@@ -0,0 +1,76 @@
+#  Copyright (c) 2024. American Printing House for the Blind.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+import os
+
+from brf2ebrl.cache import PassCache, CacheStats
+from brf2ebrl.parser import parse, Parser, ParserContext
+
+
+def test_pass_cache_get_and_put(tmp_path):
+    cache = PassCache(str(tmp_path))
+    key = cache.key("input", "pass")
+    assert cache.get(key) is None
+    cache.put(key, "output ⠁")
+    assert cache.get(key) == "output ⠁"
+    assert cache.stats == CacheStats(hits=1, misses=1)
+
+
+def test_pass_cache_key_depends_on_scope_pass_and_text(tmp_path):
+    cache = PassCache(str(tmp_path))
+    keys = {
+        cache.key("input", "pass"),
+        cache.key("input", "other pass"),
+        cache.key("other input", "pass"),
+        cache.scoped("plugin", "1.0").key("input", "pass"),
+        cache.scoped("plugin", "1.1").key("input", "pass"),
+    }
+    assert len(keys) == 5
+    assert cache.scoped("plugin", "1.0").key("input", "pass") == cache.scoped("plugin", "1.0").key("input", "pass")
+
+
+def test_pass_cache_evicts_least_recently_used(tmp_path):
+    cache = PassCache(str(tmp_path), max_size=1400)
+    keys = [cache.key(str(i), "pass") for i in range(3)]
+    for i, key in enumerate(keys[:2]):
+        cache.put(key, os.urandom(500).hex())
+        os.utime(cache._path(key), (i, i))
+    cache.get(keys[0])
+    cache.put(keys[2], os.urandom(500).hex())
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) is not None
+    assert cache.get(keys[2]) is not None
+    assert cache.stats.evictions == 1
+
+
+def test_pass_cache_only_scans_directory_when_estimate_is_too_large(tmp_path, monkeypatch):
+    cache = PassCache(str(tmp_path), max_size=1400).scoped("plugin")
+    walks = []
+    walk = os.walk
+    monkeypatch.setattr(os, "walk", lambda top: walks.append(top) or walk(top))
+    for i in range(2):
+        cache.put(cache.key(str(i), "pass"), os.urandom(500).hex())
+    assert len(walks) == 1
+    cache.put(cache.key("2", "pass"), os.urandom(500).hex())
+    assert len(walks) == 2
+    assert cache.stats.evictions == 1
+    assert sum(f.stat().st_size for f in tmp_path.glob("*/*")) <= 1400 * 0.9
+
+
+def test_parse_uses_pass_cache_for_cacheable_passes(tmp_path):
+    calls = []
+
+    def record(name: str, result: str):
+        def apply(text: str, _: ParserContext) -> str:
+            calls.append(name)
+            return result
+        return apply
+    passes = [Parser("First", record("First", "first")), Parser("Side effect", record("Side effect", "side"), cacheable=False),
+              Parser("Last", record("Last", "last"))]
+    context = ParserContext(pass_cache=PassCache(str(tmp_path)))
+    assert parse("text", passes, parser_context=context) == "last"
+    assert parse("text", passes, parser_context=context) == "last"
+    assert calls == ["First", "Side effect", "Last", "Side effect"]
+    assert context.pass_cache.stats == CacheStats(hits=2, misses=2)
@@ -0,0 +1,144 @@
+#  Copyright (c) 2024. American Printing House for the Blind.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+import asyncio
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from brf2ebrl import convert, convert_async
+from brf2ebrl.parser import Parser, ParserException, ParserContext
+from brf2ebrl.plugin import Bundler, create_plugin
+
+
+class _RecordingBundler(Bundler):
+    written: dict[str, list] = {}
+
+    def __init__(self, name: str, *args, **kwargs):
+        self._entries = _RecordingBundler.written.setdefault(name, [])
+
+    def write_file(self, name: str, path: Path, add_to_spine: bool):
+        self._entries.append((name, path.read_bytes(), add_to_spine))
+
+    def write_str(self, name: str, data: str, add_to_spine: bool):
+        self._entries.append((name, data, add_to_spine))
+
+    def close(self):
+        pass
+
+
+def _upper_case(text: str, _: ParserContext) -> str:
+    return text.upper()
+
+
+def _fail_on_error(text: str, _: ParserContext) -> str:
+    if "error" in text:
+        raise ValueError("Found an error")
+    return text
+
+
+def _create_parser(**kwargs) -> list[Parser]:
+    return [Parser("Fail on error", _fail_on_error), Parser("Upper case", _upper_case)]
+
+
+def _map_file(input_file: str, index: int) -> str:
+    return f"vol{index}.html"
+
+
+class _VolumeBundler(_RecordingBundler):
+    """A bundler written against the original two argument write_volume."""
+
+    def write_volume(self, name: str, data: str):
+        assert isinstance(data, str)
+        self._entries.append((name, data, "volume"))
+
+
+_PLUGIN = create_plugin("test", "Test plugin", _create_parser, _map_file, _RecordingBundler)
+_VOLUME_PLUGIN = create_plugin("volume", "Volume plugin", _create_parser, _map_file, _VolumeBundler)
+_WAITING = threading.Event()
+
+
+def _wait_until_cancelled(text: str, parser_context: ParserContext) -> str:
+    _WAITING.set()
+    while True:
+        parser_context.check_cancelled()
+        time.sleep(0.01)
+
+
+_WAITING_PLUGIN = create_plugin("waiting", "Waiting plugin", lambda **kwargs: [Parser("Wait", _wait_until_cancelled)],
+                                _map_file, _RecordingBundler)
+
+
+@pytest.fixture
+def volumes(tmp_path):
+    paths = []
+    for index in range(4):
+        path = tmp_path / f"vol{index}.brf"
+        path.write_text(f"volume {index}", encoding="utf-8")
+        paths.append(str(path))
+    return paths
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_convert_writes_volumes_in_order(volumes, jobs):
+    progress = []
+    convert(_PLUGIN, volumes, f"out{jobs}", progress_callback=lambda i, p: progress.append((i, p)), jobs=jobs)
+    assert _RecordingBundler.written.pop(f"out{jobs}") == [
+        (f"vol{index}.html", f"VOLUME {index}", True) for index in range(len(volumes))
+    ]
+    assert sorted(progress) == [(index, p) for index in range(len(volumes)) for p in (0.0, 0.5)]
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_convert_writes_volumes_to_bundler_overriding_write_volume(volumes, jobs):
+    convert(_VOLUME_PLUGIN, volumes, f"volume{jobs}", jobs=jobs)
+    assert _RecordingBundler.written.pop(f"volume{jobs}") == [
+        (f"vol{index}.html", f"VOLUME {index}", "volume") for index in range(len(volumes))
+    ]
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_convert_reports_parser_exception(volumes, jobs):
+    Path(volumes[1]).write_text("an error", encoding="utf-8")
+    with pytest.raises(ParserException) as exc_info:
+        convert(_PLUGIN, volumes, f"error{jobs}", jobs=jobs)
+    assert exc_info.value.file_name == volumes[1]
+    assert exc_info.value.text == "an error"
+    entries = _RecordingBundler.written.pop(f"error{jobs}")
+    assert entries == [("vol0.html", "VOLUME 0", True), ("errors/vol1.html", "an error", False)]
+
+
+def test_convert_async_reports_progress(volumes):
+    async def run_conversion():
+        conversion = convert_async(_PLUGIN, volumes, "async")
+        progress = [p async for p in conversion]
+        await conversion
+        # The progress has been given, so iterating again ends at once.
+        assert [p async for p in conversion] == []
+        return progress
+    progress = asyncio.run(run_conversion())
+    assert _RecordingBundler.written.pop("async") == [
+        (f"vol{index}.html", f"VOLUME {index}", True) for index in range(len(volumes))
+    ]
+    assert progress == [(index, p) for index in range(len(volumes)) for p in (0.0, 0.5)]
+
+
+def test_convert_async_stops_when_task_cancelled(volumes):
+    async def run_conversion():
+        _WAITING.clear()
+        conversion = convert_async(_WAITING_PLUGIN, volumes, "cancelled")
+
+        async def wait_for_conversion():
+            await conversion
+        task = asyncio.create_task(wait_for_conversion())
+        assert await asyncio.get_running_loop().run_in_executor(None, _WAITING.wait, 10)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert conversion.done()
+    asyncio.run(run_conversion())
+    _RecordingBundler.written.pop("cancelled")
@@ -4,11 +4,13 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
+import string
+
 import pytest
 
 from brf2ebrl import ParserContext
 from brf2ebrl.common.detectors import convert_ascii_to_unicode_braille, \
-    translate_ascii_to_unicode_braille
+    translate_ascii_to_unicode_braille, INGEST_BRF_PARSER
 from brf2ebrl.common.selectors import most_confident_detector
 from brf2ebrl.parser import DetectionResult, parse, detector_parser, Parser
 
@@ -41,4 +43,19 @@ def test_convert_ascii_to_unicode_braille(text: str, cursor: int, expected_text:
     "TEST\nDOCU;mT\f"
 ])
 def test_conversion_by_character_vs_bulk(text: str):
-    assert parse(text, [Parser("Test conversion bulk", translate_ascii_to_unicode_braille)]) == parse(text, [detector_parser("Test convert by character", {}, [convert_ascii_to_unicode_braille], most_confident_detector)])
\ No newline at end of file
+    assert parse(text, [Parser("Test conversion bulk", translate_ascii_to_unicode_braille)]) == parse(text, [detector_parser("Test convert by character", {}, [convert_ascii_to_unicode_braille], most_confident_detector)])
+
+
+@pytest.mark.parametrize("text", [
+    "SOME TEXT",
+    "some text\r\n\tmore\x0b\x0c",
+    "".join(chr(x) for x in range(0x300)),
+    "\u2801 \x00TEST\x7f\ufeffDOCU;mT\f",
+])
+def test_ingest_same_as_separate_passes(text: str):
+    separate_passes = [
+        Parser("Filter", lambda x, _: "".join(c for c in x if c in string.printable)),
+        Parser("Uppercase", lambda x, _: x.upper()),
+        Parser("Convert", translate_ascii_to_unicode_braille),
+    ]
+    assert parse(text, [INGEST_BRF_PARSER]) == parse(text, separate_passes)
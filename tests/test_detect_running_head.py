@@ -0,0 +1,31 @@
+#  Copyright (c) 2024. American Printing House for the Blind.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import pytest
+
+from brf2ebrl.common.detectors import combine_detectors, braille_page_counter_detector, \
+    create_running_head_detector, detect_and_pass_processing_instructions
+from brf2ebrl.common.selectors import early_exit_most_confident_fragment
+from brf2ebrl.parser import parse, fragment_parser
+
+
+def _create_running_head_pass():
+    return fragment_parser("Detect running head", {}, [
+        combine_detectors([braille_page_counter_detector, create_running_head_detector(3)]),
+        detect_and_pass_processing_instructions,
+    ], early_exit_most_confident_fragment)
+
+
+@pytest.mark.parametrize("text,expected", [
+    ("<?braille-page ⠼⠁?>\n⠀⠀⠀⠀⠓⠑⠁⠙\n⠞⠑⠭⠞\n<?braille-page ⠼⠃?>\n⠀⠀⠀⠀⠓⠑⠁⠙\n⠞⠑⠭⠞\n",
+     "<?braille-page ⠼⠁?>\n⠀⠀⠀⠀⠓⠑⠁⠙\n⠞⠑⠭⠞\n<?braille-page ⠼⠃?>\n<?running-head ⠓⠑⠁⠙?>\n⠞⠑⠭⠞\n"),
+    ("<?braille-page ⠼⠁?>\n⠞⠑⠭⠞\n<?braille-page ⠼⠃?>\n⠞⠑⠭⠞\n<?print-page ⠼⠉?>\n⠀⠀⠀⠀⠝⠕⠞\n",
+     "<?braille-page ⠼⠁?>\n⠞⠑⠭⠞\n<?braille-page ⠼⠃?>\n⠞⠑⠭⠞\n<?print-page ⠼⠉?>\n⠀⠀⠀⠀⠝⠕⠞\n"),
+    ("⠀⠀⠀⠀⠝⠕⠞\n<?braille-page ⠼⠁?>\n<?braille-page ⠼⠃?>\n⠀⠀⠀⠀⠓⠑⠁⠙\f",
+     "⠀⠀⠀⠀⠝⠕⠞\n<?braille-page ⠼⠁?>\n<?braille-page ⠼⠃?>\n<?running-head ⠓⠑⠁⠙?>\f"),
+])
+def test_detect_running_head(text: str, expected: str):
+    assert parse(text, [_create_running_head_pass()]) == expected
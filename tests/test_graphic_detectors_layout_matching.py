@@ -1,6 +1,10 @@
+import random
+
 from brf2ebrl.common import PageLayout, PageNumberPosition
 from brf2ebrl.common.detectors import _ASCII_TO_UNICODE_DICT
 from brf2ebrl.common.graphic_detectors import (
+    _PpnMatcher,
+    _build_ppn_variation_map,
     _find_matching_ppn_in_positioned_words,
     find_matching_ppn_in_blocks,
 )
@@ -69,3 +73,27 @@ def test_text_block_matching_still_matches_known_ppn():
     match = find_matching_ppn_in_blocks(blocks, [expected])
 
     assert match == expected
+
+
+def _find_matching_ppn_in_blocks_by_substring(text_blocks, braille_ppns_list):
+    variation_map = _build_ppn_variation_map(braille_ppns_list)
+    for block_text in text_blocks:
+        block_text_clean = block_text.strip().lower()
+        if block_text_clean in variation_map:
+            return variation_map[block_text_clean]
+        for candidate_variation, original_ppn in variation_map.items():
+            if candidate_variation in block_text_clean:
+                return original_ppn
+    return None
+
+
+def test_ppn_matcher_finds_same_ppn_as_substring_search():
+    rng = random.Random(0)
+    pieces = ["#a", "#b", "#aj", "#j", "-", "-#b", "a", "b", "p", ",,iv", " ", "x"]
+    for _ in range(500):
+        ppns = [_to_unicode_braille("".join(rng.choices(pieces[:9], k=rng.randint(1, 4))))
+                for _ in range(rng.randint(1, 12))]
+        blocks = ["".join(rng.choices(pieces, k=rng.randint(0, 8))) for _ in range(rng.randint(1, 4))]
+        expected = _find_matching_ppn_in_blocks_by_substring(blocks, ppns)
+        assert find_matching_ppn_in_blocks(blocks, ppns) == expected
+        assert find_matching_ppn_in_blocks(blocks, _PpnMatcher(ppns)) == expected
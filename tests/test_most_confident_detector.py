@@ -4,10 +4,60 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
-from brf2ebrl.common.selectors import most_confident_detector
-from brf2ebrl.parser import DetectionResult
+import pytest
 
+from brf2ebrl.common.selectors import most_confident_detector, most_confident_fragment, \
+    early_exit_most_confident_detector, early_exit_most_confident_fragment
+from brf2ebrl.parser import DetectionResult, detector_hints
 
-def test_select_most_confident_detector():
+
+@pytest.mark.parametrize("selector", [most_confident_detector, early_exit_most_confident_detector])
+def test_select_most_confident_detector(selector):
     detectors = [lambda text, cursor, state, output_text: DetectionResult(cursor + 4, state, 0.2, output_text + "d"), lambda text, cursor, state, output_text: DetectionResult(cursor + 1, state, 0.9, output_text + "a"), lambda text, cursor, state, output_text: DetectionResult(cursor + 2, state, 0.6, output_text + "b"), lambda text, cursor, state, output_text: DetectionResult(cursor + 3, state, 0.3, output_text + "c")]
-    assert most_confident_detector("TEST BRF", 0, {}, "", detectors) == DetectionResult(1, {}, 0.9, "a")
\ No newline at end of file
+    assert selector("TEST BRF", 0, {}, "", detectors) == DetectionResult(1, {}, 0.9, "a")
+
+
+@pytest.mark.parametrize("selector", [most_confident_detector, early_exit_most_confident_detector])
+def test_default_when_no_detector_matches(selector):
+    assert selector("TEST BRF", 0, {}, "", [lambda text, cursor, state, output_text: None]) == DetectionResult(1, {}, 0.0, "T")
+
+
+@pytest.mark.parametrize("selector", [most_confident_fragment, early_exit_most_confident_fragment])
+def test_select_most_confident_fragment(selector):
+    detectors = [lambda text, cursor, state: DetectionResult(cursor + 4, state, 0.2, "d"), lambda text, cursor, state: None, lambda text, cursor, state: DetectionResult(cursor + 2, state, 0.6, "b")]
+    assert selector("TEST BRF", 0, {}, detectors) == DetectionResult(2, {}, 0.6, "b")
+
+
+@pytest.mark.parametrize("selector", [most_confident_fragment, early_exit_most_confident_fragment])
+def test_no_fragment_selected_when_no_detector_matches(selector):
+    assert selector("TEST BRF", 0, {}, [lambda text, cursor, state: None]) is None
+
+
+def _create_fragment_detector(confidence: float, fragment: str, calls: list[str]):
+    @detector_hints(max_confidence=confidence)
+    def detect(text: str, cursor: int, state):
+        calls.append(fragment)
+        return DetectionResult(cursor + 1, state, confidence, fragment)
+    return detect
+
+
+@pytest.mark.parametrize("selector", [most_confident_fragment, early_exit_most_confident_fragment])
+def test_first_most_confident_fragment_selected_on_tie(selector):
+    detectors = [_create_fragment_detector(0.5, "a", []), _create_fragment_detector(0.9, "b", []), _create_fragment_detector(0.9, "c", [])]
+    assert selector("TEST BRF", 0, {}, detectors).text == "b"
+
+
+def test_early_exit_stops_when_no_detector_can_be_selected():
+    calls = []
+    detectors = [_create_fragment_detector(0.4, "a", calls), _create_fragment_detector(0.9, "b", calls), _create_fragment_detector(1.0, "c", calls), _create_fragment_detector(0.9, "d", calls)]
+    assert early_exit_most_confident_fragment("TEST BRF", 0, {}, detectors).text == "c"
+    assert calls == ["c"]
+
+
+def test_early_exit_selectors_bound_to_detectors_select_the_same():
+    calls = []
+    detectors = [_create_fragment_detector(0.4, "a", calls), _create_fragment_detector(1.0, "c", calls)]
+    assert early_exit_most_confident_fragment.bind_detectors(detectors)("TEST BRF", 0, {}).text == "c"
+    assert calls == ["c"]
+    select = early_exit_most_confident_detector.bind_detectors([lambda text, cursor, state, output_text: None])
+    assert select("TEST BRF", 0, {}, "") == DetectionResult(1, {}, 0.0, "T")
@@ -7,7 +7,10 @@
 from collections.abc import Iterable
 
 import pytest
-from brf2ebrl.parser import parse, detector_parser, Detector, DetectionResult, DetectionSelector, DetectionState
+from brf2ebrl.common.selectors import most_confident_fragment
+from brf2ebrl.parser import parse, detector_parser, Detector, DetectionResult, DetectionSelector, DetectionState, \
+    fragment_parser, fragment_detector, detector_hints, get_detector_hints, merge_detector_hints, DetectorHints, \
+    Parser, ParserContext, ParserException, parse_chunks, replace_parser
 
 
 def _remove_detector(_: str, cursor: int, state: DetectionState, output_text: str) -> DetectionResult:
@@ -24,3 +27,116 @@ def _first_detector_selector(text: str, cursor: int, state: DetectionState, outp
 ])
 def test_single_pass_parser(input_text: str, initial_state: DetectionState, detectors: Iterable[Detector], selector: DetectionSelector, expected_text: str):
     assert parse(input_text, [detector_parser("Test single pass", initial_state, detectors, selector)]) == expected_text
+
+
+
+@pytest.mark.parametrize("input_text,detectors,expected_text", [
+    ("TEST BRF", [lambda text, cursor, state: DetectionResult(cursor + 1, state, 1.0, text[cursor] * 2)], "TTEESSTT  BBRRFF"),
+    ("TEST BRF", [lambda text, cursor, state: DetectionResult(cursor + 2, state, 1.0, "X") if text.startswith("ES", cursor) else None], "TXT BRF"),
+    ("TEST BRF", [fragment_detector(lambda text, cursor, state, output_text: DetectionResult(cursor + 1, state, 1.0, output_text + text[cursor].lower()))], "test brf"),
+])
+def test_fragment_parser(input_text: str, detectors, expected_text: str):
+    assert parse(input_text, [fragment_parser("Test fragment pass", {}, detectors, most_confident_fragment)]) == expected_text
+
+
+def test_detectors_only_called_where_hints_allow():
+    calls = []
+
+    @detector_hints(line_start_only=True, first_chars="A")
+    def detect_line_start_a(text: str, cursor: int, state: DetectionState) -> DetectionResult | None:
+        calls.append(cursor)
+        return DetectionResult(cursor + 1, state, 1.0, "a") if text[cursor] == "A" else None
+
+    result = parse("ABA\nAB\nBA", [fragment_parser("Test hints", {}, [detect_line_start_a], most_confident_fragment)])
+    assert result == "aBA\naB\nBA"
+    assert calls == [0, 4]
+
+
+def test_merge_detector_hints():
+    assert merge_detector_hints([DetectorHints(True, frozenset("A")), DetectorHints(True, frozenset("B"))]) == DetectorHints(True, frozenset("AB"))
+    assert merge_detector_hints([DetectorHints(True, frozenset("A")), DetectorHints()]) == DetectorHints()
+    assert get_detector_hints(fragment_detector(detector_hints(first_chars="<")(lambda text, cursor, state, output_text: None))) == DetectorHints(first_chars=frozenset("<"))
+
+
+def test_parser_skips_to_next_possible_match():
+    calls = []
+
+    def next_b(text: str, cursor: int, state: DetectionState) -> int:
+        index = text.find("B", cursor + 1)
+        return index if index >= 0 else len(text)
+
+    @detector_hints(next_match=next_b)
+    def detect_b(text: str, cursor: int, state: DetectionState) -> DetectionResult | None:
+        calls.append(cursor)
+        return DetectionResult(cursor + 1, state, 1.0, "b") if text[cursor] == "B" else None
+
+    @detector_hints(first_chars="<")
+    def detect_lt(text: str, cursor: int, state: DetectionState) -> DetectionResult | None:
+        calls.append(cursor)
+        return DetectionResult(cursor + 1, state, 1.0, "&lt;")
+
+    result = parse("AAABAA<AAB", [fragment_parser("Test skip", {}, [detect_b, detect_lt], most_confident_fragment)])
+    assert result == "AAAbAA&lt;AAb"
+    assert calls == [0, 3, 4, 6, 6, 7, 9]
+
+
+def test_parse_reports_pass_metrics():
+    metrics = []
+    passes = [Parser("Double", lambda text, _: text * 2), Parser("First half", lambda text, _: text[:len(text) // 2])]
+    assert parse("TEST", passes, parser_context=ParserContext(metrics=metrics.append), volume="vol1.brf") == "TEST"
+    assert [(m.volume, m.pass_index, m.pass_name, m.input_length, m.output_length) for m in metrics] == [
+        ("vol1.brf", 0, "Double", 4, 8), ("vol1.brf", 1, "First half", 8, 4)]
+    assert all(m.wall_time >= 0 and m.cpu_time >= 0 for m in metrics)
+
+
+def test_detector_metrics_reported_when_enabled():
+    reported = []
+
+    @detector_hints(first_chars="E")
+    def detect_e(text: str, cursor: int, state: DetectionState) -> DetectionResult | None:
+        return DetectionResult(cursor + 1, state, 0.5, "e")
+
+    def detect_t(text: str, cursor: int, state: DetectionState) -> DetectionResult | None:
+        return DetectionResult(cursor + 1, state, 1.0, "t") if text[cursor] == "T" else None
+
+    passes = [fragment_parser("Test metrics", {}, [detect_e, detect_t], most_confident_fragment)]
+    assert parse("TEST", passes, parser_context=ParserContext(detector_metrics=lambda name, metrics: reported.append((name, metrics)))) == "teSt"
+    assert [(name, [(m.name, m.calls, m.results, m.wins) for m in metrics]) for name, metrics in reported] == [
+        ("Test metrics", [("0:detect_e", 1, 1, 1), ("1:detect_t", 4, 2, 2)])]
+
+
+@pytest.mark.parametrize("chunks", [["<?a?>", "b<", "?c?", ">d<?"], ["<", "?", "?", ">"], ["<?a?><?b?>"], [""]])
+def test_replace_parser_chunks_match_text(chunks: list[str]):
+    parser = replace_parser("Test replace", [("<?", "<!--"), ("?>", "-->")])
+    text = "".join(chunks)
+    assert "".join(parser.parse_chunks(chunks, ParserContext())) == parser.parse(text, ParserContext())
+
+
+def test_replace_parser_rejects_overlapping_strings():
+    with pytest.raises(ValueError):
+        replace_parser("Test replace", [("aa", "b")])
+
+
+def test_parse_chunks_streams_trailing_passes():
+    metrics = []
+    passes = [Parser("Double", lambda text, _: text * 2), replace_parser("Replace", [("ST", "X")]),
+              replace_parser("Lower", [("X", "x")])]
+    chunks = parse_chunks("TEST", passes, parser_context=ParserContext(metrics=metrics.append))
+    assert [m.pass_name for m in metrics] == ["Double"]
+    assert "".join(chunks) == parse("TEST", passes) == "TExTEx"
+    assert [(m.pass_name, m.input_length, m.output_length) for m in metrics] == [
+        ("Double", 4, 8), ("Replace", 8, 6), ("Lower", 6, 6)]
+
+
+def test_parse_chunks_problem_gives_input_of_streamed_passes():
+    def fail_on_x(chunks, _):
+        for chunk in chunks:
+            if "X" in chunk:
+                raise ValueError("Found X")
+            yield chunk
+
+    passes = [Parser("Double", lambda text, _: text * 2), replace_parser("Replace", [("ST", "X")]),
+              Parser("Fail on X", lambda text, _: text, parse_chunks=fail_on_x)]
+    with pytest.raises(ParserException) as exc_info:
+        "".join(parse_chunks("TEST", passes))
+    assert exc_info.value.text == "TESTTEST"
@@ -0,0 +1,108 @@
+#  Copyright (c) 2024. American Printing House for the Blind.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+from zipfile import ZipFile
+
+import pdfplumber
+
+from brf2ebrl import convert
+from brf2ebrl.cache import PassCache
+from brf2ebrl.common.graphic_detectors import GraphicsSession, create_pdf_graphic_detector
+from brf2ebrl.parser import ParserContext, Parser, EBrailleParserOptions
+from brf2ebrl.plugin import create_plugin
+from brf2ebrl.utils.pdf import PdfPageIndex, analyse_pdf_pages
+
+
+def test_pdf_page_index_analyses_once_and_writes_requested_pages(tmp_path, write_text_pdf, monkeypatch):
+    write_text_pdf(tmp_path / "book.pdf", ["#a", "#b", "#c"])
+    opened = []
+    pdfplumber_open = pdfplumber.open
+    monkeypatch.setattr(pdfplumber, "open", lambda path, *args, **kwargs: opened.append(path) or pdfplumber_open(
+        path, *args, **kwargs))
+    index = PdfPageIndex()
+    pages = index.pages(str(tmp_path / "book.pdf"), str(tmp_path / "out"))
+    assert [(p.relative_path, p.pdf_counter, p.extract_text()) for p in pages] == [
+        ("images/book/1.pdf", 1, "#a"), ("images/book/2.pdf", 2, "#b"), ("images/book/3.pdf", 3, "#c")]
+    assert pages[0].extract_words()[0]["x0"] == 560
+    assert index.pages(str(tmp_path / "book.pdf"), str(tmp_path / "out")) is pages
+    assert len(opened) == 1
+    assert not (tmp_path / "out").exists()
+    index.write_page(pages[1])
+    assert [p.name for p in (tmp_path / "out/images/book").iterdir()] == ["2.pdf"]
+    with pdfplumber_open(tmp_path / "out/images/book/2.pdf") as pdf:
+        assert pdf.pages[0].extract_text() == "#b"
+
+
+def test_pdf_pages_analysed_in_pool_are_in_page_order(tmp_path, write_text_pdf):
+    write_text_pdf(tmp_path / "book.pdf", [f"#{i}" for i in range(30)])
+    pages = analyse_pdf_pages(str(tmp_path / "book.pdf"), str(tmp_path / "out"), workers=2)
+    assert pages == analyse_pdf_pages(str(tmp_path / "book.pdf"), str(tmp_path / "out"))
+    assert [p.extract_text() for p in pages] == [f"#{i}" for i in range(30)]
+
+
+def test_pdf_page_index_uses_cached_pages(tmp_path, write_text_pdf, monkeypatch):
+    write_text_pdf(tmp_path / "book.pdf", ["#a", "#b"])
+    cache = PassCache(str(tmp_path / "cache"))
+    pages = PdfPageIndex(cache=cache).pages(str(tmp_path / "book.pdf"), str(tmp_path / "out"))
+    monkeypatch.setattr(pdfplumber, "open", None)
+    assert PdfPageIndex(cache=cache).pages(str(tmp_path / "book.pdf"), str(tmp_path / "out")) == pages
+    assert (cache.stats.hits, cache.stats.misses) == (1, 1)
+
+
+def test_graphics_session_shares_pages_between_volume_detectors(tmp_path, write_text_pdf, monkeypatch):
+    write_text_pdf(tmp_path / "book.pdf", ["#a", "#b"])
+    opened = []
+    pdfplumber_open = pdfplumber.open
+    monkeypatch.setattr(pdfplumber, "open", lambda path, *args, **kwargs: opened.append(path) or pdfplumber_open(
+        path, *args, **kwargs))
+    session = GraphicsSession()
+    detectors = [create_pdf_graphic_detector(str(tmp_path / f"vol{i}.brf"), str(tmp_path / "out" / f"vol{i}.html"),
+                                             str(tmp_path / "book.pdf"), session=session) for i in range(2)]
+    # Volumes are parsed out of order, each detector keeps the references of its own volume.
+    second = detectors[1]("<?braille-ppn ⠼⠃?>\n⠃\n", ParserContext())
+    first = detectors[0]("<?braille-ppn ⠼⠁?>\n⠁\n", ParserContext())
+    assert 'data="images/book/1.pdf"' in first and "2.pdf" not in first
+    assert 'data="images/book/2.pdf"' in second and "1.pdf" not in second
+    assert len(opened) == 1
+
+
+def _to_html(text: str, _: ParserContext) -> str:
+    return f"<html><body><p>{text}</p></body></html>"
+
+
+def _create_graphics_parser(brf_path: str, output_path: str, images_path: str, graphics_session: GraphicsSession,
+                            **kwargs) -> list[Parser]:
+    return [Parser("Graphics", create_pdf_graphic_detector(brf_path, output_path, images_path,
+                                                           session=graphics_session)), Parser("To HTML", _to_html)]
+
+
+def _map_file(input_file: str, index: int) -> str:
+    return f"vol{index}.html"
+
+
+_GRAPHICS_PLUGIN = create_plugin("graphics", "Graphics plugin", _create_graphics_parser, _map_file)
+
+
+def test_pool_workers_use_pdf_pages_analysed_for_conversion(tmp_path, write_text_pdf, monkeypatch):
+    write_text_pdf(tmp_path / "book.pdf", ["#a", "#b"])
+    volumes = []
+    for i, ppn in enumerate(["⠼⠁", "⠼⠃"]):
+        (tmp_path / f"vol{i}.brf").write_text(f"<?braille-ppn {ppn}?>\n⠁\n", encoding="utf-8")
+        volumes.append(str(tmp_path / f"vol{i}.brf"))
+    opened = tmp_path / "opened.txt"
+    pdfplumber_open = pdfplumber.open
+
+    def record_open(path, *args, **kwargs):
+        # Worker processes are forked with this patch, so record the opens in a file they all append to.
+        with open(opened, "a", encoding="utf-8") as opened_file:
+            opened_file.write(f"{path}\n")
+        return pdfplumber_open(path, *args, **kwargs)
+    monkeypatch.setattr(pdfplumber, "open", record_open)
+    convert(_GRAPHICS_PLUGIN, volumes, str(tmp_path / "out.ebrl"), jobs=2, parser_context=ParserContext(
+        options={EBrailleParserOptions.images_path: str(tmp_path / "book.pdf")}))
+    assert opened.read_text(encoding="utf-8").splitlines() == [str(tmp_path / "book.pdf")]
+    with ZipFile(tmp_path / "out.ebrl") as zip_file:
+        assert b'data="images/book/2.pdf"' in zip_file.read("ebraille/vol1.html")
+        assert "ebraille/images/book/1.pdf" in zip_file.namelist()
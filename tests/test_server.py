@@ -0,0 +1,121 @@
+#  Copyright (c) 2024. American Printing House for the Blind.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+import base64
+import http.client
+import io
+import json
+import os
+import threading
+import time
+from zipfile import ZipFile
+
+import pytest
+
+from brf2ebrl.common import PageLayout, PageNumberPosition
+from brf2ebrl.parser import Parser, ParserContext
+from brf2ebrl.plugin import create_plugin
+from brf2ebrl.server import ConversionService, ConversionRequest, JobStatus, ServiceBusyException, create_server, \
+    parse_job
+
+_STARTED = threading.Event()
+
+
+def _to_html(text: str, context: ParserContext) -> str:
+    if "wait" in text:
+        _STARTED.set()
+        while True:
+            context.check_cancelled()
+            time.sleep(0.01)
+    page_layout = context.options["page_layout"]
+    return f"<html><body><p>{text.upper()} {page_layout.cells_per_line}</p></body></html>"
+
+
+_PLUGIN = create_plugin("test", "Test plugin", lambda **kwargs: [Parser("To HTML", _to_html)],
+                        lambda input_file, index: f"vol{index}.html")
+
+
+@pytest.fixture
+def service(tmp_path):
+    with ConversionService({_PLUGIN.id: _PLUGIN}, workers=1, max_queued=1, page_layouts={"standard": PageLayout()},
+                           work_dir=str(tmp_path)) as conversion_service:
+        yield conversion_service
+
+
+@pytest.fixture
+def client(service):
+    with create_server(service, ("127.0.0.1", 0), max_request_size=4096) as server:
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+
+        def request(method: str, path: str, body: dict | None = None) -> tuple[int, bytes]:
+            connection = http.client.HTTPConnection(*server.server_address)
+            connection.request(method, path, json.dumps(body) if body is not None else None)
+            response = connection.getresponse()
+            result = response.status, response.read()
+            connection.close()
+            return result
+        yield request
+        server.shutdown()
+
+
+def test_server_converts_uploaded_volumes(client):
+    volumes = [{"name": f"vol{i}.brf", "data": base64.b64encode(f"volume {i}".encode()).decode()} for i in range(2)]
+    status, body = client("POST", "/jobs?wait=1", {"parser": "test", "volumes": volumes,
+                                                   "page_layout": {"standard": "standard", "cells_per_line": 32}})
+    job = json.loads(body)
+    assert (status, job["status"], job["progress"], job["error"]) == (200, "done", 1.0, None)
+    status, bundle = client("GET", f"/jobs/{job['id']}/bundle")
+    assert status == 200
+    with ZipFile(io.BytesIO(bundle)) as zip_file:
+        assert b"<p>VOLUME 1 32</p>" in zip_file.read("ebraille/vol1.html")
+    assert client("DELETE", f"/jobs/{job['id']}")[0] == 200
+    assert client("GET", f"/jobs/{job['id']}")[0] == 404
+
+
+def test_server_rejects_invalid_jobs(client):
+    assert client("POST", "/jobs", {"parser": "missing", "brfs": ["a.brf"]})[0] == 400
+    assert client("POST", "/jobs", {"parser": "test", "volumes": [{"name": "a.brf", "data": "?"}]})[0] == 400
+    assert client("POST", "/jobs", {"parser": "test", "brfs": ["a.brf"], "page_layout": "missing"})[0] == 400
+
+
+def test_server_refuses_large_jobs(client):
+    volumes = [{"name": "a.brf", "data": base64.b64encode(b"a" * 4096).decode()}]
+    assert client("POST", "/jobs", {"parser": "test", "volumes": volumes})[0] == 413
+
+
+def test_service_cancels_running_job_and_limits_queue(service, tmp_path):
+    (tmp_path / "wait.brf").write_text("wait", encoding="utf-8")
+    _STARTED.clear()
+    running = service.submit(ConversionRequest(plugin_id="test", brfs=[str(tmp_path / "wait.brf")]))
+    assert _STARTED.wait(10)
+    queued = service.submit(ConversionRequest(plugin_id="test", uploads=[("a.brf", b"a")]))
+    with pytest.raises(ServiceBusyException):
+        service.submit(ConversionRequest(plugin_id="test", uploads=[("b.brf", b"b")]))
+    service.remove(running.id)
+    assert running.wait(10) and running.status == JobStatus.CANCELLED
+    assert queued.wait(10) and queued.status == JobStatus.DONE
+    assert queued.request.uploads == () and queued.request.brfs == [os.path.join(queued.work_dir, "a.brf")]
+
+
+def test_parse_job_reads_page_layout(service):
+    request = parse_job({"brfs": ["a.brf"], "page_layout": {"odd_print_page_number": "TOP_RIGHT"}}, service)
+    assert request.plugin_id == "test"
+    assert request.page_layout == PageLayout(odd_print_page_number=PageNumberPosition.TOP_RIGHT)
+
+
+def test_server_only_listens_on_other_addresses_when_allowed(service):
+    with pytest.raises(ValueError):
+        create_server(service, ("0.0.0.0", 0))
+    with create_server(service, ("0.0.0.0", 0), allow_remote=True) as server:
+        assert server.server_address[1] != 0
+
+
+def test_server_keeps_file_at_unix_socket_path(service, tmp_path):
+    path = tmp_path / "service.sock"
+    path.write_text("not a socket", encoding="utf-8")
+    with pytest.raises(FileExistsError):
+        create_server(service, str(path))
+    assert path.read_text(encoding="utf-8") == "not a socket"
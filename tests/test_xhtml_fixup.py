@@ -0,0 +1,28 @@
+#  Copyright (c) 2024. American Printing House for the Blind.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+from brf2ebrl.common.detectors import xhtml_fixup_detector, xhtml_fixup_chunks
+from brf2ebrl.parser import ParserContext
+from brf2ebrl.utils.ebrl import VolumeNavigation, HeadingRef, PageRef
+
+
+def test_xhtml_fixup_reports_navigation():
+    navigation = []
+    text = xhtml_fixup_detector(
+        '<h1>⠁⠀⠃</h1><p>⠉<span role="doc-pagebreak">⠼⠁</span></p><h2 id="custom">⠙</h2><h2>⠑</h2>',
+        ParserContext(navigation=navigation.append))
+    assert navigation == [VolumeNavigation(
+        title="⠁⠀⠃",
+        heading_refs=(HeadingRef(href="#h_1", heading_braille="⠁⠀⠃", level=1),
+                      HeadingRef(href="#custom", heading_braille="⠙", level=2),
+                      HeadingRef(href="#h_2", heading_braille="⠑", level=2)),
+        page_refs=(PageRef(href="#page_1", title="", page_num_braille="⠼⠁"),),
+    )]
+    assert 'id="h_2"' in text and 'id="page_1"' in text
+
+
+def test_xhtml_fixup_chunks_match_text():
+    text = 'before <h1>⠁ &amp; ⠃</h1><?braille-page ⠼⠁?><p>⠉<span role="doc-pagebreak">⠼⠁</span></p> after'
+    assert "".join(xhtml_fixup_chunks([text], ParserContext())) == xhtml_fixup_detector(text, ParserContext())
@@ -0,0 +1,76 @@
+#  Copyright (c) 2024. American Printing House for the Blind.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+import os
+import sys
+from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED, ZIP_STORED
+
+import pytest
+
+from brf2ebrl.utils import zip as parallel_zip
+from brf2ebrl.utils.zip import ParallelZipWriter
+
+
+@pytest.mark.parametrize("max_pending", [1, None])
+def test_parallel_zip_writer_writes_entries_in_order(tmp_path, max_pending):
+    entries = [(f"file{i}.txt", ZIP_DEFLATED if i % 3 else ZIP_STORED, (f"entry {i} ⠁" * i * 100).encode("utf-8"))
+               for i in range(20)]
+    entries.append(("random.bin", ZIP_DEFLATED, os.urandom(100_000)))
+    with ZipFile(tmp_path / "test.zip", "w") as zip_file:
+        zip_file.writestr("first", b"written directly")
+        writer = ParallelZipWriter(zip_file, max_workers=4, max_pending=max_pending)
+        for name, compress_type, data in entries:
+            zinfo = ZipInfo(name)
+            zinfo.compress_type = compress_type
+            writer.write(zinfo, data)
+        writer.close()
+        zip_file.writestr("last", b"written directly")
+    with ZipFile(tmp_path / "test.zip") as zip_file:
+        assert zip_file.testzip() is None
+        assert zip_file.namelist() == ["first", *(name for name, _, _ in entries), "last"]
+        for name, compress_type, data in entries:
+            assert zip_file.getinfo(name).compress_type == compress_type
+            assert zip_file.read(name) == data
+
+
+def _write_entries(path, writer_class) -> bytes:
+    with ZipFile(path, "w") as zip_file:
+        writer = writer_class(zip_file)
+        for i in range(10):
+            zinfo = ZipInfo(f"file{i}.txt", date_time=(2024, 1, 1, 0, 0, 0))
+            zinfo.compress_type = ZIP_DEFLATED if i % 2 else ZIP_STORED
+            writer.write(zinfo, (f"entry {i} ⠁" * i * 100).encode("utf-8"), level=6)
+        writer.close()
+    return path.read_bytes()
+
+
+class _WriteStr:
+    def __init__(self, zip_file: ZipFile):
+        self._zip_file = zip_file
+
+    def write(self, zinfo: ZipInfo, data: bytes, level: int):
+        self._zip_file.writestr(zinfo, data, compresslevel=level)
+
+    def close(self):
+        pass
+
+
+def test_parallel_zip_writer_matches_writestr(tmp_path):
+    # Whether or not entries are written raw on this version, the archive is the same as one written with writestr.
+    assert _write_entries(tmp_path / "parallel.zip", ParallelZipWriter) == \
+           _write_entries(tmp_path / "writestr.zip", _WriteStr)
+
+
+@pytest.mark.skipif(sys.version_info[:2] not in parallel_zip._RAW_WRITE_VERSIONS,
+                    reason="ZipFile internals not checked against this version")
+def test_parallel_zip_writer_writes_raw_on_checked_versions(tmp_path):
+    with ZipFile(tmp_path / "check.zip", "w") as zip_file:
+        assert parallel_zip._can_write_raw(zip_file)
+
+
+def test_parallel_zip_writer_uses_writestr_on_other_versions(tmp_path, monkeypatch):
+    monkeypatch.setattr(parallel_zip, "_RAW_WRITE_VERSIONS", set())
+    assert _write_entries(tmp_path / "fallback.zip", ParallelZipWriter) == \
+           _write_entries(tmp_path / "writestr.zip", _WriteStr)